@@ -0,0 +1,225 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Times the stages of a diff on a pair of synthetic decks (see nastrandiff.synthetic.SyntheticDecks) and saves the
+results as JSON, so that runs can be compared to find performance regressions.
+
+    python benchmarks/suite.py --cards 1000000 --output results.json
+    python benchmarks/suite.py --cards 1000000 --compare results.json
+
+Each stage is timed (--repeat times, keeping the shortest time), then run again under tracemalloc to find the peak
+memory that it allocates. The decks are generated in a temporary directory unless --deck-dir is given; generated decks
+are reused if the parameters match.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nastrandiff  # noqa: E402
+import nastrandiff.synthetic  # noqa: E402
+
+RESULTS_VERSION = 1
+
+
+def read_deck_lines(file_name: str) -> (list, list, list):
+    with open(file_name) as f:
+        exec_lines = list(nastrandiff.NastranDiff.read_file(f, "CEND"))
+        case_lines = list(nastrandiff.NastranDiff.read_file(f, "BEGIN BULK"))
+        bulk_lines = list(nastrandiff.NastranDiff.read_file(f, "ENDDATA"))
+    return exec_lines, case_lines, bulk_lines
+
+
+def measure(fn, memory: bool, repeat: int = 1) -> dict:
+    """
+    Returns the shortest time taken by repeat runs of fn and, if memory is True, the peak memory allocated by another
+    run of fn
+    """
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    result = dict(seconds=min(times))
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run(decks: (str, str), jobs: int, memory: bool, progress: bool, repeat: int = 1) -> dict:
+    """
+    Runs each stage on the decks, returning a dict mapping the name of each stage to its measurements
+    """
+    nd = nastrandiff.NastranDiff()
+    nd.jobs = jobs
+    state = {}
+
+    def read_file():
+        state["lines"] = [read_deck_lines(d) for d in decks]
+
+    def parse_bulk_data():
+        nastrandiff.NastranDiff.parse_bulk_data(state["lines"][0][2], jobs)
+
+    def compare_bulk():
+        state["diff"] = nd.compare_bulk(state["lines"][0][2], state["lines"][1][2])
+
+    def make_table_bulk():
+        nd.make_table_bulk(*state["diff"], from_desc="file1", to_desc="file2")
+
+    def calculate_diff():
+        nd.file1 = open(decks[0])
+        nd.file2 = open(decks[1])
+        nd.output = io.StringIO()
+        try:
+            nd.calculate_diff()
+        finally:
+            nd.file1.close()
+            nd.file2.close()
+            nd.output = None
+
+    stages = {}
+    for name, fn in (("read_file", read_file), ("parse_bulk_data", parse_bulk_data), ("compare_bulk", compare_bulk),
+                     ("make_table_bulk", make_table_bulk), ("calculate_diff", calculate_diff)):
+        if progress:
+            print("Running {}...".format(name))
+        stages[name] = measure(fn, memory, repeat)
+    return stages
+
+
+def generate(args) -> (str, str, dict):
+    """
+    Generates the decks (unless they already exist with the same parameters), returning their paths and a description
+    """
+    parameters = dict(cards=args.cards, seed=args.seed, changed_fraction=args.changed, depth=args.depth,
+                      fanout=args.fanout)
+    directory = os.path.join(args.deck_dir, "decks-{cards}-{seed}-{changed_fraction}-{depth}-{fanout}".format(
+        **parameters))
+    description_path = os.path.join(directory, "decks.json")
+    if os.path.exists(description_path):
+        with open(description_path) as f:
+            description = json.load(f)
+        if description["parameters"] == parameters:
+            return description["decks"][0], description["decks"][1], description
+
+    if args.progress:
+        print("Generating decks in {}...".format(directory))
+    generator = nastrandiff.synthetic.SyntheticDecks(args.cards, args.seed, args.changed, args.depth, args.fanout)
+    decks = generator.write(os.path.join(directory, "1"), os.path.join(directory, "2"))
+    files = [os.path.join(d, n) for d in (os.path.dirname(decks[0]), os.path.dirname(decks[1]))
+             for n in os.listdir(d)]
+    description = dict(parameters=parameters, decks=decks, changed=generator.n_changed, files=len(files) // 2,
+                       bytes=sum(os.path.getsize(f) for f in files) // 2)
+    with open(description_path, "w") as f:
+        json.dump(description, f, indent=2)
+    return decks[0], decks[1], description
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Prints the ratio of each measurement to the baseline. Returns False if any ratio is above threshold.
+    """
+    ok = True
+    print("{:<20}{:>12}{:>12}{:>8}".format("Stage", "Baseline", "Current", "Ratio"))
+    for stage, current in results["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            continue
+        for measurement, unit in (("seconds", "s"), ("peak_memory", "MB")):
+            if measurement not in current or measurement not in base:
+                continue
+            scale = 1. if unit == "s" else 1. / 1024 ** 2
+            ratio = current[measurement] / base[measurement] if base[measurement] > 0 else 1.
+            flag = "" if ratio <= threshold else "  REGRESSION"
+            ok = ok and ratio <= threshold
+            print("{:<20}{:>10.2f}{:<2}{:>10.2f}{:<2}{:>8.2f}{}".format(
+                stage if unit == "s" else "", base[measurement] * scale, unit, current[measurement] * scale, unit,
+                ratio, flag))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks NASTRAN-Diff on synthetic decks")
+    parser.add_argument("--cards", type=int, default=100000,
+                        help="the number of bulk data entries in each deck. Default: %(default)s")
+    parser.add_argument("--seed", type=int, default=0, help="the random seed. Default: %(default)s")
+    parser.add_argument("--changed", type=float, default=0.01,
+                        help="the fraction of entries that are different in the second deck. Default: %(default)s")
+    parser.add_argument("--depth", type=int, default=3,
+                        help="the depth of the tree of included files. Default: %(default)s")
+    parser.add_argument("--fanout", type=int, default=3,
+                        help="the number of files included by each included file that isn't a leaf. "
+                             "Default: %(default)s")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="the number of worker processes. Default: 1")
+    parser.add_argument("--deck-dir", default=os.path.join(tempfile.gettempdir(), "nastrandiff-benchmarks"),
+                        help="the directory where the decks are generated. Default: %(default)s")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="the number of times to time each stage (the shortest time is kept). Default: %(default)s")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="don't measure peak memory (which runs each stage a second time)")
+    parser.add_argument("--output", help="the JSON file where the results are saved")
+    parser.add_argument("--compare", help="a JSON file of earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="the ratio to the earlier results above which a measurement is reported as a regression "
+                             "(the exit code is then 1). Default: %(default)s")
+    parser.add_argument("--progress", action="store_true", help="display the progress of the benchmark")
+    args = parser.parse_args()
+
+    deck1, deck2, description = generate(args)
+    results = dict(version=RESULTS_VERSION,
+                   time=datetime.datetime.now().isoformat(),
+                   python=platform.python_version(),
+                   platform=platform.platform(),
+                   jobs=args.jobs,
+                   repeat=args.repeat,
+                   decks=description,
+                   stages=run((deck1, deck2), args.jobs, not args.no_memory, args.progress, args.repeat))
+    try:
+        import resource
+        # ru_maxrss is in kB on Linux (and bytes on macOS)
+        results["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:  # not available on Windows
+        pass
+
+    for stage, m in results["stages"].items():
+        print("{:<20}{:10.3f} s{}".format(stage, m["seconds"], "" if "peak_memory" not in m else
+                                          "{:10.1f} MB".format(m["peak_memory"] / 1024 ** 2)))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+A micro-benchmark of the bulk data tokenizer (nastrandiff.tokenizer). It times the line parsers against the
+implementation that they replaced, which is kept here for comparison, and checks that both give the same results.
+
+    python benchmarks/tokenizer.py [--lines N] [--repeat R]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nastrandiff import tokenizer  # noqa: E402
+
+
+def legacy_parse_field(field: str):
+    field = field.strip()
+    if re.match("[-+.0-9]", field):
+        if "." in field:
+            field = field.replace("D", "E")
+            p = re.compile("([.0-9])([-+])([0-9])")
+            field = p.sub("\\1E\\2\\3", field)
+            return float(field)
+        else:
+            return int(field)
+    else:
+        return field
+
+
+def legacy_parse_fixed_field_format_line(line: str) -> (str, list, bool):
+    bde_name = line[0:8]
+    if "*" in bde_name:
+        field_width = 16
+        bde_name = bde_name[0:bde_name.find("*")]
+    else:
+        field_width = 8
+    bde_name = bde_name.strip()
+    if "$" in line:
+        line = line.split("$")[0]
+    if len(line) < 72:
+        line += " " * (72 - len(line))
+    fields = [legacy_parse_field(line[i:i + field_width]) for i in range(8, min(len(line), 72), field_width)]
+    continuation = len(bde_name) == 0 or "+" in bde_name
+    return bde_name, fields, continuation
+
+
+def make_lines(n: int, seed: int = 1) -> list:
+    """
+    Returns n GRID and CQUAD4 lines in 8 character fixed-field format, with reals in the forms found in real decks
+    """
+    rnd = random.Random(seed)
+
+    def real():
+        v = rnd.uniform(-1000., 1000.)
+        return rnd.choice(["{:.3f}".format(v), "{:.2E}".format(v).replace("E", ""), "{:.1E}".format(v)])[:8]
+
+    lines = []
+    for i in range(n):
+        if i % 2 == 0:
+            fields = ["GRID", i + 1, "", real(), real(), real()]
+        else:
+            fields = ["CQUAD4", i, 1] + [rnd.randint(1, n) for _ in range(4)]
+        lines.append("".join("{:<8}".format(f) for f in fields).rstrip())
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the bulk data tokenizer")
+    parser.add_argument("--lines", type=int, default=100000, help="The number of lines to parse")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of times to time each parser (the best "
+                                                              "time is reported)")
+    args = parser.parse_args()
+
+    lines = make_lines(args.lines)
+    grids = [line for line in lines if line.startswith("GRID")]
+    if [legacy_parse_fixed_field_format_line(line) for line in lines] != \
+            [tokenizer.parse_fixed_field_format_line(line) for line in lines]:
+        sys.exit("The tokenizer doesn't give the same results as the legacy parser")
+    if list(tokenizer.parse_lines(lines)) != [tokenizer.parse_line(line) for line in lines]:
+        sys.exit("parse_lines doesn't give the same results as parse_line")
+
+    cases = [("legacy", lambda: [legacy_parse_fixed_field_format_line(line) for line in lines]),
+             ("parse_line", lambda: [tokenizer.parse_line(line) for line in lines]),
+             ("parse_lines", lambda: list(tokenizer.parse_lines(lines))),
+             ("legacy (GRID only)", lambda: [legacy_parse_fixed_field_format_line(line) for line in grids]),
+             ("parse_line (GRID only)", lambda: [tokenizer.parse_line(line) for line in grids]),
+             ("parse_fixed_field_lines (GRID only)", lambda: tokenizer.parse_fixed_field_lines(grids)),
+             ("parse_lines (GRID only)", lambda: list(tokenizer.parse_lines(grids)))]
+    times = {}
+    for name, fn in cases:
+        times[name] = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        n = len(grids) if "GRID" in name else len(lines)
+        print("{:<40}{:10.3f} s{:10.2f} us/line".format(name, times[name], times[name] / n * 1e6))
+    print("Speedup: {:.1f}x per line, {:.1f}x in batches".format(
+        times["legacy"] / times["parse_line"],
+        times["legacy (GRID only)"] / times["parse_fixed_field_lines (GRID only)"]))
+
+if __name__ == "__main__":
+    main()
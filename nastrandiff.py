@@ -18,32 +18,193 @@ __version__ = "1.0.0"
 import argparse
 import datetime
 import nastrandiff
+import nastrandiff.batch
+import nastrandiff.cache
+import nastrandiff.check
+import nastrandiff.columnar
+import nastrandiff.compare
+import nastrandiff.compressed
+import nastrandiff.metrics
+import nastrandiff.server
+import nastrandiff.snapshot
+import nastrandiff.structured
 import os
 import pathlib
 import sys
 import time
+import typing
 import webbrowser
 
+
+def deck_file(file_name: str) -> typing.TextIO:
+    """
+    Opens file1 or file2 like argparse.FileType('r'), decompressing the deck if it's compressed
+    """
+    if file_name == "-":
+        return argparse.FileType('r')(file_name)
+    try:
+        return nastrandiff.compressed.open_deck(file_name)
+    except OSError as e:
+        raise argparse.ArgumentTypeError("can't open '{}': {}".format(file_name, e))
+
+
+def output_file(file_name: str, output_format: str) -> typing.TextIO:
+    """
+    Opens the file where the report (or the differences in a structured format) is written, or returns standard output
+    for '-'
+    """
+    if file_name == "-":
+        return sys.stdout
+    # the csv module writes its own line endings
+    return open(file_name, "w", newline=None if output_format == "html" else "")
+
+
+def card_types(values: typing.Union[None, list]) -> typing.Union[None, set]:
+    """
+    Returns the card types given to --include-cards or --exclude-cards (each a comma-separated list), in upper case
+    """
+    if values is None:
+        return None
+    return set(name.strip().upper() for names in values for name in names.split(",") if name.strip())
+
+
+def exit_error(parser: argparse.ArgumentParser, e: Exception) -> None:
+    """
+    Exits with the message of a DeckError, or of an OSError reading the decks or writing the report, in the same form
+    as parser.error but without the usage
+    """
+    parser.exit(1, "{}: error: {}\n".format(parser.prog, e))
+
+
+def snapshot_command(argv: list) -> None:
+    """
+    Runs "nastrandiff.py snapshot", which writes a snapshot of a deck (see nastrandiff.snapshot)
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]) + " snapshot",
+                                     description="""Parses a NASTRAN input deck and writes it to a snapshot, which can
+                                     be given in place of the deck as either file of a diff (or --batch) and is read
+                                     much faster.""")
+    parser.add_argument("file", help="the deck, which may be compressed with gzip, bzip2 or xz")
+    parser.add_argument("-o", "--output",
+                        help="the snapshot file. Default: the name of the deck with the extension .ndsnap")
+    parser.add_argument("--include-threads", type=int, default=4, metavar="N",
+                        help="the number of threads reading INCLUDEd files ahead of the parser. Default: %(default)s")
+    parser.add_argument("--include-cards", action="append", metavar="NAME[,NAME...]",
+                        help="only store the bulk data entries of these card types. May be given more than once")
+    parser.add_argument("--exclude-cards", action="append", metavar="NAME[,NAME...]",
+                        help="don't store the bulk data entries of these card types. May be given more than once")
+    args = parser.parse_args(argv)
+    output = args.output
+    if output is None:
+        base = args.file
+        for suffix in nastrandiff.compressed.SUFFIXES:
+            if base.endswith(suffix):
+                base = base[:-len(suffix)]
+        output = os.path.splitext(base)[0] + ".ndsnap"
+    options = dict(memory_map=False, columnar_types=None, include_threads=args.include_threads,
+                   include_cards=card_types(args.include_cards), exclude_cards=card_types(args.exclude_cards))
+    try:
+        nastrandiff.snapshot.make_snapshot(args.file, output, options)
+    except (OSError, ValueError) as e:
+        parser.error("can't write a snapshot of '{}': {}".format(args.file, e))
+
+
 # If this file was called from the command line, respond to the arguments passed
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "snapshot":
+        snapshot_command(sys.argv[2:])
+        sys.exit(0)
+
     parser = argparse.ArgumentParser(description="""A utility program for determining the diff between two NASTRAN input
                                      decks. This program understands multi-file input decks that use the INCLUDE
-                                     directive.""")
-    parser.add_argument("file1", nargs="?", type=argparse.FileType('r'),
-                        help="first (left) file to diff")
-    parser.add_argument("file2", nargs="?", type=argparse.FileType('r'),
-                        help="second (right) file to diff")
-    parser.add_argument("--output", nargs="?", type=argparse.FileType('w'),
-                        help="the (html) file where the output should be directed. Default: diff-[current-time].html",
-                        default="diff-{}.html".format(datetime.datetime.now().strftime("%Y%m%d%H%M%S")))
+                                     directive. Run "%(prog)s snapshot -h" for how to write a snapshot of a deck, which
+                                     can be given as either file.""")
+    parser.add_argument("file1", nargs="?", type=deck_file,
+                        help="first (left) file to diff, which may be compressed with gzip, bzip2 or xz")
+    parser.add_argument("file2", nargs="?", type=deck_file,
+                        help="second (right) file to diff, which may be compressed with gzip, bzip2 or xz")
+    default_output = "diff-{}".format(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+    parser.add_argument("--output", nargs="?",
+                        help="the file where the output should be directed ('-' for standard output). Not used for a "
+                             "paginated HTML report (--report-dir), --batch, --check or --serve. "
+                             "Default: diff-[current-time].[format]")
+    parser.add_argument("--format", choices=("html",) + nastrandiff.structured.FORMATS, default="html",
+                        help="the format of the output: an HTML report, or one JSON object (jsonl) or CSV row (csv) "
+                             "for each difference. Default: %(default)s")
+    parser.add_argument("--batch", nargs="+", action="append", metavar="CANDIDATE",
+                        help="diff each of these files (or glob patterns, such as 'variants/*.bdf') against file1, "
+                             "writing a report for each and a summary to --report-dir (default: "
+                             "batch-[current-time])")
+    parser.add_argument("--abs-tol", type=float,
+                        help="the absolute tolerance used to compare real fields of bulk data entries")
+    parser.add_argument("--rel-tol", type=float,
+                        help="the relative tolerance used to compare real fields of bulk data entries")
+    parser.add_argument("--tolerance", action="append", default=[], metavar="NAME[:FIELD]=ABS[,REL]",
+                        help="the tolerances for a card type, or for one field of a card type (numbered from 1 after "
+                             "the card name). May be given more than once")
+    parser.add_argument("--include-cards", action="append", metavar="NAME[,NAME...]",
+                        help="only compare the bulk data entries of these card types (e.g. PSHELL,PCOMP,MAT1,MAT8). "
+                             "The other entries are skipped without being parsed. May be given more than once")
+    parser.add_argument("--exclude-cards", action="append", metavar="NAME[,NAME...]",
+                        help="don't compare the bulk data entries of these card types (e.g. GRID,CQUAD4), which are "
+                             "skipped without being parsed. May be given more than once")
+    parser.add_argument("--report-dir",
+                        help="write a paginated report, with a page for each card type, to this directory instead of "
+                             "writing a single file")
+    parser.add_argument("--page-size", type=int, default=1000,
+                        help="the number of bulk data entries on each page of a paginated report. Default: %(default)s")
+    parser.add_argument("--check", action="store_true",
+                        help="only check whether the decks are equivalent, without writing a report. The exit code is "
+                             "{} if they aren't".format(nastrandiff.check.EXIT_DIFFERENT))
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="with --check, stop at the first difference that is found")
     parser.add_argument("-C", nargs="?", type=int,
                         help="use context output format, showing 'lines' (integer) lines of context")
     parser.add_argument("-s", action="store_true",
                         help="display field separators in diff")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of worker processes. With 2 or more, both files are read at the same time. "
+                             "Default: 1")
+    parser.add_argument("--include-threads", type=int, default=4, metavar="N",
+                        help="the number of threads reading INCLUDEd files ahead of the parser, which helps on network "
+                             "file systems (0 to read each file when it's reached). Default: %(default)s")
+    parser.add_argument("--mmap", action="store_true",
+                        help="read the files using memory mapping")
+    parser.add_argument("--columnar", action="store_true",
+                        help="store the entries of common card types (GRID, CQUAD4, etc.) in columns, which uses much "
+                             "less memory")
+    parser.add_argument("--memory-limit", type=int, metavar="MB",
+                        help="compare the bulk data using spill files on disk, using about this much memory in MB, for "
+                             "decks that don't fit in memory. The files are read one at a time and aren't memory "
+                             "mapped or cached, so --jobs, --mmap and the cache aren't used")
+    parser.add_argument("--spill-dir",
+                        help="the directory for the spill files of --memory-limit. Default: the temporary directory")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip included files that are identical in both decks when diffing the bulk data")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't store parsed decks in, or load them from, the cache")
+    parser.add_argument("--cache-dir", default=nastrandiff.cache.default_cache_dir(),
+                        help="the directory used to cache parsed decks. Default: %(default)s")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="the maximum size of the cache in MB. Default: %(default)s")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="display statistics about the cache")
     parser.add_argument("--time", action='store_true',
                         help="display the wall-time required to execute the diff")
+    parser.add_argument("--metrics-json",
+                        help="write the time, memory, lines, etc. of each stage of the diff to this JSON file")
     parser.add_argument("--progress", action="store_true",
                         help="display the progress of the program")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="run a diff server at this address (HOST:PORT, e.g. localhost:8765, or unix:PATH for a "
+                             "Unix socket), which keeps recently parsed decks in memory. file1 and file2 aren't given.")
+    parser.add_argument("--serve-remote", action="store_true",
+                        help="allow --serve to listen on an address other than loopback. The server reads any file "
+                             "named in a request, so only use this on a trusted network.")
+    parser.add_argument("--server-memory", type=int, default=1024, metavar="MB",
+                        help="the memory used by the decks kept by --serve, in MB. Default: %(default)s")
+    parser.add_argument("--server", metavar="ADDRESS",
+                        help="ask the diff server at this address (see --serve) to diff the files")
     parser.add_argument("--no-launch-browser", action="store_true",
                         help="don't launch the system default web browser with the results")
     parser.add_argument('--version', action='version',
@@ -57,25 +218,149 @@ if __name__ == '__main__':
         parser.print_help()
         sys.exit(0)
 
-    if args.file1 is None or args.file2 is None:
+    if args.serve is None and (args.file1 is None or (args.file2 is None and args.batch is None)):
         parser.print_help()
         sys.exit(0)
 
     nd = nastrandiff.NastranDiff()
     nd.file1 = args.file1
     nd.file2 = args.file2
-    nd.output = args.output
+    nd.output_format = args.format
     nd.context = args.C
     nd.progress = args.progress
     nd.separators = args.s
+    nd.jobs = args.jobs
+    nd.incremental = args.incremental
+    nd.include_threads = args.include_threads
+    if args.memory_limit is not None:
+        nd.memory_limit = args.memory_limit * 1024 ** 2
+        nd.spill_dir = args.spill_dir
+        if args.jobs > 1 or args.mmap:
+            print("Warning: --jobs and --mmap aren't used with --memory-limit")
+    nd.memory_map = args.mmap
+    if args.columnar:
+        nd.columnar_types = nastrandiff.columnar.DEFAULT_COLUMNAR_TYPES
+    nd.include_cards = card_types(args.include_cards)
+    nd.exclude_cards = card_types(args.exclude_cards)
+    nd.report_dir = args.report_dir
+    if args.abs_tol is not None or args.rel_tol is not None or len(args.tolerance) > 0:
+        nd.tolerances = nastrandiff.compare.Tolerances(args.abs_tol or 0., args.rel_tol or 0.)
+        for spec in args.tolerance:
+            try:
+                nd.tolerances.parse_tolerance(spec)
+            except ValueError as e:
+                parser.error(str(e))
+    nd.page_size = args.page_size
+    if not args.no_cache:
+        nd.cache = nastrandiff.cache.DeckCache(args.cache_dir, args.cache_size * 1024 ** 2)
+    if args.metrics_json is not None:
+        nd.metrics = nastrandiff.metrics.Metrics()
+
+    if args.serve is not None:
+        service = nastrandiff.server.DiffService(args.server_memory * 1024 ** 2,
+                                                 dict(memory_map=nd.memory_map, columnar_types=nd.columnar_types,
+                                                      include_cards=nd.include_cards,
+                                                      exclude_cards=nd.exclude_cards))
+        service.verbose = args.progress
+        try:
+            server = nastrandiff.server.make_server(args.serve, service, allow_remote=args.serve_remote)
+        except (OSError, ValueError) as e:
+            parser.error("can't serve at '{}': {}".format(args.serve, e))
+        print("Serving diffs at {}".format(nastrandiff.server.server_address(server)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        sys.exit(0)
+
+    if args.batch is not None:
+        candidates = [] if nd.file2 is None else [nd.file2.name]
+        candidates = nastrandiff.batch.expand_candidates(candidates + [c for group in args.batch for c in group])
+        if len(candidates) == 0:
+            parser.error("no candidate files match --batch")
+        directory = args.report_dir if args.report_dir is not None else "batch-{}".format(default_output[5:])
+        batch = nastrandiff.batch.BatchDiff(nd, nd.file1.name, candidates, directory)
+        start = time.time()
+        try:
+            batch.run()
+        except (nastrandiff.DeckError, OSError) as e:
+            exit_error(parser, e)
+        end = time.time()
+        if args.time:
+            print("Elapsed time: {}".format(end - start))
+        if args.cache_stats and nd.cache is not None:
+            print(nd.cache.format_stats())
+        if args.metrics_json is not None:
+            nd.metrics.write_json(args.metrics_json, file1=nd.file1.name, candidates=candidates)
+        url = pathlib.Path(os.path.realpath(os.path.join(directory, "summary.html"))).as_uri()
+        print("Summary written to {}".format(url))
+        if not args.no_launch_browser:
+            webbrowser.open(url)
+        sys.exit(0)
+
+    if args.check:
+        start = time.time()
+        try:
+            result = nd.check(args.fail_fast)
+        except (nastrandiff.DeckError, OSError) as e:
+            exit_error(parser, e)
+        end = time.time()
+        print(result.format())
+        if args.time:
+            print("Elapsed time: {}".format(end - start))
+        if args.metrics_json is not None:
+            nd.metrics.write_json(args.metrics_json, file1=nd.file1.name, file2=nd.file2.name)
+        sys.exit(0 if result.equivalent else nastrandiff.check.EXIT_DIFFERENT)
+
+    if args.server is not None and nd.report_dir is not None:
+        parser.error("--report-dir can't be used with --server")
+    if nd.report_dir is None or nd.output_format != "html":
+        # the output file is only created when it is written to
+        output_name = args.output if args.output is not None else "{}.{}".format(default_output, nd.output_format)
+        try:
+            nd.output = output_file(output_name, nd.output_format)
+        except OSError as e:
+            parser.error("can't open '{}': {}".format(output_name, e))
 
     start = time.time()
-    nd.calculate_diff()
+    if args.server is not None:
+        options = dict(format=nd.output_format, context=nd.context, separators=nd.separators,
+                       tolerances=args.tolerance)
+        if args.abs_tol is not None:
+            options["abs_tol"] = args.abs_tol
+        if args.rel_tol is not None:
+            options["rel_tol"] = args.rel_tol
+        if nd.include_cards is not None:
+            options["include_cards"] = sorted(nd.include_cards)
+        if nd.exclude_cards is not None:
+            options["exclude_cards"] = sorted(nd.exclude_cards)
+        try:
+            nd.output.write(nastrandiff.server.request_diff(args.server, nd.file1.name, nd.file2.name, **options))
+        except (OSError, RuntimeError, nastrandiff.DeckError) as e:
+            print("Error: the diff server at {} failed: {}".format(args.server, e))
+            sys.exit(1)
+    else:
+        try:
+            nd.calculate_diff()
+        except (nastrandiff.DeckError, OSError) as e:
+            exit_error(parser, e)
     end = time.time()
+    if nd.output is not None and nd.output is not sys.stdout:
+        nd.output.close()
     if args.time:
         print("Elapsed time: {}".format(end - start))
+    if args.cache_stats and nd.cache is not None:
+        print(nd.cache.format_stats())
+    if args.metrics_json is not None:
+        nd.metrics.write_json(args.metrics_json, file1=nd.file1.name, file2=nd.file2.name,
+                              cache=None if nd.cache is None else nd.cache.stats())
 
-    if not args.no_launch_browser:
-        url = pathlib.Path(os.path.realpath(nd.output.name)).as_uri()
+    if not args.no_launch_browser and nd.output_format == "html" and nd.output is not sys.stdout:
+        if nd.report_dir is not None:
+            url = pathlib.Path(os.path.realpath(os.path.join(nd.report_dir, "index.html"))).as_uri()
+        else:
+            url = pathlib.Path(os.path.realpath(nd.output.name)).as_uri()
         print("Launching system browser to open URL {}".format(url))
         webbrowser.open(url)
@@ -13,13 +13,48 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
 
+import collections
+import concurrent.futures
+import contextlib
 import difflib
+import hashlib
+import heapq
+import io
 import itertools
+import nastrandiff.card
+import nastrandiff.casecontrol
+import nastrandiff.check
+import nastrandiff.columnar
+import nastrandiff.compressed
+import nastrandiff.external
+import nastrandiff.mapped
+import nastrandiff.metrics
+import nastrandiff.prefetch
+import nastrandiff.report
+import nastrandiff.snapshot
+import nastrandiff.structured
+import nastrandiff.tokenizer
+import operator
 import os
 import re
+import shutil
+import tempfile
 import typing
 
 
+class DeckError(Exception):
+    """
+    An error raised while reading or parsing one of the decks. The name of the deck is available as file_name.
+    """
+    def __init__(self, file_name: str, message: str):
+        super().__init__(file_name, message)
+        self.file_name = file_name
+        self.message = message
+
+    def __str__(self):
+        return "{}: {}".format(self.file_name, self.message)
+
+
 class NastranDiff:
     """
     A class that determines a diff between two NASTRAN input decks.
@@ -29,17 +64,81 @@ class NastranDiff:
     - file1: The first file to diff (a TextIOWrapper)
     - file2: The second file to diff (a TextIOWrapper)
     - output: An HTML file to write the output (a TextIOWrapper)
+    - output_format: "html" for an HTML report, or "jsonl" or "csv" to write a record for each difference as it is
+      found (see nastrandiff.structured). Structured output reads the decks in this process, without the cache.
     - context: None to show full files in diff; an integer to show '''context''' lines of context
     - progress: A boolean indicating whether to display progress
     - separators: A boolean indicating whether to insert separators between the bulk data fields in the HTML
+    - jobs: The number of worker processes. With 2 or more, both decks are read at the same time in separate
+      processes (so file1 and file2 must be named files) and each deck's bulk data is parsed using jobs // 2 processes
+    - cache: None, or a nastrandiff.cache.DeckCache used to store and retrieve parsed decks
+    - incremental: A boolean indicating whether to skip included files that are identical in both decks (including
+      the files that they include) when reading the bulk data. The cache is not used in this mode.
+    - include_threads: The number of threads reading the files INCLUDEd by each deck ahead of the parser (see
+      nastrandiff.prefetch.IncludePrefetcher); 0 to read each file when its INCLUDE statement is reached
+    - memory_map: A boolean indicating whether to read the decks using nastrandiff.mapped.MappedDeck. The bulk data is
+      then split between the worker processes by byte offsets, rather than by sending them the lines.
+    - report_dir: None to write the report to output; otherwise, the directory where a paginated report is written
+      (see nastrandiff.report.PaginatedReport)
+    - page_size: The number of bulk data entries on each page of a paginated report
+    - tolerances: None to compare the bulk data entries as they are formatted; otherwise, a
+      nastrandiff.compare.Tolerances used to compare their fields
+    - columnar_types: None, or a set of card types whose entries are stored in columns (see
+      nastrandiff.columnar.ColumnarBulk), which uses much less memory for card types with many entries
+    - include_cards: None to compare the bulk data entries of every card type; otherwise, a set of the card types
+      that are compared. The entries of other card types are skipped without being parsed (see filter_bulk_lines).
+    - exclude_cards: None, or a set of card types whose bulk data entries are skipped without being parsed
+    - metrics: None, or a nastrandiff.metrics.Metrics that records the time, memory, etc. taken by each stage of
+      calculate_diff (see add_hook)
+    - memory_limit: None to compare the bulk data in memory; otherwise, the approximate number of bytes of memory to
+      use for the bulk data, which is then compared using spill files on disk (see compare_bulk_external). The decks
+      are read in this process, without the cache.
+    - spill_dir: The directory where the spill files are created when memory_limit is set (None for the system's
+      temporary directory)
     """
     def __init__(self):
         self.file1 = None
         self.file2 = None
         self.output = None
+        self.output_format = "html"
         self.context = None
         self.progress = False
         self.separators = False
+        self.jobs = 1
+        self.cache = None
+        self.incremental = False
+        self.include_threads = 4
+        self.memory_map = False
+        self.report_dir = None
+        self.page_size = 1000
+        self.tolerances = None
+        self.columnar_types = None
+        self.include_cards = None
+        self.exclude_cards = None
+        self.metrics = None
+        self.memory_limit = None
+        self.spill_dir = None
+
+    def add_hook(self, hook: typing.Callable[[nastrandiff.metrics.StageMetrics], None]) -> None:
+        """
+        Registers a function that is called with the nastrandiff.metrics.StageMetrics of each stage of calculate_diff
+        (include resolution, reading or parsing each deck, diffing the executive and case control, comparing the bulk
+        data and rendering the report) as it finishes. This turns on metrics if they're off.
+        """
+        if self.metrics is None:
+            self.metrics = nastrandiff.metrics.Metrics()
+        self.metrics.add_hook(hook)
+
+    def _stage(self, name: str) -> typing.ContextManager[nastrandiff.metrics.StageMetrics]:
+        return nastrandiff.metrics.stage(self.metrics, name)
+
+    @staticmethod
+    def _count_tree(stage: nastrandiff.metrics.StageMetrics, tree: tuple) -> None:
+        # Adds the files in an include tree to the "files" and bytes of a stage
+        stage.info["files"] = stage.info.get("files", 0) + 1
+        stage.bytes += os.path.getsize(tree[0])
+        for child in tree[2]:
+            NastranDiff._count_tree(stage, child)
 
     @staticmethod
     def check_for_include(line: str) -> typing.Union[None, str]:
@@ -51,30 +150,125 @@ class NastranDiff:
         return None if r is None else r.group(2)
 
     @staticmethod
-    def read_file(f: typing.TextIO, break_at: str) -> str:
-        for line in f:
-            if line.startswith(break_at):
-                break
-            include = NastranDiff.check_for_include(line)
-            if include is not None:
-                include_f = open(os.path.dirname(os.path.realpath(f.name)) + os.path.sep + include, "r")
-                yield from NastranDiff.read_file(include_f, break_at)
-            else:
-                yield line
+    def read_file(f: typing.TextIO, break_at: str, skip: dict = None,
+                  includes: nastrandiff.prefetch.IncludeReader = None) -> str:
+        """
+        Yields the lines of f up to the line starting with break_at, replacing INCLUDE statements with the lines of
+        the included file. skip optionally maps the real path of included files to the number of times that they
+        should be left out (see plan_incremental); the counts are decremented as the files are skipped. includes is
+        the IncludeReader (e.g. an IncludePrefetcher for f, see include_reader) reading the included files; by
+        default, each file is read when its INCLUDE statement is reached. A ValueError is raised if a file includes
+        itself, directly or through other files. Included files compressed with gzip, bzip2 or xz are decompressed as
+        they're read, and an INCLUDE of a file that was compressed in place finds the compressed file (see
+        nastrandiff.compressed); f itself can be opened with nastrandiff.compressed.open_deck.
+        """
+        yield from (nastrandiff.prefetch.IncludeReader() if includes is None else includes).read(f, break_at, skip)
+
+    def include_reader(self, f: typing.TextIO) -> nastrandiff.prefetch.IncludeReader:
+        """
+        Returns the IncludeReader for reading the deck in f with read_file, which reads the included files ahead in
+        include_threads threads. When memory_limit is set, a quarter of it is used for the lines read ahead. Close it
+        when the deck has been read.
+        """
+        if self.memory_limit is not None:
+            return nastrandiff.prefetch.include_reader(getattr(f, "name", None), self.include_threads,
+                                                       max(1, self.memory_limit // 4))
+        return nastrandiff.prefetch.include_reader(getattr(f, "name", None), self.include_threads)
+
+    @staticmethod
+    def include_tree(file_name: str, parents: tuple = ()) -> tuple:
+        """
+        Returns a tree of the files making up a deck as a (file name, digest, includes) tuple, where includes is a list
+        of the same tuples for the files INCLUDEd by file_name, in order. The digest is a SHA-256 hex digest of the
+        (decompressed) file and the digests of its includes, so two nodes have the same digest only if they contain the
+        same lines.
+        parents holds the real paths of the files including file_name, so that cycles raise a ValueError.
+        """
+        path = os.path.realpath(file_name)
+        nastrandiff.prefetch.check_cycle(parents, path)
+        includes = []
+        h = hashlib.sha256()
+        with nastrandiff.compressed.open_binary(file_name) as f:
+            for line in f:
+                h.update(line)
+                if line.startswith(b"INCLUDE"):
+                    include = NastranDiff.check_for_include(line.decode(errors="replace"))
+                    if include is not None:
+                        include_name = nastrandiff.compressed.resolve(os.path.dirname(path) + os.path.sep + include)
+                        includes.append(NastranDiff.include_tree(include_name, parents + (path,)))
+        for i in includes:
+            h.update(i[1].encode())
+        return file_name, h.hexdigest(), includes
+
+    @staticmethod
+    def identical_includes(tree1: tuple, tree2: tuple) -> collections.Counter:
+        """
+        Matches the included files of two include trees by digest, starting with the files included by the root files.
+        Files that aren't matched are replaced by the files that they include, until nothing remains to be matched.
+        Returns a Counter of the matched digests.
+        """
+        matched = collections.Counter()
+        pool1 = tree1[2]
+        pool2 = tree2[2]
+        while len(pool1) > 0 and len(pool2) > 0:
+            common = collections.Counter(n[1] for n in pool1) & collections.Counter(n[1] for n in pool2)
+            matched += common
+            pools = []
+            for pool in (pool1, pool2):
+                remaining = common.copy()
+                unmatched_includes = []
+                for node in pool:
+                    if remaining[node[1]] > 0:
+                        remaining[node[1]] -= 1
+                    else:
+                        unmatched_includes += node[2]
+                pools.append(unmatched_includes)
+            pool1, pool2 = pools
+        return matched
+
+    @staticmethod
+    def plan_skips(tree: tuple, matched: collections.Counter) -> dict:
+        """
+        Returns a dict mapping the real path of included files to the number of times that read_file should skip them
+        so that the files with matched digests are left out of the deck described by tree.
+        """
+        remaining = matched.copy()
+        skip = collections.Counter()
+
+        def visit(node):
+            for child in node[2]:
+                if remaining[child[1]] > 0:
+                    remaining[child[1]] -= 1
+                    skip[os.path.realpath(child[0])] += 1
+                else:
+                    visit(child)
+
+        visit(tree)
+        return dict(skip)
+
+    def plan_incremental(self) -> (dict, dict):
+        """
+        Finds the included files that are identical in file1 and file2. Returns the skip dicts for read_file that
+        leave these files out of each deck. The bulk data entries in these files are equal, so they don't need to be
+        parsed or compared.
+        """
+        if self.progress:
+            print("Fingerprinting included files...")
+        with self._stage("include_resolution") as stage:
+            tree1 = NastranDiff.include_tree(self.file1.name)
+            tree2 = NastranDiff.include_tree(self.file2.name)
+            matched = NastranDiff.identical_includes(tree1, tree2)
+            if stage.enabled:
+                NastranDiff._count_tree(stage, tree1)
+                NastranDiff._count_tree(stage, tree2)
+                stage.info["identical_files"] = sum(matched.values())
+        if self.progress:
+            print("Skipping {} identical included files".format(sum(matched.values())))
+        return NastranDiff.plan_skips(tree1, matched), NastranDiff.plan_skips(tree2, matched)
 
     @staticmethod
     def parse_field(field: str) -> typing.Union[int, float, str]:
-        field = field.strip()  # remove leading and trailing whitespace
-        if re.match("[-+.0-9]", field):  # it's integer or real (because it starts with one of those characters
-            if "." in field:  # it's real (reals must contain a decimal point per NASTRAN docs)
-                field = field.replace("D", "E")  # MSC uses 'D' instead of 'E' for scientific notation
-                p = re.compile("([.0-9])([-+])([0-9])")
-                field = p.sub("\\1E\\2\\3", field)
-                return float(field)
-            else:  # it's integer
-                return int(field)
-        else:  # it's character
-            return field
+        return nastrandiff.tokenizer.parse_field(field)
 
     @staticmethod
     def format_float_nastran(f: float, width: int = 8) -> str:
@@ -124,67 +318,251 @@ class NastranDiff:
 
     @staticmethod
     def parse_fixed_field_format_line(line: str) -> (str, list, bool):
-        bde_name = line[0:8]
-        if "*" in bde_name:
-            field_width = 16
-            bde_name = bde_name[0:bde_name.find("*")]  # remove the asterisk that indicates large fields
-        else:
-            field_width = 8
-        bde_name = bde_name.strip()
-        if "$" in line:
-            line = line.split("$")[0]  # remove the comment, if one exists
-        if len(line) < 72:
-            line += " " * (72 - len(line))
-        # in the following list comprehension, we ignore the continuation field (only read the first 72 characters
-        fields = [NastranDiff.parse_field(line[i:i + field_width]) for i in range(8, min(len(line), 72), field_width)]
-        continuation = len(bde_name) == 0 or "+" in bde_name
-        return bde_name, fields, continuation
+        return nastrandiff.tokenizer.parse_fixed_field_format_line(line)
 
     @staticmethod
     def parse_free_field_format_line(line: str) -> (str, list, bool):
-        split_line = line.split(",")
-        bde_name = split_line[0]
+        return nastrandiff.tokenizer.parse_free_field_format_line(line)
+
+    @staticmethod
+    def is_card_start(line: str) -> bool:
+        """
+        Returns True if the line begins a new bulk data entry. Blank lines, comments and continuation lines return
+        False. This only looks at the first field, so it is much cheaper than parsing the line.
+        """
+        if "$" in line:
+            line = line[0:line.find("$")]
+        line = line.rstrip()
+        if len(line) == 0:
+            return False
+        if "," in line:
+            bde_name = line[0:line.find(",")]
+        else:
+            bde_name = line[0:8]
         if "*" in bde_name:
-            bde_name = bde_name[0:bde_name.find("*")]  # remove the asterisk that indicates large fields
+            bde_name = bde_name[0:bde_name.find("*")]
         bde_name = bde_name.strip()
-        fields = [NastranDiff.parse_field(f) for f in split_line[1:]]
-        continuation = len(bde_name) == 0 or "+" in bde_name
-        return bde_name, fields, continuation
-
-    @staticmethod
-    def parse_bulk_data(bulk: iter) -> dict:
-        multi_field_keys = {"PLOAD4": [1],
-                            "FORCE": [1],
-                            "SPC": [1],
-                            "SPC1": [2],
-                            "TEMP": [1],
-                            "MPC": [1],
-                            "DMIG": [1, 2]}
-        data = {}
-        key = ""
+        return len(bde_name) != 0 and "+" not in bde_name
+
+    @staticmethod
+    def filter_bulk_lines(bulk: iter, include_cards: typing.Collection[str] = None,
+                          exclude_cards: typing.Collection[str] = None) -> str:
+        """
+        Yields the lines of the bulk data entries whose card type is in include_cards (any card type if it is None) and
+        not in exclude_cards, dropping the lines of the other entries and their continuations. The card types are
+        compared in upper case. Like is_card_start, this only looks at the first field of each line, so the entries
+        that are dropped are never parsed. Comments and blank lines go with the entry before them.
+        """
+        include = None if include_cards is None else frozenset(name.upper() for name in include_cards)
+        exclude = frozenset(name.upper() for name in exclude_cards or ())
+        # whether the entries whose first field is the key are kept (1) or dropped (0), or -1 for continuations
+        decisions = {}
+        keep = True
+        for line in bulk:
+            if "," in line or "$" in line:
+                code = line[0:line.find("$")] if "$" in line else line  # remove the comment
+                first = code[0:code.find(",")] if "," in code else code[0:8]
+            else:
+                first = line[0:8]
+            decision = decisions.get(first)
+            if decision is None:
+                bde_name = first[0:first.find("*")] if "*" in first else first
+                bde_name = bde_name.strip().upper()
+                if len(bde_name) == 0 or "+" in bde_name:
+                    decision = -1
+                else:
+                    decision = int((include is None or bde_name in include) and bde_name not in exclude)
+                if len(decisions) >= 4096:
+                    decisions.clear()  # the continuation fields may all be different
+                decisions[first] = decision
+            if decision >= 0:
+                keep = decision == 1
+            if keep:
+                yield line
+
+    @staticmethod
+    def _filter_bulk(bulk: iter, options: dict) -> iter:
+        # Drops the bulk data entries of the card types filtered out in options (see parse_options)
+        if options is None or (options.get("include_cards") is None and not options.get("exclude_cards")):
+            return bulk
+        return NastranDiff.filter_bulk_lines(bulk, options.get("include_cards"), options.get("exclude_cards"))
+
+    @staticmethod
+    def split_bulk_data(lines: list, n_chunks: int) -> list:
+        """
+        Splits the lines of the bulk data into (approximately) n_chunks lists of lines. The splits are only made at
+        the start of a bulk data entry, so an entry and its continuations always end up in the same chunk.
+        """
+        chunk_size = max(1, -(-len(lines) // max(1, n_chunks)))
+        chunks = []
+        start = 0
+        while start < len(lines):
+            end = min(start + chunk_size, len(lines))
+            while end < len(lines) and not NastranDiff.is_card_start(lines[end]):
+                end += 1
+            chunks.append(lines[start:end])
+            start = end
+        return chunks
+
+    @staticmethod
+    def _strip_lines(bulk: iter) -> str:
+        # Yields the lines of bulk data with the comments and trailing whitespace removed, skipping blank lines
         for line in bulk:
             if "$" in line:
                 # Remove the comment character and anything after it
                 line = line[0:line.find("$")]
             line = line.rstrip()  # remove trailing whitespace
-            if len(line) == 0:
-                continue
-            if "," in line:
-                # the format is a free-field format
-                bde_name, fields, continuation = NastranDiff.parse_free_field_format_line(line)
-            else:
-                # the format must be fixed-field format
-                bde_name, fields, continuation = NastranDiff.parse_fixed_field_format_line(line)
+            if len(line) > 0:
+                yield line
+
+    @staticmethod
+    def _generate_bulk_lines(bulk: iter) -> (str, list):
+        # Parses the bulk data, yielding a (BDE name, lines) tuple for each bulk data entry
+        entry_name = None
+        entry_lines = None
+        # free-field format if it has a comma; otherwise fixed, where runs of lines of the same card type are parsed
+        # together
+        for bde_name, fields, continuation in nastrandiff.tokenizer.parse_lines(NastranDiff._strip_lines(bulk)):
             if continuation:
-                data[key] += "\n" + NastranDiff.format_bde("", fields)
+                entry_lines.append(fields)
             else:
-                key = bde_name + "{:8}".format(fields[0])  # BDE name and the ID
-                if bde_name in multi_field_keys:
-                    key += "".join(["{:8}".format(fields[i]) for i in multi_field_keys[bde_name]])
-                if key in data:
-                    print("""Warning: Multiple lines being saved as '{}'. This may indicate a problem in the BDF or a
-                          bug in this software""".format(key))
-                data[key] = NastranDiff.format_bde(bde_name, fields)
+                if entry_name is not None:
+                    yield entry_name, entry_lines
+                entry_name = bde_name
+                entry_lines = [fields]
+        if entry_name is not None:
+            yield entry_name, entry_lines
+
+    @staticmethod
+    def generate_bulk_fields(bulk: iter) -> (str, str, list):
+        """
+        Parses the bulk data, yielding a (key, BDE name, lines) tuple for each bulk data entry in the order that they
+        appear. lines is a list holding the list of parsed fields of the first line and of each continuation line.
+        Keys are not checked for uniqueness here; see parse_bulk_data.
+        """
+        multi_field_keys = nastrandiff.card.multi_field_keys
+        for bde_name, lines in NastranDiff._generate_bulk_lines(bulk):
+            fields = lines[0]
+            key = bde_name + "{:8}".format(fields[0])  # BDE name and the ID
+            if bde_name in multi_field_keys:
+                key += "".join(["{:8}".format(fields[i]) for i in multi_field_keys[bde_name]])
+            yield key, bde_name, lines
+
+    @staticmethod
+    def generate_bulk_cards(bulk: iter) -> nastrandiff.card.Card:
+        """
+        Parses the bulk data, yielding a Card for each bulk data entry in the order that they appear
+        """
+        Card = nastrandiff.card.Card
+        for bde_name, lines in NastranDiff._generate_bulk_lines(bulk):
+            yield Card(bde_name, lines)
+
+    @staticmethod
+    def format_entry(bde_name: str, lines: list) -> str:
+        """
+        Formats an entry parsed by generate_bulk_fields, with each continuation on a new line
+        """
+        return "\n".join([NastranDiff.format_bde(bde_name if i == 0 else "", fields) for i, fields in enumerate(lines)])
+
+    @staticmethod
+    def generate_bulk_entries(bulk: iter) -> (str, str):
+        """
+        Parses the bulk data, yielding a (key, formatted entry) tuple for each bulk data entry in the order that they
+        appear. Keys are not checked for uniqueness here; see parse_bulk_data.
+        """
+        for key, bde_name, lines in NastranDiff.generate_bulk_fields(bulk):
+            yield key, NastranDiff.format_entry(bde_name, lines)
+
+    @staticmethod
+    def _generate_entries(bulk: iter, typed: bool) -> (typing.Union[str, tuple],
+                                                       typing.Union[str, nastrandiff.card.Card]):
+        # The items of the dicts returned by parse_bulk_data (typed is False) and parse_bulk_fields (typed is True)
+        if typed:
+            return ((card.key, card) for card in NastranDiff.generate_bulk_cards(bulk))
+        return NastranDiff.generate_bulk_entries(bulk)
+
+    @staticmethod
+    def _parse_bulk_chunk(lines: list, typed: bool = False) -> list:
+        # Executed in a worker process by parse_bulk_data
+        return list(NastranDiff._generate_entries(lines, typed))
+
+    @staticmethod
+    def merge_bulk_entries(data: dict, entries: iter) -> dict:
+        if isinstance(data, nastrandiff.columnar.ColumnarBulk):
+            data.merge(entries)
+            return data
+        for key, txt in entries:
+            if key in data:
+                print("""Warning: Multiple lines being saved as '{}'. This may indicate a problem in the BDF or a
+                          bug in this software""".format(key if isinstance(key, str) else txt.key_string()))
+            data[key] = txt
+        return data
+
+    @staticmethod
+    def parse_bulk_data(bulk: iter, jobs: int = 1, typed: bool = False, data: dict = None) -> dict:
+        """
+        Parses the bulk data into a dict mapping each entry's key (the BDE name and ID) to the formatted entry. If
+        typed is True, the keys are tuples and the values are Cards instead, as from generate_bulk_cards (see also
+        parse_bulk_fields). The entries are added to data, if it is given.
+
+        When jobs is greater than 1, the bulk data is split into chunks at entry boundaries and the chunks are parsed
+        in a pool of jobs worker processes. The chunks are merged in their original order, so the result (and any
+        warnings about duplicate keys) is identical to parsing in a single process.
+        """
+        data = {} if data is None else data
+        if jobs <= 1:
+            return NastranDiff.merge_bulk_entries(data, NastranDiff._generate_entries(bulk, typed))
+        # use several chunks per worker so that the work stays balanced when the chunks take different times to parse
+        chunks = NastranDiff.split_bulk_data(list(bulk), jobs * 4)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            for entries in executor.map(NastranDiff._parse_bulk_chunk, chunks, itertools.repeat(typed)):
+                NastranDiff.merge_bulk_entries(data, entries)
+        return data
+
+    @staticmethod
+    def _new_bulk(options: dict) -> typing.Union[dict, nastrandiff.columnar.ColumnarBulk]:
+        # The object that parse_bulk_fields adds the entries to
+        if options is not None and options.get("columnar_types"):
+            return nastrandiff.columnar.ColumnarBulk(options["columnar_types"])
+        return {}
+
+    @staticmethod
+    def parse_bulk_fields(bulk: iter, jobs: int = 1,
+                          options: dict = None) -> typing.Union[dict, nastrandiff.columnar.ColumnarBulk]:
+        """
+        Parses the bulk data into a dict mapping each entry's key (see Card) to its Card. Entries in this form are
+        compared field by field (see entries_equal) and only formatted if they're in the report.
+
+        options is a dict of parsing options (see parse_options). If it has "columnar_types", the result is a
+        ColumnarBulk storing those card types in columns instead. If it has "include_cards" or "exclude_cards", the
+        entries of the card types that are filtered out are skipped (see filter_bulk_lines).
+        """
+        bulk = NastranDiff._filter_bulk(bulk, options)
+        data = NastranDiff.parse_bulk_data(bulk, jobs, typed=True, data=NastranDiff._new_bulk(options))
+        if isinstance(data, nastrandiff.columnar.ColumnarBulk):
+            data.finalize()
+        return data
+
+    @staticmethod
+    def _parse_bulk_ranges_chunk(ranges: list, typed: bool = False, options: dict = None) -> list:
+        # Executed in a worker process by parse_bulk_ranges
+        lines = NastranDiff._filter_bulk(nastrandiff.mapped.MappedDeck.read_ranges(ranges), options)
+        return list(NastranDiff._generate_entries(lines, typed))
+
+    @staticmethod
+    def parse_bulk_ranges(chunks: list, jobs: int = 1, typed: bool = False, data: dict = None,
+                          options: dict = None) -> dict:
+        """
+        Parses bulk data given as chunks of (file name, start offset, end offset) ranges (see MappedDeck.split) in a
+        pool of jobs worker processes. Each worker maps the files itself, so only the offsets are sent to it. The
+        result is the same as for parse_bulk_data. The card types filtered out in options (see parse_options) are
+        skipped.
+        """
+        data = {} if data is None else data
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for entries in executor.map(NastranDiff._parse_bulk_ranges_chunk, chunks, itertools.repeat(typed),
+                                        itertools.repeat(options)):
+                NastranDiff.merge_bulk_entries(data, entries)
         return data
 
     @staticmethod
@@ -197,38 +575,394 @@ class NastranDiff:
             txt += l[width:]
         return txt
 
-    def compare_bulk(self, bulk1, bulk2) -> (list, list, list, list):
-        if self.progress:
-            print("Parsing bulk data (file 1)...")
-        bulk1 = NastranDiff.parse_bulk_data(bulk1)
-        if self.progress:
-            print("Parsing bulk data (file 2)...")
-        bulk2 = NastranDiff.parse_bulk_data(bulk2)
+    @staticmethod
+    def read_deck(f: typing.TextIO, jobs: int = 1, skip: dict = None, options: dict = None,
+                  stage: nastrandiff.metrics.StageMetrics = None) -> (list, list, dict):
+        """
+        Reads a whole deck, returning the executive control lines, the case control lines and the bulk data parsed by
+        parse_bulk_fields with options. skip is passed to read_file for the bulk data. The lines and bulk data entries
+        are counted in stage, if it is given.
+        """
+        stage = nastrandiff.metrics.StageMetrics("read_deck", enabled=False) if stage is None else stage
+        threads = 0 if options is None else options.get("include_threads", 0)
+        with nastrandiff.prefetch.include_reader(getattr(f, "name", None), threads) as includes:
+            exec_lines = list(stage.count_lines(NastranDiff.read_file(f, "CEND", includes=includes)))
+            case_lines = list(stage.count_lines(NastranDiff.read_file(f, "BEGIN BULK", includes=includes)))
+            bulk_lines = NastranDiff.read_file(f, "ENDDATA", skip, includes)
+            bulk = NastranDiff.parse_bulk_fields(stage.count_lines(bulk_lines), jobs, options)
+        stage.count_cards(bulk)
+        return exec_lines, case_lines, bulk
 
-        file1unique = []
-        file2unique = []
-        diff1 = []
-        diff2 = []
+    @staticmethod
+    def read_mapped_deck(file_name: str, jobs: int = 1, skip: dict = None, options: dict = None,
+                         stage: nastrandiff.metrics.StageMetrics = None) -> (list, list, dict):
+        """
+        The same as read_deck, but using a MappedDeck
+        """
+        stage = nastrandiff.metrics.StageMetrics("read_deck", enabled=False) if stage is None else stage
+        with nastrandiff.mapped.MappedDeck(file_name, skip) as deck:
+            exec_lines = list(stage.count_lines(deck.lines("exec")))
+            case_lines = list(stage.count_lines(deck.lines("case")))
+            if stage.enabled:
+                lines, n_bytes = deck.count("bulk")
+                stage.lines += lines
+                stage.bytes += n_bytes
+            if jobs <= 1:
+                bulk = NastranDiff.parse_bulk_fields(deck.lines("bulk"), options=options)
+            else:
+                bulk = NastranDiff.parse_bulk_ranges(deck.split("bulk", jobs * 4), jobs, typed=True,
+                                                     data=NastranDiff._new_bulk(options), options=options)
+                if isinstance(bulk, nastrandiff.columnar.ColumnarBulk):
+                    bulk.finalize()
+        stage.count_cards(bulk)
+        return exec_lines, case_lines, bulk
+
+    @staticmethod
+    def _read_deck_worker(file_name: str, jobs: int, skip: dict = None, options: dict = None,
+                          measure: bool = False) -> (list, list, dict, str, nastrandiff.metrics.StageMetrics):
+        # Executed in a worker process by read_decks. Anything printed (e.g. warnings) is captured and returned so
+        # that the parent process can print it in order. If measure is True, the StageMetrics of reading the deck is
+        # returned (otherwise None) so that the parent process can record it.
+        messages = io.StringIO()
+        metrics = nastrandiff.metrics.Metrics() if measure else None
+        try:
+            with contextlib.redirect_stdout(messages), nastrandiff.metrics.stage(metrics, "read_deck") as stage:
+                if nastrandiff.snapshot.is_snapshot(file_name):
+                    exec_lines, case_lines, bulk = nastrandiff.snapshot.read_snapshot(file_name, options)
+                    stage.count_cards(bulk)
+                elif options is not None and options.get("memory_map"):
+                    exec_lines, case_lines, bulk = NastranDiff.read_mapped_deck(file_name, jobs, skip, options, stage)
+                else:
+                    with nastrandiff.compressed.open_deck(file_name) as f:
+                        exec_lines, case_lines, bulk = NastranDiff.read_deck(f, jobs, skip, options, stage)
+        except Exception as e:
+            raise DeckError(file_name, "{}: {}".format(type(e).__name__, e)) from e
+        return exec_lines, case_lines, bulk, messages.getvalue(), stage if measure else None
+
+    def parse_options(self) -> dict:
+        """
+        Returns the options that affect how the decks are read and parsed, as a dict that can be sent to a worker
+        process
+        """
+        return dict(memory_map=self.memory_map, columnar_types=self.columnar_types,
+                    include_threads=self.include_threads, include_cards=self.include_cards,
+                    exclude_cards=self.exclude_cards)
+
+    def cache_variant(self, options: dict = None) -> str:
+        """
+        Returns the variant of the cache keys of decks parsed with options (by default, parse_options), since the
+        cached decks must have been parsed in the same way
+        """
+        if options is None:
+            options = self.parse_options()
+        variant = "" if not options["columnar_types"] else "columnar:" + ",".join(sorted(options["columnar_types"]))
+        if options["include_cards"] is not None:
+            variant += ";include:" + ",".join(sorted(name.upper() for name in options["include_cards"]))
+        if options["exclude_cards"]:
+            variant += ";exclude:" + ",".join(sorted(name.upper() for name in options["exclude_cards"]))
+        return variant
 
+    def has_snapshot(self) -> bool:
+        """
+        Returns True if file1 or file2 is a snapshot (see nastrandiff.snapshot), which must be read by read_decks
+        """
+        return any(nastrandiff.snapshot.is_snapshot(getattr(f, "name", None)) for f in (self.file1, self.file2))
+
+    def read_decks(self, skips: (dict, dict) = (None, None)) -> ((list, list, dict), (list, list, dict)):
+        """
+        Reads and parses file1 and file2, returning a tuple of (exec_lines, case_lines, bulk) for each file. Decks are
+        taken from the cache when possible. When jobs > 1, the remaining decks are read at the same time in two worker
+        processes. Errors are raised as a DeckError naming the file. skips are passed to read_file for the bulk data of
+        each file; decks read with skips are incomplete, so they aren't cached.
+
+        Snapshots (see nastrandiff.snapshot) are read first, without the cache. The other deck is then parsed with the
+        card types stored in columns in the snapshot, so that the bulk data of both can be compared.
+        """
         if self.progress:
-            print("Processing bulk data differences...")
+            print("Reading both files...")
+        file_names = [self.file1.name, self.file2.name]
+        decks = [None, None]
+        keys = [None, None]
+        options = self.parse_options()
+        for i, file_name in enumerate(file_names):
+            if nastrandiff.snapshot.is_snapshot(file_name):
+                with self._stage("read_snapshot{}".format(i + 1)) as stage:
+                    try:
+                        decks[i] = nastrandiff.snapshot.read_snapshot(file_name, options)
+                    except (OSError, ValueError) as e:
+                        raise DeckError(file_name, "{}: {}".format(type(e).__name__, e)) from e
+                    stage.count_cards(decks[i][2])
+                if self.progress:
+                    print("Loaded snapshot (file {})".format(i + 1))
+        snapshots = [d is not None for d in decks]
+        if any(snapshots):
+            # so that the bulk data doesn't have to be converted to be compared (see nastrandiff.columnar.comparable)
+            options["columnar_types"] = frozenset().union(*(d[2].columnar_types for d in decks if d is not None)) \
+                or None
+        use_cache = self.cache is not None and skips[0] is None and skips[1] is None and not all(snapshots)
+        variant = self.cache_variant(options)
+        if use_cache:
+            trees = [None, None]
+            with self._stage("include_resolution") as stage:
+                for i, file_name in enumerate(file_names):
+                    if snapshots[i]:
+                        continue
+                    try:
+                        trees[i] = NastranDiff.include_tree(file_name)
+                    except OSError as e:
+                        raise DeckError(file_name, "{}: {}".format(type(e).__name__, e)) from e
+                    if stage.enabled:
+                        NastranDiff._count_tree(stage, trees[i])
+            with self._stage("cache_lookup") as stage:
+                for i, file_name in enumerate(file_names):
+                    if snapshots[i]:
+                        continue
+                    keys[i] = self.cache.key(trees[i], variant)
+                    decks[i] = self.cache.get(keys[i])
+                    if decks[i] is not None:
+                        stage.count_cards(decks[i][2])
+                        if self.progress:
+                            print("Loaded file {} from the cache".format(i + 1))
+                stage.info["hits"] = sum(d is not None and not snapshot for d, snapshot in zip(decks, snapshots))
 
-        for bde in sorted(bulk1):
-            if bde in bulk2:
-                b1 = NastranDiff.remove_continuations(bulk1[bde])
-                b2 = NastranDiff.remove_continuations(bulk2[bde])
-                if b1 != b2:
-                    diff1.append(bulk1[bde])
-                    diff2.append(bulk2[bde])
+        jobs = max(1, self.jobs // 2)
+        with contextlib.ExitStack() as stack:
+            if self.jobs > 1:
+                executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=2))
+                results = [None if d is not None else executor.submit(NastranDiff._read_deck_worker, n, jobs, skip,
+                                                                      options, self.metrics is not None)
+                           for n, d, skip in zip(file_names, decks, skips)]
             else:
-                file1unique.append(bulk1[bde])
+                results = [None] * 2
+            for i, file_name in enumerate(file_names):
+                if decks[i] is not None:
+                    continue
+                if results[i] is None:
+                    exec_lines, case_lines, bulk, messages, stage = NastranDiff._read_deck_worker(
+                        file_name, self.jobs, skips[i], options, self.metrics is not None)
+                else:
+                    exec_lines, case_lines, bulk, messages, stage = results[i].result()
+                if stage is not None:
+                    stage.name = "read_deck{}".format(i + 1)
+                    self.metrics.record(stage)
+                if self.progress:
+                    print("Parsed bulk data (file {})".format(i + 1))
+                print(messages, end="")
+                decks[i] = (exec_lines, case_lines, bulk)
+                if use_cache:
+                    self.cache.put(keys[i], decks[i])
+        return decks[0], decks[1]
+
+    def _parse_bulks(self, bulk1, bulk2) -> tuple:
+        # Parses the lines of the bulk data of both decks
+        parsed = []
+        for i, bulk in enumerate((bulk1, bulk2)):
+            if self.progress:
+                print("Parsing bulk data (file {})...".format(i + 1))
+            with self._stage("parse_bulk{}".format(i + 1)) as stage:
+                parsed.append(NastranDiff.parse_bulk_fields(stage.count_lines(bulk), self.jobs, self.parse_options()))
+                stage.count_cards(parsed[-1])
+        return tuple(parsed)
+
+    def compare_bulk(self, bulk1, bulk2) -> (list, list, list, list):
+        return self.compare_parsed_bulk(*self._parse_bulks(bulk1, bulk2))
+
+    def sort_bulk_external(self, bulk1, bulk2, directory: str) -> (nastrandiff.external.ExternalSort,
+                                                                  nastrandiff.external.ExternalSort):
+        """
+        Parses the bulk data of two decks, sorting the entries of each using spill runs in directory (see
+        nastrandiff.external.ExternalSort) and about memory_limit bytes of memory however large the decks are
+        """
+        memory_limit = max(1, self.memory_limit)
+        sorts = []
+        try:
+            for i, bulk in enumerate((bulk1, bulk2)):
+                if self.progress:
+                    print("Parsing bulk data (file {})...".format(i + 1))
+                with self._stage("parse_bulk{}".format(i + 1)) as stage:
+                    sort = nastrandiff.external.ExternalSort(directory, memory_limit, "bulk{}".format(i + 1))
+                    sorts.append(sort)
+                    lines = NastranDiff._filter_bulk(stage.count_lines(bulk), self.parse_options())
+                    for card in NastranDiff.generate_bulk_cards(lines):
+                        if stage.enabled:
+                            stage.cards[card.name] += 1
+                        sort.add(card)
+                    stage.info["runs"] = len(sort.runs)
+        except BaseException:
+            for sort in sorts:
+                sort.remove()
+            raise
+        return tuple(sorts)
+
+    def compare_bulk_external(self, bulk1, bulk2, directory: str) -> (nastrandiff.external.SpillFile,
+                                                                     nastrandiff.external.SpillFile,
+                                                                     nastrandiff.external.SpillFile,
+                                                                     nastrandiff.external.SpillFile):
+        """
+        The same as compare_bulk, but using about memory_limit bytes of memory however large the decks are. The entries
+        of each deck are sorted (see sort_bulk_external), then the runs of the two decks are joined. The results are
+        SpillFiles in directory, which can be iterated over (and have a length) like the lists returned by compare_bulk
+        until directory is removed.
+        """
+        sorts = self.sort_bulk_external(bulk1, bulk2, directory)
+        try:
+            if self.progress:
+                print("Processing bulk data differences...")
+            with self._stage("compare") as stage:
+                results = nastrandiff.external.merge_join(sorts[0], sorts[1], self.entries_equal, directory,
+                                                          max(1, self.memory_limit))
+                stage.info.update(changed=len(results[0]), deleted=len(results[2]), added=len(results[3]))
+        finally:
+            for sort in sorts:
+                sort.remove()
+        return results
 
-        for bde in sorted(bulk2):
-            if bde not in bulk1:
-                file2unique.append(bulk2[bde])
+    def external_differences(self, sorted1: nastrandiff.external.ExternalSort,
+                             sorted2: nastrandiff.external.ExternalSort) -> (typing.Union[None, str],
+                                                                              typing.Union[None, str]):
+        """
+        Yields the differences between the bulk data sorted by sort_bulk_external in the form of bulk_differences, in
+        natural order of the keys. The spill runs are removed when the differences have been yielded.
+        """
+        try:
+            for card1, card2 in nastrandiff.external.join_sorted(sorted1, sorted2, self.entries_equal):
+                yield None if card1 is None else card1.format(), None if card2 is None else card2.format()
+        finally:
+            sorted1.remove()
+            sorted2.remove()
 
+    def entries_equal(self, card1: nastrandiff.card.Card, card2: nastrandiff.card.Card) -> bool:
+        """
+        Compares two Cards. If tolerances is None, the entries are equal if they are formatted the same (ignoring where
+        the continuations are). Otherwise, the fields are compared using tolerances.
+        """
+        if card1.type_id != card2.type_id:
+            return False
+        bde_name = card1.name
+        fields1 = card1.fields
+        fields2 = card2.fields
+        if self.tolerances is not None:
+            return self.tolerances.fields_equal(bde_name, fields1, fields2)
+        if fields1 == fields2 and all(type(f1) is type(f2) for f1, f2 in zip(fields1, fields2)):
+            return True
+        # the fields may still be formatted the same (e.g. if they differ in the 9th significant digit)
+        return NastranDiff.format_bde(bde_name, fields1) == NastranDiff.format_bde(bde_name, fields2)
+
+    @staticmethod
+    def sorted_cards(bulk: dict) -> list:
+        """
+        Returns the Cards of bulk data parsed by parse_bulk_fields, sorted by key in natural order (see
+        nastrandiff.card.natural_key)
+        """
+        cards = list(bulk.values())
+        try:
+            cards.sort(key=operator.attrgetter("key"))  # the same order, when the keys can be compared
+        except TypeError:
+            # a key field is a number in some entries and characters in others
+            cards.sort(key=lambda c: nastrandiff.card.natural_key(c.key))
+        return cards
+
+    def join_bulk(self, bulk1: dict, bulk2: dict) -> (nastrandiff.card.Card, nastrandiff.card.Card):
+        """
+        Joins two dicts of Cards in one pass over their entries sorted by key (see sorted_cards), yielding (card1,
+        card2) for each entry that is different, in order. card2 is None for entries only in bulk1 and card1 is None
+        for entries only in bulk2. Entries with the same digest are identical, so they're skipped without comparing
+        their fields.
+        """
+        cards1 = self.sorted_cards(bulk1)
+        cards2 = self.sorted_cards(bulk2)
+        n1 = len(cards1)
+        n2 = len(cards2)
+        i = 0
+        j = 0
+        while i < n1 and j < n2:
+            card1 = cards1[i]
+            card2 = cards2[j]
+            key1 = card1.key
+            key2 = card2.key
+            if key1 == key2:
+                if card1.digest != card2.digest and not self.entries_equal(card1, card2):
+                    yield card1, card2
+                i += 1
+                j += 1
+                continue
+            try:
+                first = key1 < key2
+            except TypeError:
+                # a key field is a number in one deck and characters in the other
+                first = nastrandiff.card.natural_key(key1) < nastrandiff.card.natural_key(key2)
+            if first:
+                yield card1, None
+                i += 1
+            else:
+                yield None, card2
+                j += 1
+        for card1 in cards1[i:]:
+            yield card1, None
+        for card2 in cards2[j:]:
+            yield None, card2
+
+    def bulk_differences(self, bulk1, bulk2) -> (typing.Union[None, str], typing.Union[None, str]):
+        """
+        Compares bulk data parsed by parse_bulk_fields (dicts or ColumnarBulk, see nastrandiff.columnar.comparable),
+        yielding the formatted entries (entry1, entry2) of each entry that is different, in natural order of the keys
+        (see sorted_cards). entry2 is None for entries only in bulk1 and entry1 is None for entries only in bulk2.
+        The entries are joined (see join_bulk) and formatted as they're yielded, so the differences are never held in
+        memory.
+        """
+        bulk1, bulk2 = nastrandiff.columnar.comparable(bulk1, bulk2)
+        if isinstance(bulk1, nastrandiff.columnar.ColumnarBulk):
+            pairs = heapq.merge(self.join_bulk(bulk1.generic, bulk2.generic),
+                                bulk1.join_columns(bulk2, self.entries_equal),
+                                key=lambda pair: nastrandiff.card.natural_key((pair[0] or pair[1]).key))
+        else:
+            pairs = self.join_bulk(bulk1, bulk2)
+        for card1, card2 in pairs:
+            yield None if card1 is None else card1.format(), None if card2 is None else card2.format()
+
+    @staticmethod
+    def difference_lists(differences: iter) -> (list, list, list, list):
+        """
+        Returns lists of the formatted entries that are different in file 1 and in file 2, and those that are only in
+        file 1 and only in file 2, given differences as from bulk_differences
+        """
+        diff1 = []
+        diff2 = []
+        file1unique = []
+        file2unique = []
+        for entry1, entry2 in differences:
+            if entry2 is None:
+                file1unique.append(entry1)
+            elif entry1 is None:
+                file2unique.append(entry2)
+            else:
+                diff1.append(entry1)
+                diff2.append(entry2)
         return diff1, diff2, file1unique, file2unique
 
+    @staticmethod
+    def table_differences(diff1, diff2, unique1, unique2) -> (typing.Union[None, str], typing.Union[None, str]):
+        """
+        Yields the differences given as lists (as from compare_parsed_bulk) in the form of bulk_differences, in the
+        order of the rows of the bulk data table
+        """
+        yield from zip(diff1, diff2)
+        yield from ((u1, None) for u1 in unique1)
+        yield from ((None, u2) for u2 in unique2)
+
+    def compare_parsed_bulk(self, bulk1, bulk2) -> (list, list, list, list):
+        """
+        Compares bulk data parsed by parse_bulk_fields, returning the lists of difference_lists, sorted by key in
+        natural order (see bulk_differences). Only the entries that are different are formatted.
+        """
+        if self.progress:
+            print("Processing bulk data differences...")
+
+        with self._stage("compare") as stage:
+            results = self.difference_lists(self.bulk_differences(bulk1, bulk2))
+            stage.info.update(changed=len(results[0]), deleted=len(results[2]), added=len(results[3]))
+        return results
+
     def format_bde_html(self, bde: str, width: int = 8) -> str:
         if self.separators:
             fmt = '<span class = "bde_sep">{}</span>'
@@ -274,16 +1008,50 @@ class NastranDiff:
         for u2 in unique2:
             yield fmt_add % ("", self.format_bde_html(u2))
 
-    def make_table_bulk(self, diff1, diff2, unique1, unique2, from_desc, to_desc) -> str:
+    def write_table_differences(self, output: typing.TextIO, differences: iter, from_desc,
+                                to_desc) -> collections.Counter:
+        """
+        Writes the bulk data table of differences (as from bulk_differences) to output, in one pass over differences.
+        The changed entries come first, then the deleted and the added entries. Each row is formatted as it's written,
+        and the rows of the deleted and added entries are held in temporary files (in spill_dir) until the changed
+        entries have been written, so the table is never held in memory. Returns a Counter of the number of "changed",
+        "deleted" and "added" entries.
+        """
         header_row = '<thead><tr>%s%s</tr></thead>' % (
             '<th class="diff_header">%s</th>' % from_desc,
             '<th class="diff_header">%s</th>' % to_desc)
 
-        return self._table_template % dict(
-            data_rows=''.join(itertools.chain(self.generate_html_difference(diff1, diff2),
-                                              self.generate_html_subtractions(unique1),
-                                              self.generate_html_additions(unique2))),
-            header_row=header_row)
+        head, tail = self._table_template.split("%(data_rows)s")
+        output.write(head % dict(header_row=header_row))
+        counts = collections.Counter()
+        with tempfile.TemporaryFile("w+", dir=self.spill_dir) as deleted, \
+                tempfile.TemporaryFile("w+", dir=self.spill_dir) as added:
+            for entry1, entry2 in differences:
+                if entry2 is None:
+                    deleted.writelines(self.generate_html_subtractions((entry1,)))
+                    counts["deleted"] += 1
+                elif entry1 is None:
+                    added.writelines(self.generate_html_additions((entry2,)))
+                    counts["added"] += 1
+                else:
+                    output.writelines(self.generate_html_difference((entry1,), (entry2,)))
+                    counts["changed"] += 1
+            for f in (deleted, added):
+                f.seek(0)
+                shutil.copyfileobj(f, output)
+        output.write(tail % dict())
+        return counts
+
+    def write_table_bulk(self, output: typing.TextIO, diff1, diff2, unique1, unique2, from_desc, to_desc) -> None:
+        """
+        Writes the bulk data table of the differences returned by compare_bulk to output (see write_table_differences)
+        """
+        self.write_table_differences(output, self.table_differences(diff1, diff2, unique1, unique2), from_desc, to_desc)
+
+    def make_table_bulk(self, diff1, diff2, unique1, unique2, from_desc, to_desc) -> str:
+        table = io.StringIO()
+        self.write_table_bulk(table, diff1, diff2, unique1, unique2, from_desc, to_desc)
+        return table.getvalue()
 
     _file_template = """
     <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
@@ -345,40 +1113,124 @@ class NastranDiff:
     %(data_rows)s        </tbody>
         </table>"""
 
+    def check(self, fail_fast: bool = False) -> nastrandiff.check.CheckResult:
+        """
+        Checks whether file1 and file2 are equivalent to the solver, without finding the differences (see
+        nastrandiff.check.check_decks). This is much faster than calculate_diff and uses constant memory.
+        """
+        if self.metrics is not None:
+            self.metrics.begin()
+        result = nastrandiff.check.check_decks(self, fail_fast)
+        if self.metrics is not None:
+            self.metrics.end()
+        return result
+
     def calculate_diff(self) -> None:
-        df = difflib.HtmlDiff()
+        if self.metrics is not None:
+            self.metrics.begin()
+        self._calculate_diff()
+        if self.metrics is not None:
+            self.metrics.end()
+
+    def _calculate_diff(self) -> None:
+        # a snapshot has no INCLUDEd files to skip, and is only read whole
+        snapshot = self.has_snapshot()
+        skip1, skip2 = self.plan_incremental() if self.incremental and not snapshot else (None, None)
+        if self.output_format != "html":
+            writer = nastrandiff.structured.make_writer(self.output_format, self.output)
+            nastrandiff.structured.write_diff(self, writer, (skip1, skip2))
+            return
+        read_whole_decks = snapshot or self.memory_limit is None and \
+            (self.jobs > 1 or self.memory_map or (self.cache is not None and not self.incremental))
+        with contextlib.ExitStack() as stack:
+            if read_whole_decks:
+                (exec1, case1, bulk1), (exec2, case2, bulk2) = self.read_decks((skip1, skip2))
+            else:
+                includes1 = stack.enter_context(self.include_reader(self.file1))
+                includes2 = stack.enter_context(self.include_reader(self.file2))
+                # these generators share the position in each file, so they must be consumed in this order
+                exec1 = self.read_file(self.file1, "CEND", includes=includes1)
+                exec2 = self.read_file(self.file2, "CEND", includes=includes2)
+                case1 = self.read_file(self.file1, "BEGIN BULK", includes=includes1)
+                case2 = self.read_file(self.file2, "BEGIN BULK", includes=includes2)
+                bulk1 = self.read_file(self.file1, "ENDDATA", skip1, includes1)
+                bulk2 = self.read_file(self.file2, "ENDDATA", skip2, includes2)
+            table_exec, table_case = self.make_control_tables(exec1, exec2, case1, case2,
+                                                              from_desc=self.file1.name, to_desc=self.file2.name)
 
-        exec1 = self.read_file(self.file1, "CEND")
-        exec2 = self.read_file(self.file2, "CEND")
+            if read_whole_decks:
+                differences = self.bulk_differences(bulk1, bulk2)
+            elif self.memory_limit is not None:
+                spill_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="nastrandiff-", dir=self.spill_dir))
+                differences = self.external_differences(*self.sort_bulk_external(bulk1, bulk2, spill_dir))
+            else:
+                differences = self.bulk_differences(*self._parse_bulks(bulk1, bulk2))
+            self.write_report(table_exec, table_case, differences, from_desc=self.file1.name, to_desc=self.file2.name)
+
+    def make_control_tables(self, exec1, exec2, case1, case2, from_desc: str, to_desc: str) -> (str, str):
+        """
+        Returns the HTML tables comparing the executive control lines and the case control lines of two decks
+        """
+        df = difflib.HtmlDiff()
         if self.progress:
             print("Diffing executive control...")
-        table_exec = df.make_table(exec1, exec2,
-                                   fromdesc=self.file1.name, todesc=self.file2.name,
-                                   context=self.context is not None,
-                                   numlines=self.context if self.context is not None else 5)
+        with self._stage("exec_diff") as stage:
+            table_exec = df.make_table(stage.count_lines(exec1), stage.count_lines(exec2),
+                                       fromdesc=from_desc, todesc=to_desc,
+                                       context=self.context is not None,
+                                       numlines=self.context if self.context is not None else 5)
 
-        case1 = self.read_file(self.file1, "BEGIN BULK")
-        case2 = self.read_file(self.file2, "BEGIN BULK")
         if self.progress:
             print("Diffing case control...")
-        table_case = df.make_table(case1, case2,
-                                   fromdesc=self.file1.name, todesc=self.file2.name,
-                                   context=self.context is not None,
-                                   numlines=self.context if self.context is not None else 5)
+        with self._stage("case_diff") as stage:
+            # compared by subcase, so reordered subcases aren't differences (see nastrandiff.casecontrol)
+            table_case = nastrandiff.casecontrol.make_table(df, stage.count_lines(case1), stage.count_lines(case2),
+                                                            fromdesc=from_desc, todesc=to_desc,
+                                                            context=self.context is not None,
+                                                            numlines=self.context if self.context is not None else 5)
+        return table_exec, table_case
 
-        bulk1 = self.read_file(self.file1, "ENDDATA")
-        bulk2 = self.read_file(self.file2, "ENDDATA")
-        bulk1diff, bulk2diff, bulk1unique, bulk2unique = self.compare_bulk(bulk1, bulk2)
+    def _compare_stage(self, differences: iter, render: nastrandiff.metrics.StageMetrics) -> iter:
+        # Yields differences, timing them as the "compare" stage (nested in render, see StageMetrics.timed), which is
+        # recorded with the number of each kind of difference once they've all been yielded
+        if self.metrics is None:
+            yield from differences
+            return
+        stage = nastrandiff.metrics.StageMetrics("compare")
+        render.nested.append(stage)
+        counts = collections.Counter(changed=0, deleted=0, added=0)
+        for entry1, entry2 in stage.timed(differences):
+            counts["deleted" if entry2 is None else "added" if entry1 is None else "changed"] += 1
+            yield entry1, entry2
+        stage.info.update(counts)
+        stage.measure_memory()
+        self.metrics.record(stage)
 
+    def write_report(self, table_exec: str, table_case: str, differences: iter, from_desc: str, to_desc: str) -> None:
+        """
+        Writes the report to output (or to report_dir), given the tables from make_control_tables and the bulk data
+        differences (as from bulk_differences, or table_differences), which are compared as the report is written
+        """
         if self.progress:
+            print("Processing bulk data differences...")
             print("Diffing bulk data...")
-        table_bulk = self.make_table_bulk(bulk1diff, bulk2diff, bulk1unique, bulk2unique,
-                                          from_desc=self.file1.name, to_desc=self.file2.name)
-
-        diff = self._file_template % dict(
-            styles=self._styles,
-            legend=self._legend,
-            table_exec=table_exec,
-            table_case=table_case,
-            table_bulk=table_bulk)
-        self.output.write(diff)
+        with self._stage("render") as stage:
+            differences = self._compare_stage(differences, stage)
+            if self.report_dir is not None:
+                report = nastrandiff.report.PaginatedReport(self, self.report_dir, self.page_size)
+                report.write(table_exec, table_case, differences, from_desc=from_desc, to_desc=to_desc)
+                counts = report.counts
+                stage.lines = sum(counts.values())  # the rows of the bulk data table
+                stage.info.update(counts)
+                return
+            # the report is written in pieces, so the bulk data table (which may be very large) is never held in memory
+            head, tail = self._file_template.split("%(table_bulk)s")
+            self.output.write(head % dict(
+                styles=self._styles,
+                legend=self._legend,
+                table_exec=table_exec,
+                table_case=table_case))
+            counts = self.write_table_differences(self.output, differences, from_desc=from_desc, to_desc=to_desc)
+            self.output.write(tail % dict())
+            stage.lines = sum(counts.values())
+            stage.info.update(counts)
@@ -0,0 +1,312 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Diffs many candidate decks against one baseline. The baseline is read and parsed once and shared (read-only) with a
+pool of worker processes, which each read one candidate at a time and write its report. A summary of the number of
+differences in each card type of each candidate is written alongside the reports.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import csv
+import difflib
+import glob
+import html
+import os
+import re
+
+import nastrandiff
+import nastrandiff.casecontrol
+import nastrandiff.columnar
+import nastrandiff.report
+import nastrandiff.snapshot
+
+CandidateResult = collections.namedtuple("CandidateResult", ["candidate", "report", "exec_changes", "case_changes",
+                                                             "cards", "messages", "error"])
+CandidateResult.__doc__ = """
+The result of diffing one candidate against the baseline.
+
+- candidate: The file name of the candidate
+- report: The file name of its report, relative to the output directory (None if there was an error)
+- exec_changes: The number of blocks of executive control lines that differ
+- case_changes: The number of case control blocks (see nastrandiff.casecontrol) that differ
+- cards: A dict mapping each card type with differences to a (changed, deleted, added) tuple of the number of entries
+- messages: Anything printed while reading the candidate (e.g. warnings)
+- error: None, or a message describing why the candidate couldn't be diffed
+"""
+
+# The baseline deck and the NastranDiff holding the options, in a worker process (see _init_worker)
+_baseline = None
+_template = None
+
+
+def expand_candidates(patterns: list) -> list:
+    """
+    Returns the file names matching a list of file names and glob patterns, in order and without duplicates
+    """
+    candidates = []
+    for pattern in patterns:
+        for file_name in sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]:
+            if file_name not in candidates:
+                candidates.append(file_name)
+    return candidates
+
+
+def report_names(candidates: list) -> list:
+    """
+    Returns a distinct report file name for each candidate, based on its path relative to the directory holding all
+    of the candidates (so "a/deck.bdf" and "b/deck.bdf" are reported in "a_deck.html" and "b_deck.html")
+    """
+    names = []
+    used = set()
+    paths = [os.path.abspath(c) for c in candidates]
+    common = os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else ""
+    for path in paths:
+        base = re.sub("[^A-Za-z0-9_.-]", "_", os.path.splitext(os.path.relpath(path, common))[0])
+        name = base + ".html"
+        n = 1
+        while name.lower() in used or name.lower() == "summary.html":
+            n += 1
+            name = "{}-{}.html".format(base, n)
+        used.add(name.lower())
+        names.append(name)
+    return names
+
+
+def _init_worker(baseline: tuple, template: "nastrandiff.NastranDiff") -> None:
+    # Executed in each worker process. With the fork start method, the arguments are inherited rather than pickled.
+    global _baseline, _template
+    _baseline = baseline
+    _template = template
+
+
+def count_cards(differences: iter, counts: dict) -> iter:
+    """
+    Yields differences (as from NastranDiff.bulk_differences), adding the number of entries of each card type that
+    are changed, deleted and added to counts, a dict mapping each card type to a [changed, deleted, added] list
+    """
+    for entry1, entry2 in differences:
+        i = 1 if entry2 is None else 2 if entry1 is None else 0
+        bde_name = nastrandiff.report.card_type(entry1 or entry2)
+        if bde_name not in counts:
+            counts[bde_name] = [0, 0, 0]
+        counts[bde_name][i] += 1
+        yield entry1, entry2
+
+
+def _diff_candidate(candidate: str, report: str) -> CandidateResult:
+    # Executed in a worker process (or in this process, with one job). Writes the report of one candidate. Any error is
+    # recorded as the candidate's error, so that the other candidates are still diffed.
+    try:
+        return _write_candidate_report(candidate, report)
+    except Exception as e:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(report)  # it may be incomplete
+        if isinstance(e, nastrandiff.DeckError):
+            error = str(e)
+        else:
+            error = "{}: {}: {}".format(candidate, type(e).__name__, e)
+        return CandidateResult(candidate, None, 0, 0, {}, "", error)
+
+
+def _write_candidate_report(candidate: str, report: str) -> CandidateResult:
+    exec1, case1, bulk1, baseline_name = _baseline
+    nd = copy.copy(_template)
+    exec2, case2, bulk2, messages, _ = nastrandiff.NastranDiff._read_deck_worker(candidate, 1, None,
+                                                                                nd.parse_options())
+    table_exec, table_case = nd.make_control_tables(exec1, exec2, case1, case2,
+                                                    from_desc=baseline_name, to_desc=candidate)
+    counts = {}
+    with open(report, "w") as nd.output:
+        nd.write_report(table_exec, table_case, count_cards(nd.bulk_differences(bulk1, bulk2), counts),
+                        from_desc=baseline_name, to_desc=candidate)
+    exec_changes = sum(tag != "equal" for tag, _, _, _, _ in
+                       difflib.SequenceMatcher(None, exec1, exec2, autojunk=False).get_opcodes())
+    case_changes = sum(1 for _ in nastrandiff.casecontrol.changed_blocks(nastrandiff.casecontrol.split_blocks(case1),
+                                                                         nastrandiff.casecontrol.split_blocks(case2)))
+    return CandidateResult(candidate, os.path.basename(report), exec_changes, case_changes,
+                           {name: tuple(c) for name, c in sorted(counts.items())}, messages, None)
+
+
+class BatchDiff:
+    """
+    Diffs each of a list of candidate decks against a baseline deck, writing a report for each candidate and a
+    summary (summary.html and summary.csv) to a directory.
+
+    Members:
+
+    - nd: The NastranDiff holding the options (context, separators, tolerances, columnar_types, memory_map, cache,
+      progress and metrics). nd.jobs is the number of worker processes diffing candidates at the same time.
+    - baseline: The file name of the baseline deck
+    - candidates: The file names of the candidate decks
+    - directory: The directory where the reports and summary are written
+    - results: The CandidateResult of each candidate, in the order of candidates, after run
+    """
+    def __init__(self, nd: "nastrandiff.NastranDiff", baseline: str, candidates: list, directory: str):
+        self.nd = nd
+        self.baseline = baseline
+        self.candidates = candidates
+        self.directory = directory
+        self.results = []
+
+    def read_baseline(self) -> (list, list, dict):
+        """
+        Reads and parses the baseline (from the cache, when possible), returning (exec_lines, case_lines, bulk). The
+        baseline can be a snapshot (see nastrandiff.snapshot).
+        """
+        nd = self.nd
+        with nd._stage("read_baseline") as stage:
+            key = None
+            if nd.cache is not None and not nastrandiff.snapshot.is_snapshot(self.baseline):
+                try:
+                    key = nd.cache.key(nastrandiff.NastranDiff.include_tree(self.baseline), nd.cache_variant())
+                except OSError as e:
+                    raise nastrandiff.DeckError(self.baseline, "{}: {}".format(type(e).__name__, e)) from e
+                deck = nd.cache.get(key)
+                if deck is not None:
+                    stage.count_cards(deck[2])
+                    return deck
+            exec_lines, case_lines, bulk, messages, _ = nastrandiff.NastranDiff._read_deck_worker(
+                self.baseline, nd.jobs, None, nd.parse_options())
+            print(messages, end="")
+            stage.count_cards(bulk)
+            if key is not None:
+                nd.cache.put(key, (exec_lines, case_lines, bulk))
+            return exec_lines, case_lines, bulk
+
+    def _template(self, baseline_bulk) -> "nastrandiff.NastranDiff":
+        # A copy of nd that can be sent to the worker processes. The candidates are parsed with the columnar types of
+        # the baseline (which differ from nd's if it's a snapshot), so that they can be compared without conversion.
+        template = copy.copy(self.nd)
+        if isinstance(baseline_bulk, nastrandiff.columnar.ColumnarBulk):
+            template.columnar_types = baseline_bulk.columnar_types
+        template.file1 = None
+        template.file2 = None
+        template.output = None
+        template.report_dir = None
+        template.cache = None
+        template.metrics = None
+        template.progress = False
+        return template
+
+    def run(self) -> list:
+        """
+        Diffs the candidates and writes the reports and summary, returning the results
+        """
+        nd = self.nd
+        if nd.metrics is not None:
+            nd.metrics.begin()
+        os.makedirs(self.directory, exist_ok=True)
+        if nd.progress:
+            print("Reading the baseline...")
+        baseline = self.read_baseline() + (self.baseline,)
+        reports = [os.path.join(self.directory, name) for name in report_names(self.candidates)]
+        self.results = []
+        with nd._stage("diff_candidates") as stage, contextlib.ExitStack() as stack:
+            if nd.jobs > 1:
+                executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                    max_workers=nd.jobs, initializer=_init_worker, initargs=(baseline, self._template(baseline[2]))))
+                results = executor.map(_diff_candidate, self.candidates, reports)
+            else:
+                _init_worker(baseline, self._template(baseline[2]))
+                stack.callback(_init_worker, None, None)
+                results = map(_diff_candidate, self.candidates, reports)
+            for result in results:
+                print(result.messages, end="")
+                if result.error is not None:
+                    print("Error: {}".format(result.error))
+                elif nd.progress:
+                    print("Diffed {} ({} of {})".format(result.candidate, len(self.results) + 1, len(self.candidates)))
+                self.results.append(result)
+            stage.info["candidates"] = len(self.results)
+            stage.info["errors"] = sum(r.error is not None for r in self.results)
+        self.write_summary()
+        if nd.metrics is not None:
+            nd.metrics.end()
+        return self.results
+
+    def card_types(self) -> list:
+        """
+        Returns the card types with differences in any candidate, in order
+        """
+        return sorted(set(name for r in self.results for name in r.cards))
+
+    def write_summary(self) -> None:
+        """
+        Writes summary.csv, with a row for each candidate and a column with the number of entries of each card type
+        that differ, and summary.html, which also links to the reports
+        """
+        card_types = self.card_types()
+        with open(os.path.join(self.directory, "summary.csv"), "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["candidate", "report", "error", "exec", "case", "bulk"] + card_types)
+            for r in self.results:
+                writer.writerow([r.candidate, r.report, r.error, r.exec_changes, r.case_changes,
+                                 sum(sum(c) for c in r.cards.values())] +
+                                [sum(r.cards.get(name, (0, 0, 0))) for name in card_types])
+
+        rows = []
+        for r in self.results:
+            if r.error is not None:
+                rows.append(self._error_row_template % dict(candidate=html.escape(r.candidate),
+                                                            error=html.escape(r.error), columns=len(card_types) + 3))
+                continue
+            cells = []
+            for name in card_types:
+                changed, deleted, added = r.cards.get(name, (0, 0, 0))
+                cells.append('<td title="{} changed, {} deleted, {} added">{}</td>'.format(
+                    changed, deleted, added, changed + deleted + added) if changed + deleted + added else "<td></td>")
+            rows.append(self._row_template % dict(candidate=html.escape(r.candidate), report=html.escape(r.report),
+                                                  exec=r.exec_changes, case=r.case_changes,
+                                                  bulk=sum(sum(c) for c in r.cards.values()), cells="".join(cells)))
+        with open(os.path.join(self.directory, "summary.html"), "w") as f:
+            f.write(self._summary_template % dict(
+                styles=self.nd._styles,
+                baseline=html.escape(self.baseline),
+                headers="".join("<th>{}</th>".format(html.escape(name)) for name in card_types),
+                rows="".join(rows)))
+
+    _summary_template = """
+    <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+              "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+    <html>
+    <head>
+        <meta http-equiv="Content-Type"
+              content="text/html; charset=ISO-8859-1" />
+        <title>Summary</title>
+        <style type="text/css">%(styles)s
+        </style>
+    </head>
+    <body>
+        <h2>Differences from %(baseline)s</h2>
+        <p>The number of blocks of executive control lines and of case control subcases that differ, and the number of
+        bulk data entries of each card type that are changed, deleted or added.</p>
+        <table class="diff" summary="Summary">
+            <tr><th>Candidate</th><th>Executive Control</th><th>Case Control</th><th>Bulk Data</th>
+                %(headers)s</tr>%(rows)s
+        </table>
+    </body>
+    </html>"""
+
+    _row_template = """
+            <tr><td><a href="%(report)s">%(candidate)s</a></td><td>%(exec)d</td><td>%(case)d</td><td>%(bulk)d</td>
+                %(cells)s</tr>"""
+
+    _error_row_template = """
+            <tr><td>%(candidate)s</td><td colspan="%(columns)d" class="diff_sub">%(error)s</td></tr>"""
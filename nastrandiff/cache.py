@@ -0,0 +1,141 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import pickle
+import tempfile
+import typing
+import zlib
+
+# Increment this whenever the parsed representation of a deck changes, so that old entries are no longer used
+CACHE_VERSION = 5
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "nastrandiff")
+
+
+class DeckCache:
+    """
+    A persistent on-disk cache of parsed decks.
+
+    Each entry is keyed by a hash of the contents of the root file of a deck and of every file that it INCLUDEs (see
+    NastranDiff.include_tree), so a change to any file in the deck results in a new key. Entries are stored as
+    compressed pickles. When the entries take more than max_size bytes, the least recently used ones are removed.
+
+    Members:
+
+    - directory: The directory holding the cache entries
+    - max_size: The maximum total size of the entries, in bytes
+    - hits: The number of entries found by get
+    - misses: The number of entries not found by get
+    - evictions: The number of entries removed to stay below max_size
+    """
+    _suffix = ".ndcache"
+
+    def __init__(self, directory: str = None, max_size: int = 1024 ** 3):
+        self.directory = directory if directory is not None else default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(include_tree: tuple, variant: str = "") -> str:
+        """
+        Returns the key of a deck. variant distinguishes decks parsed with different options.
+        """
+        # the digest of the root of the tree covers all of the included files
+        return hashlib.sha256("nastrandiff-cache-{}-{}-{}".format(CACHE_VERSION, variant,
+                                                                  include_tree[1]).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self._suffix)
+
+    def get(self, key: str) -> typing.Union[None, tuple]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                deck = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            # a corrupt entry (for example, from a process that was killed while writing) is treated as a miss
+            self._remove(path)
+            self.misses += 1
+            return None
+        os.utime(path)  # the modification time records when the entry was last used
+        self.hits += 1
+        return deck
+
+    def put(self, key: str, deck: tuple) -> None:
+        data = zlib.compress(pickle.dumps(deck, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        # write to a temporary file first so that other processes never see a partially written entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def entries(self) -> list:
+        """
+        Returns a list of (modification time, size, path) for the entries, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self._suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self) -> None:
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            self.evictions += 1
+            total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        return dict(directory=self.directory,
+                    entries=len(entries),
+                    size=sum(e[1] for e in entries),
+                    max_size=self.max_size,
+                    hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions)
+
+    def format_stats(self) -> str:
+        return """Cache directory: {directory}
+Cache entries: {entries} ({size} of {max_size} bytes)
+Cache hits: {hits}, misses: {misses}, evictions: {evictions}""".format(**self.stats())
@@ -0,0 +1,153 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import itertools
+import typing
+
+import nastrandiff
+
+# Card types that can have more than one entry with the same ID, mapped to the positions of the fields (on the first
+# line) that are also part of the key
+multi_field_keys = {"PLOAD4": [1],
+                    "FORCE": [1],
+                    "SPC": [1],
+                    "SPC1": [2],
+                    "TEMP": [1],
+                    "MPC": [1],
+                    "DMIG": [1, 2]}
+
+# Card types are identified by their name packed into an integer (8 bytes or less, as the names of all NASTRAN card
+# types are), so the numbers are the same in every process and sort in the same order as the names. The names are
+# interned as they're seen so that converting between the two is a dict lookup.
+_type_ids = {}
+_type_names = {}
+
+
+def type_id(bde_name: str) -> int:
+    i = _type_ids.get(bde_name)
+    if i is None:
+        i = int.from_bytes(bde_name.encode().ljust(8, b"\0"), "big")
+        _type_ids[bde_name] = i
+        _type_names[i] = bde_name
+    return i
+
+
+def type_name(i: int) -> str:
+    name = _type_names.get(i)
+    if name is None:
+        name = i.to_bytes(max(8, (i.bit_length() + 7) // 8), "big").rstrip(b"\0").decode()
+        type_id(name)
+    return name
+
+
+def natural_key(key: tuple) -> tuple:
+    """
+    Returns a tuple that sorts keys (see Card) in their natural order: by card type, then numerically by the ID and the
+    other key fields. Character fields sort after numbers, so keys with both can be compared.
+    """
+    return (key[0],) + tuple((1, k) if type(k) is str else (0, k) for k in key[1:])
+
+
+def fields_digest(fields: tuple) -> bytes:
+    """
+    Returns a digest of the fields of an entry. Entries have the same digest only if their fields have the same values
+    and types, so they're formatted the same. The digest is the same in every process.
+    """
+    return hashlib.blake2b(repr(fields).encode(), digest_size=16).digest()
+
+
+class Card:
+    """
+    A parsed bulk data entry. It holds the parsed fields rather than the formatted entry, which is only produced (by
+    format) for the entries that are in the report.
+
+    Members:
+
+    - type_id: The number of the card type (see type_id)
+    - key: The key identifying the entry in the deck: a tuple of type_id, the ID and, for the card types in
+      multi_field_keys, the other fields that are part of the key
+    - fields: A tuple of the fields of the entry, including those on continuation lines
+    - layout: None if the entry is on one line; otherwise, a tuple of the number of fields on each line
+    - digest: The digest of the fields (see fields_digest), which is computed as the entry is parsed so that
+      identical entries are found without comparing their fields
+    """
+    __slots__ = ("type_id", "key", "fields", "layout", "digest")
+
+    def __init__(self, bde_name: str, lines: list):
+        """
+        lines is a list holding the list of parsed fields of the first line and of each continuation line, as from
+        NastranDiff.generate_bulk_fields
+        """
+        self.type_id = type_id(bde_name)
+        first = lines[0]
+        if len(lines) == 1:
+            self.fields = tuple(first)
+            self.layout = None
+        else:
+            self.fields = tuple(itertools.chain.from_iterable(lines))
+            self.layout = tuple(len(line) for line in lines)
+        self.digest = fields_digest(self.fields)
+        if bde_name in multi_field_keys:
+            self.key = (self.type_id, first[0]) + tuple(first[i] for i in multi_field_keys[bde_name])
+        else:
+            self.key = (self.type_id, first[0])
+
+    @classmethod
+    def from_fields(cls, bde_name: str, key_fields: tuple, fields: tuple, layout: typing.Union[None, tuple]) -> "Card":
+        """
+        Makes a Card from its members, with key_fields being the key without the type number
+        """
+        card = cls.__new__(cls)
+        card.type_id = type_id(bde_name)
+        card.key = (card.type_id,) + key_fields
+        card.fields = fields
+        card.layout = layout
+        card.digest = fields_digest(fields)
+        return card
+
+    @property
+    def name(self) -> str:
+        return type_name(self.type_id)
+
+    def lines(self) -> list:
+        """
+        Returns the fields split into lines, as they were passed to the constructor
+        """
+        if self.layout is None:
+            return [list(self.fields)]
+        lines = []
+        start = 0
+        for n in self.layout:
+            lines.append(list(self.fields[start:start + n]))
+            start += n
+        return lines
+
+    def format(self) -> str:
+        return nastrandiff.NastranDiff.format_entry(self.name, self.lines())
+
+    def key_string(self) -> str:
+        """
+        Returns the key as a string (the BDE name followed by the key fields, each formatted in 8 characters), as used
+        by parse_bulk_data. The entries in the report are sorted by this.
+        """
+        return self.name + "".join(["{:8}".format(k) for k in self.key[1:]])
+
+    def __eq__(self, other):
+        return isinstance(other, Card) and self.type_id == other.type_id and self.fields == other.fields and \
+            self.layout == other.layout
+
+    def __repr__(self):
+        return "Card({!r}, {!r})".format(self.name, self.lines())
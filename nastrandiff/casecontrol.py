@@ -0,0 +1,246 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Compares case control sections by their structure. A section is split into blocks: the lines before the first
+subcase, and each SUBCASE (or SUBCOM, SYMCOM, REPCASE or OUTPUT) with the lines that follow it. Blocks are matched by
+their ID, so reordered subcases aren't differences, and only the lines of blocks that differ are diffed. The cost
+depends on the number and size of the changed blocks rather than on the size of the section.
+"""
+
+import collections
+import difflib
+import html
+import re
+import typing
+
+# A line starting a block: SUBCASE (which can be abbreviated to SUBC), SUBCOM, SYMCOM and REPCASE followed by their ID,
+# or OUTPUT(PLOT), OUTPUT(XYPLOT), etc.
+_block_regex = re.compile(r"\s*(?:(SUBCOM|SYMCOM|REPCASE|SUBC(?:ASE|AS|A)?)\s*=?\s*(\d+)|(OUTPUT\s*\(\s*\w+\s*\)))",
+                          re.IGNORECASE)
+
+# The kinds of blocks, in the order that they're reported when they have the same ID
+_kind_order = {"": 0, "SUBCASE": 1, "SUBCOM": 2, "SYMCOM": 3, "REPCASE": 4, "OUTPUT": 5}
+
+Block = collections.namedtuple("Block", ["key", "start", "lines"])
+Block.__doc__ = """
+A block of a case control section.
+
+- key: (kind, ID, n), where kind is "" for the lines before the first subcase (with ID 0), "SUBCASE", "SUBCOM",
+  "SYMCOM", "REPCASE" or "OUTPUT" (where the ID is the name, e.g. "PLOT"); n counts the earlier blocks with the same
+  kind and ID (which are errors, but are still compared)
+- start: The index of the first line of the block in the section
+- lines: A tuple of the lines of the block
+"""
+
+
+def block_start(line: str) -> typing.Union[None, tuple]:
+    """
+    Returns the (kind, ID) of a block if line starts one, or None
+    """
+    r = _block_regex.match(line)
+    if r is None:
+        return None
+    if r.group(3) is not None:
+        return "OUTPUT", re.sub(r"\s", "", r.group(3)).upper()[7:-1]
+    kind = r.group(1).upper()
+    return "SUBCASE" if kind.startswith("SUBCA") or kind == "SUBC" else kind, int(r.group(2))
+
+
+def split_blocks(lines: list) -> list:
+    """
+    Splits the lines of a case control section into Blocks, in order. The first block holds the lines before the
+    first subcase, and may be empty.
+    """
+    blocks = []
+    counts = collections.Counter()
+    key = ("", 0, 0)
+    start = 0
+    for i, line in enumerate(lines):
+        kind_id = block_start(line)
+        if kind_id is None:
+            continue
+        blocks.append(Block(key, start, tuple(lines[start:i])))
+        key = kind_id + (counts[kind_id],)
+        counts[kind_id] += 1
+        start = i
+    blocks.append(Block(key, start, tuple(lines[start:])))
+    return blocks
+
+
+def has_blocks(lines: list) -> bool:
+    """
+    Returns True if a case control section has any subcases (or other blocks)
+    """
+    return any(block_start(line) is not None for line in lines)
+
+
+def _sort_key(key: tuple) -> tuple:
+    # Blocks are reported by ID, with the lines before the first subcase first
+    kind, i, n = key
+    return (kind != "", type(i) is str, i, _kind_order[kind], n)
+
+
+def match_blocks(blocks1: list, blocks2: list) -> (Block, Block):
+    """
+    Matches the blocks of two case control sections (from split_blocks) by key, yielding (block1, block2) for each
+    block, sorted by ID. block2 is None for blocks only in the first section and block1 is None for blocks only in the
+    second.
+    """
+    by_key1 = {b.key: b for b in blocks1}
+    by_key2 = {b.key: b for b in blocks2}
+    for key in sorted(set(by_key1) | set(by_key2), key=_sort_key):
+        yield by_key1.get(key), by_key2.get(key)
+
+
+def changed_blocks(blocks1: list, blocks2: list) -> (Block, Block):
+    """
+    The same as match_blocks, but only yielding the blocks that are different
+    """
+    for block1, block2 in match_blocks(blocks1, blocks2):
+        if block1 is None or block2 is None or block1.lines != block2.lines:
+            yield block1, block2
+
+
+def block_name(key: tuple) -> str:
+    kind, i, n = key
+    if kind == "":
+        return "Before the first subcase"
+    name = "OUTPUT({})".format(i) if kind == "OUTPUT" else "{} {}".format(kind, i)
+    return name if n == 0 else "{} (repeated {})".format(name, n)
+
+
+def _ranges(ids: list) -> str:
+    # Formats sorted integers as ranges, e.g. "1-3, 5"
+    ranges = []
+    for i in ids:
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ", ".join(str(a) if a == b else "{}-{}".format(a, b) for a, b in ranges)
+
+
+def _block_diffs(df: difflib.HtmlDiff, blocks1: list, blocks2: list) -> tuple:
+    # Yields the side by side lines of the matched blocks in the form of difflib._mdiff (without context), with a
+    # separator (None, None, None) between the blocks. The lines of the blocks that are the same are yielded as equal
+    # lines, and only the blocks that differ are diffed by difflib.
+    first = True
+    for block1, block2 in match_blocks(blocks1, blocks2):
+        if not first:
+            yield None, None, None
+        first = False
+        start1 = block1.start if block1 is not None else 0
+        start2 = block2.start if block2 is not None else 0
+        lines1, lines2 = df._tab_newline_replace(list(block1.lines) if block1 is not None else [],
+                                                 list(block2.lines) if block2 is not None else [])
+        if block1 is not None and block2 is not None and block1.lines == block2.lines:
+            for i, line in enumerate(lines1):
+                yield (start1 + i + 1, line), (start2 + i + 1, line), False
+            continue
+        for (n1, line1), (n2, line2), flag in difflib._mdiff(lines1, lines2, None, linejunk=df._linejunk,
+                                                             charjunk=df._charjunk):
+            yield (start1 + n1 if n1 != "" else n1, line1), (start2 + n2 if n2 != "" else n2, line2), flag
+
+
+def _make_block_table(df: difflib.HtmlDiff, blocks1: list, blocks2: list, fromdesc: str, todesc: str,
+                      numlines: int) -> str:
+    # The same as df.make_table without context (and using its private methods to format the rows), with the lines
+    # from _block_diffs, so that there is a single table however many blocks there are
+    df._make_prefix()
+    diffs = _block_diffs(df, blocks1, blocks2)
+    if df._wrapcolumn:
+        diffs = df._line_wrapper(diffs)
+    fromlist, tolist, flaglist = df._collect_lines(diffs)
+    fromlist, tolist, flaglist, next_href, next_id = df._convert_flags(fromlist, tolist, flaglist, False, numlines)
+
+    rows = []
+    fmt = '            <tr><td class="diff_next"%s>%s</td>%s<td class="diff_next">%s</td>%s</tr>\n'
+    for i in range(len(flaglist)):
+        if flaglist[i] is None:
+            rows.append('        </tbody>        \n        <tbody>\n')
+        else:
+            rows.append(fmt % (next_id[i], next_href[i], fromlist[i], next_href[i], tolist[i]))
+    if fromdesc or todesc:
+        header_row = '<thead><tr>%s%s%s%s</tr></thead>' % (
+            '<th class="diff_next"><br /></th>',
+            '<th colspan="2" class="diff_header">%s</th>' % fromdesc,
+            '<th class="diff_next"><br /></th>',
+            '<th colspan="2" class="diff_header">%s</th>' % todesc)
+    else:
+        header_row = ''
+    table = df._table_template % dict(data_rows="".join(rows), header_row=header_row, prefix=df._prefix[1])
+    return table.replace("\0+", '<span class="diff_add">').replace("\0-", '<span class="diff_sub">'). \
+        replace("\0^", '<span class="diff_chg">').replace("\1", "</span>").replace("\t", "&nbsp;")
+
+
+def make_table(df: difflib.HtmlDiff, lines1: list, lines2: list, fromdesc: str = "", todesc: str = "",
+               context: bool = False, numlines: int = 5) -> str:
+    """
+    Returns the HTML comparing two case control sections. Sections without subcases are compared with
+    df.make_table, as for the executive control. Otherwise, without context, there is a single table (formatted as
+    by df.make_table) with the blocks in order of their IDs, where the lines of the blocks that are the same are
+    written as they are and only the blocks that differ are diffed. With context, only the blocks that are different
+    have a table (from df.make_table), and the blocks that are the same are listed.
+    """
+    lines1 = list(lines1)
+    lines2 = list(lines2)
+    if not has_blocks(lines1) and not has_blocks(lines2):
+        return df.make_table(lines1, lines2, fromdesc=fromdesc, todesc=todesc, context=context, numlines=numlines)
+
+    blocks1 = split_blocks(lines1)
+    blocks2 = split_blocks(lines2)
+    parts = []
+    keys1 = set(b.key for b in blocks1)
+    keys2 = set(b.key for b in blocks2)
+    if [b.key for b in blocks1 if b.key in keys2] != [b.key for b in blocks2 if b.key in keys1]:
+        parts.append("<p>The subcases are in a different order.</p>\n")
+    if not context:
+        parts.append(_make_block_table(df, blocks1, blocks2, fromdesc, todesc, numlines))
+        return "".join(parts)
+
+    same = collections.defaultdict(list)
+    tables = []
+    for block1, block2 in match_blocks(blocks1, blocks2):
+        block = block1 if block1 is not None else block2
+        if block1 is not None and block2 is not None and block1.lines == block2.lines:
+            same[block.key[0]].append(block.key[1])
+            continue
+        where = []
+        for desc, b in ((fromdesc, block1), (todesc, block2)):
+            if b is not None:
+                if len(b.lines) == 1:
+                    where.append("line {} of {}".format(b.start + 1, desc))
+                else:
+                    where.append("lines {}-{} of {}".format(b.start + 1, b.start + len(b.lines), desc))
+        tables.append("<h3>{} ({})</h3>\n".format(html.escape(block_name(block.key)), html.escape(", ".join(where))))
+        tables.append(df.make_table(list(block1.lines) if block1 is not None else [],
+                                    list(block2.lines) if block2 is not None else [],
+                                    fromdesc=fromdesc, todesc=todesc, context=context, numlines=numlines))
+    if len(tables) == 0:
+        tables.append("<p>No differences.</p>\n")
+
+    summary = []
+    for kind in sorted(same, key=_kind_order.get):
+        if kind == "":
+            summary.append("the lines before the first subcase")
+        elif kind == "OUTPUT":
+            summary.append(", ".join("OUTPUT({})".format(i) for i in same[kind]))
+        else:
+            summary.append("{} {}".format(kind, _ranges(sorted(set(same[kind])))))
+    if summary:
+        parts.append("<p>The same in both files: {}.</p>\n".format(html.escape("; ".join(summary))))
+    return "".join(parts + tables)
@@ -0,0 +1,205 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+import contextlib
+import hashlib
+import itertools
+import re
+
+import nastrandiff
+import nastrandiff.casecontrol
+import nastrandiff.prefetch
+import nastrandiff.snapshot
+
+# The exit code of nastrandiff.py --check when the decks aren't equivalent. 1 is used by Python for uncaught errors.
+EXIT_DIFFERENT = 3
+
+_SECTIONS = (("exec", "CEND"), ("case", "BEGIN BULK"), ("bulk", "ENDDATA"))
+
+_equals_regex = re.compile("\\s*=\\s*")
+
+_MULTISET_MODULUS = 1 << 128
+
+Fingerprint = collections.namedtuple("Fingerprint", ["digest", "count"])
+
+
+def normalize_control_line(line: str) -> str:
+    """
+    Returns an executive or case control line with the comment removed and whitespace normalized (so "LOAD=1" and
+    "  LOAD = 1" are the same), or an empty string if nothing remains
+    """
+    if "$" in line:
+        line = line[0:line.find("$")]
+    return _equals_regex.sub("=", " ".join(line.split()))
+
+
+def _control_lines(lines: iter) -> str:
+    # Yields the normalized lines of an executive or case control section that aren't blank
+    for line in lines:
+        line = normalize_control_line(line)
+        if len(line) > 0:
+            yield line
+
+
+def control_fingerprints(lines1: iter, lines2: iter, fail_fast: bool = False) -> (Fingerprint, Fingerprint):
+    """
+    Returns the fingerprints of two executive control sections (see control_fingerprint), reading the lines of both
+    in one pass. If fail_fast is True, no more lines are read after the first one that is different, so the
+    fingerprints (which are then different) only cover the lines up to it.
+    """
+    hashes = (hashlib.sha256(), hashlib.sha256())
+    counts = [0, 0]
+    for pair in itertools.zip_longest(_control_lines(lines1), _control_lines(lines2)):
+        for i, line in enumerate(pair):
+            if line is not None:
+                hashes[i].update(line.encode() + b"\n")
+                counts[i] += 1
+        if fail_fast and pair[0] != pair[1]:
+            break
+    return tuple(Fingerprint(h.hexdigest(), count) for h, count in zip(hashes, counts))
+
+
+def control_fingerprint(lines: iter) -> Fingerprint:
+    """
+    Returns the fingerprint of an executive control section: a hash of the normalized lines, in order (the order of
+    these lines matters to the solver), and the number of lines that aren't blank
+    """
+    return control_fingerprints(lines, ())[0]
+
+
+def _digest(text: str) -> int:
+    # A 128-bit hash, which is added to the others in a multiset
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=16).digest(), "big")
+
+
+def case_fingerprint(lines: iter) -> Fingerprint:
+    """
+    Returns the fingerprint of a case control section: a hash of the multiset of its blocks (see
+    nastrandiff.casecontrol.split_blocks), each hashed from its normalized lines in order, so reordered subcases have
+    the same fingerprint, and the number of lines that aren't blank
+    """
+    lines = list(_control_lines(lines))
+    total = 0
+    for block in nastrandiff.casecontrol.split_blocks(lines):
+        if len(block.lines) > 0:
+            total = (total + _digest("\n".join(block.lines))) % _MULTISET_MODULUS
+    return Fingerprint("{:032x}".format(total), len(lines))
+
+
+def card_digest(card: "nastrandiff.card.Card") -> int:
+    """
+    Returns a 128-bit hash of a bulk data entry in its canonical form, formatted by NastranDiff.format_bde (so entries
+    that only differ in their format, or in where the continuations are, have the same hash)
+    """
+    return _digest(nastrandiff.NastranDiff.format_bde(card.name, card.fields))
+
+
+def cards_fingerprint(cards: iter) -> Fingerprint:
+    """
+    Returns the fingerprint of the Cards of a bulk data section: a hash of the multiset of the entries, which doesn't
+    depend on their order, and the number of entries
+    """
+    total = 0
+    count = 0
+    for card in cards:
+        total = (total + card_digest(card)) % _MULTISET_MODULUS
+        count += 1
+    return Fingerprint("{:032x}".format(total), count)
+
+
+def bulk_fingerprint(lines: iter) -> Fingerprint:
+    """
+    Returns the fingerprint of a bulk data section (see cards_fingerprint). The entries are hashed as they are parsed,
+    so only one is held in memory.
+    """
+    return cards_fingerprint(nastrandiff.NastranDiff.generate_bulk_cards(lines))
+
+
+class CheckResult:
+    """
+    The result of checking whether two decks are equivalent.
+
+    Members:
+
+    - sections: An OrderedDict mapping "exec", "case" and "bulk" to a (Fingerprint, Fingerprint) tuple for the two
+      decks, for the sections that were checked
+    - equivalent: True if every section has the same fingerprint in both decks
+    """
+    def __init__(self):
+        self.sections = collections.OrderedDict()
+
+    @property
+    def equivalent(self) -> bool:
+        return all(f1 == f2 for f1, f2 in self.sections.values())
+
+    def different_sections(self) -> list:
+        return [name for name, (f1, f2) in self.sections.items() if f1 != f2]
+
+    def format(self) -> str:
+        if self.equivalent:
+            return "The decks are equivalent"
+        unchecked = [name for name, _ in _SECTIONS if name not in self.sections]
+        return "The decks differ in: {}{}".format(", ".join(self.different_sections()),
+                                                 "" if not unchecked else " (not checked: {})".format(
+                                                     ", ".join(unchecked)))
+
+
+def check_decks(nd: "nastrandiff.NastranDiff", fail_fast: bool = False) -> CheckResult:
+    """
+    Checks whether nd.file1 and nd.file2 are equivalent by comparing the fingerprints of each section, without keeping
+    either deck in memory. If fail_fast is True, the check stops at the first difference that is found: the first
+    executive control line that is different, or the end of the first other section that is different (the case
+    control and bulk data are compared as multisets, so they can only be shown to be different once they've been
+    read). The bulk data entries of the card types filtered out by nd (see NastranDiff.include_cards) aren't checked.
+    Either file can be a snapshot (see nastrandiff.snapshot).
+    """
+    result = CheckResult()
+    options = nd.parse_options()
+    with contextlib.ExitStack() as stack:
+        sides = []  # the Snapshot or the IncludeReader of each file
+        for f in (nd.file1, nd.file2):
+            if nastrandiff.snapshot.is_snapshot(getattr(f, "name", None)):
+                sides.append(stack.enter_context(nastrandiff.snapshot.Snapshot(f.name)))
+            else:
+                # the included files aren't read ahead, so that only the lines being hashed are held in memory
+                sides.append(stack.enter_context(nastrandiff.prefetch.IncludeReader()))
+        for section, break_at in _SECTIONS:
+            if nd.progress:
+                print("Checking {}...".format(section))
+            with nd._stage("check_" + section) as stage:
+                streams = []  # the lines, or the Cards of the bulk data, of each file
+                for f, side in zip((nd.file1, nd.file2), sides):
+                    if isinstance(side, nastrandiff.snapshot.Snapshot):
+                        if section == "bulk":
+                            streams.append(card for card, _ in side.cards(options))
+                        else:
+                            streams.append(stage.count_lines(side.lines(section)))
+                        continue
+                    lines = stage.count_lines(nd.read_file(f, break_at, includes=side))
+                    if section == "bulk":
+                        streams.append(nd.generate_bulk_cards(nd._filter_bulk(lines, options)))
+                    else:
+                        streams.append(lines)
+                if section == "exec":
+                    result.sections[section] = control_fingerprints(streams[0], streams[1], fail_fast)
+                elif section == "case":
+                    result.sections[section] = tuple(case_fingerprint(lines) for lines in streams)
+                else:
+                    result.sections[section] = tuple(cards_fingerprint(cards) for cards in streams)
+            if fail_fast and not result.equivalent:
+                break
+    return result
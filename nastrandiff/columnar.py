@@ -0,0 +1,402 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import array
+import heapq
+import itertools
+import operator
+import typing
+
+import nastrandiff.card
+
+# The card types that usually make up most of a deck. Only entries that are keyed by the BDE name and ID alone can be
+# stored in columns, so card types in nastrandiff.card.multi_field_keys must not be added here.
+DEFAULT_COLUMNAR_TYPES = frozenset(["GRID", "CROD", "CBAR", "CBEAM", "CBUSH", "CQUAD4", "CQUAD8", "CTRIA3", "CTRIA6",
+                                    "CHEXA", "CPENTA", "CTETRA", "CONM2"])
+
+# Kinds of the values in a column
+BLANK = 0
+INT = 1
+REAL = 2
+STRING = 3  # the value is an index into CardColumns.strings
+
+_MAX_EXACT_INT = 2 ** 53  # the largest integer that is exactly represented by a double
+
+
+class CardColumns:
+    """
+    The entries of one card type, stored in columns instead of as one Python object per entry.
+
+    The IDs are held in an int64 array. Each field position has an array of doubles holding the values and an array of
+    bytes holding their kinds (BLANK, INT, REAL or STRING), so that all of the fields are stored without loss.
+    Character fields are stored once in strings, and the value is the index of the string.
+    The number of fields on each line of an entry (its layout) is stored as an index into layouts, so that the entry
+    can be formatted exactly as it was parsed.
+
+    Members:
+
+    - bde_name: The card type
+    - ids: The IDs (the first field) of the entries
+    - values: A list with an array of values for each field position after the ID
+    - kinds: A list with an array of kinds for each field position after the ID
+    - layout: The index into layouts of each entry
+    - layouts: The distinct tuples of the number of fields on each line
+    - strings: The distinct character fields
+    """
+    def __init__(self, bde_name: str):
+        self.bde_name = bde_name
+        self.ids = array.array("q")
+        self.values = []
+        self.kinds = []
+        self.layout = array.array("H")
+        self.layouts = []
+        self._layout_index = {}
+        self.strings = []
+        self._string_index = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # columns read from a snapshot are memoryviews of the mapped file, which can't be pickled, so they're copied
+        def copy(a):
+            if isinstance(a, memoryview):
+                c = array.array(a.format)
+                c.frombytes(a.cast("B"))
+                return c
+            return a
+        state = dict(self.__dict__)
+        state.update(ids=copy(self.ids), layout=copy(self.layout), values=[copy(v) for v in self.values],
+                     kinds=[copy(k) for k in self.kinds])
+        return state
+
+    @staticmethod
+    def can_store(card: nastrandiff.card.Card) -> bool:
+        """
+        Returns True if the fields of a Card can be stored without loss: the ID is an integer and the other integers
+        can be represented exactly by a double. Otherwise, the entries of its card type must be stored in
+        ColumnarBulk.generic.
+        """
+        fields = card.fields
+        if len(fields) == 0 or type(fields[0]) is not int or abs(fields[0]) > _MAX_EXACT_INT:
+            return False
+        for f in fields:
+            if type(f) is int and abs(f) > _MAX_EXACT_INT:
+                return False
+        return True
+
+    def append(self, card: nastrandiff.card.Card) -> None:
+        layout = card.layout if card.layout is not None else (len(card.fields),)
+        if layout not in self._layout_index:
+            self._layout_index[layout] = len(self.layouts)
+            self.layouts.append(layout)
+        self.layout.append(self._layout_index[layout])
+
+        fields = card.fields[1:]
+        row = len(self.ids)
+        self.ids.append(card.fields[0])
+        while len(self.values) < len(fields):
+            # a new field position; entries so far don't have it
+            self.values.append(array.array("d", bytes(8 * row)))
+            self.kinds.append(array.array("b", bytes(row)))
+        for i, f in enumerate(fields):
+            t = type(f)
+            if t is str:
+                if f == "":
+                    self.values[i].append(0.)
+                    self.kinds[i].append(BLANK)
+                else:
+                    if f not in self._string_index:
+                        self._string_index[f] = len(self.strings)
+                        self.strings.append(f)
+                    self.values[i].append(self._string_index[f])
+                    self.kinds[i].append(STRING)
+            else:
+                self.values[i].append(f)
+                self.kinds[i].append(INT if t is int else REAL)
+        for i in range(len(fields), len(self.values)):
+            self.values[i].append(0.)
+            self.kinds[i].append(BLANK)
+
+    def entry(self, row: int) -> nastrandiff.card.Card:
+        """
+        Returns the entry in a row as a Card
+        """
+        layout = self.layouts[self.layout[row]]
+        fields = [self.ids[row]]
+        for i in range(sum(layout) - 1):
+            kind = self.kinds[i][row]
+            v = self.values[i][row]
+            fields.append(v if kind == REAL else "" if kind == BLANK else int(v) if kind == INT else
+                          self.strings[int(v)])
+        return nastrandiff.card.Card.from_fields(self.bde_name, (fields[0],), tuple(fields),
+                                                 layout if len(layout) > 1 else None)
+
+    def sort(self) -> list:
+        """
+        Sorts the entries by ID. When an ID appears more than once, the last entry is kept (as when the entries are
+        stored in a dict). Returns the IDs that appeared more than once, in the order they were removed.
+        """
+        n = len(self.ids)
+        order = sorted(range(n), key=self.ids.__getitem__)  # stable, so duplicates stay in the order they were added
+        keep = []
+        duplicates = []
+        for k, row in enumerate(order):
+            if k + 1 < n and self.ids[order[k + 1]] == self.ids[row]:
+                duplicates.append(self.ids[row])
+            else:
+                keep.append(row)
+        if len(keep) == n and all(keep[k] == k for k in range(n)):
+            return duplicates
+        self.ids = array.array("q", (self.ids[r] for r in keep))
+        self.layout = array.array("H", (self.layout[r] for r in keep))
+        self.values = [array.array("d", (v[r] for r in keep)) for v in self.values]
+        self.kinds = [array.array("b", (k[r] for r in keep)) for k in self.kinds]
+        return duplicates
+
+    def same_row(self, row: int, other: "CardColumns", other_row: int) -> bool:
+        """
+        Returns True if a row holds exactly the same fields (and layout) as a row of other
+        """
+        if self.layouts[self.layout[row]] != other.layouts[other.layout[other_row]]:
+            return False
+        for i in range(min(len(self.values), len(other.values))):
+            kind = self.kinds[i][row]
+            if kind != other.kinds[i][other_row]:
+                return False
+            if kind == STRING:
+                if self.strings[int(self.values[i][row])] != other.strings[int(other.values[i][other_row])]:
+                    return False
+            elif self.values[i][row] != other.values[i][other_row]:
+                return False
+        return True  # the layouts are the same, so any extra fields are blank
+
+    def __eq__(self, other):
+        # compares whole arrays, which is much faster than comparing the rows one at a time
+        return isinstance(other, CardColumns) and self.bde_name == other.bde_name and self.ids == other.ids and \
+            self.layouts == other.layouts and self.layout == other.layout and self.strings == other.strings and \
+            self.values == other.values and self.kinds == other.kinds
+
+
+class ColumnarBulk:
+    """
+    Parsed bulk data, with the entries of the card types in columnar_types stored in CardColumns. Entries of other card
+    types are stored in the generic dict in the same way as for NastranDiff.parse_bulk_fields. Entries are stored by
+    card type: when an entry can't be stored in columns (see CardColumns.can_store), its card type is removed from
+    columnar_types and all of its entries are stored in generic, so that each entry of a type is found in the same
+    place in both of the bulk data that are compared.
+
+    Members:
+
+    - columnar_types: The card types that are stored in columns
+    - generic_types: The card types that were removed from columnar_types (see remove_columns)
+    - generic: A dict mapping the key of each other entry to its Card
+    - columns: A dict mapping each card type to its CardColumns
+    """
+    def __init__(self, columnar_types: frozenset = DEFAULT_COLUMNAR_TYPES):
+        self.columnar_types = columnar_types
+        self.generic_types = frozenset()
+        self.generic = {}
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.generic) + sum(len(c) for c in self.columns.values())
+
+    def merge(self, entries: iter) -> None:
+        """
+        Adds (key, Card) tuples. Call finalize when all entries have been added.
+        """
+        for key, card in entries:
+            bde_name = card.name
+            if bde_name in self.columnar_types:
+                if CardColumns.can_store(card):
+                    if bde_name not in self.columns:
+                        self.columns[bde_name] = CardColumns(bde_name)
+                    self.columns[bde_name].append(card)
+                    continue
+                self.remove_columns(bde_name)
+            self._add_generic(key, card)
+
+    def _add_generic(self, key: tuple, card: nastrandiff.card.Card) -> None:
+        if key in self.generic:
+            print("""Warning: Multiple lines being saved as '{}'. This may indicate a problem in the BDF or a
+                          bug in this software""".format(card.key_string()))
+        self.generic[key] = card
+
+    def remove_columns(self, bde_name: str) -> None:
+        """
+        Removes a card type from columnar_types, because it has an entry that can't be stored in columns (here or in
+        the bulk data that this is compared with), moving the entries in its columns to generic in the order that they
+        were added. The columns may be shared with another ColumnarBulk, so they aren't changed.
+        """
+        self.columnar_types = self.columnar_types - {bde_name}
+        self.generic_types = self.generic_types | {bde_name}
+        columns = self.columns.pop(bde_name, None)
+        if columns is not None:
+            for row in range(len(columns)):
+                card = columns.entry(row)
+                self._add_generic(card.key, card)
+
+    def finalize(self) -> None:
+        """
+        Sorts the columns by ID. Warnings about duplicate keys in the columns are printed here.
+        """
+        for bde_name in sorted(self.columns):
+            for i in self.columns[bde_name].sort():
+                print("""Warning: Multiple lines being saved as '{}'. This may indicate a problem in the BDF or a
+                          bug in this software""".format(bde_name + "{:8}".format(i)))
+
+    def join_columns(self, other: "ColumnarBulk", entries_equal) -> (nastrandiff.card.Card, nastrandiff.card.Card):
+        """
+        Joins the columns with those of other, one card type at a time in order of the sorted IDs, yielding (card1,
+        card2) for each entry that is different, as for NastranDiff.join_bulk. entries_equal is called with the Cards
+        of entries with the same ID in both that aren't exactly the same.
+        """
+        for bde_name in sorted(set(self.columns) | set(other.columns)):
+            c1 = self.columns.get(bde_name, CardColumns(bde_name))
+            c2 = other.columns.get(bde_name, CardColumns(bde_name))
+            if c1 != c2:
+                yield from _join(c1, c2, entries_equal)
+
+
+# The number of rows of the columns compared at once by _changed_rows
+_BLOCK_ROWS = 1024
+
+
+def _different(values1, values2, rows1: typing.Union[None, list], rows2: typing.Union[None, list]) -> iter:
+    # Yields the indexes into rows1 and rows2 (the rows of two columns with the same IDs, or None if all of the rows
+    # have the same IDs) of the rows that have different values in two columns. When the rows are the same, whole
+    # blocks of rows are compared at once, and only the blocks that differ are compared a row at a time.
+    if rows1 is not None:
+        yield from itertools.compress(range(len(rows1)), map(operator.ne, map(values1.__getitem__, rows1),
+                                                             map(values2.__getitem__, rows2)))
+        return
+    if values1 == values2:
+        return
+    for start in range(0, len(values1), _BLOCK_ROWS):
+        block1 = values1[start:start + _BLOCK_ROWS]
+        block2 = values2[start:start + _BLOCK_ROWS]
+        if block1 != block2:
+            yield from itertools.compress(range(start, start + len(block1)), map(operator.ne, block1, block2))
+
+
+def _changed_rows(c1: CardColumns, c2: CardColumns, rows1: typing.Union[None, list],
+                  rows2: typing.Union[None, list]) -> list:
+    # Returns the sorted indexes into rows1 and rows2 (as for _different) of the rows that may be different. The other
+    # rows hold exactly the same fields.
+    changed = set()
+    if c1.layouts == c2.layouts:
+        changed.update(_different(c1.layout, c2.layout, rows1, rows2))
+    else:
+        # compares the indexes of the layouts of c2 in c1.layouts
+        layouts = [c1._layout_index.get(layout, -1) for layout in c2.layouts]
+        changed.update(_different(c1.layout, list(map(layouts.__getitem__, c2.layout)),
+                                  range(len(c1)) if rows1 is None else rows1,
+                                  range(len(c2)) if rows2 is None else rows2))
+    # the layouts of the other rows are the same, so any field positions that only one has are blank in both
+    for i in range(min(len(c1.values), len(c2.values))):
+        changed.update(_different(c1.kinds[i], c2.kinds[i], rows1, rows2))
+        changed.update(_different(c1.values[i], c2.values[i], rows1, rows2))
+        if c1.strings != c2.strings:
+            # the same index may be a different string
+            kinds = c1.kinds[i] if rows1 is None else map(c1.kinds[i].__getitem__, rows1)
+            changed.update(itertools.compress(itertools.count(), map(operator.eq, kinds, itertools.repeat(STRING))))
+    return sorted(changed)
+
+
+def _join(c1: CardColumns, c2: CardColumns, entries_equal) -> (nastrandiff.card.Card, nastrandiff.card.Card):
+    # Joins the columns of a card type, as for ColumnarBulk.join_columns. The IDs that match and the rows that are the
+    # same are found with operations on whole arrays (which loop in C rather than in Python), so that Cards are only
+    # made for the rows that differ.
+    if len(c1) == 0 or len(c2) == 0:
+        # a card type in only one of them
+        yield from ((c1.entry(row), None) for row in range(len(c1)))
+        yield from ((None, c2.entry(row)) for row in range(len(c2)))
+        return
+    if c1.ids == c2.ids:
+        rows1 = rows2 = None
+        deleted = added = ()
+    else:
+        index2 = dict(zip(c2.ids, range(len(c2))))
+        found = list(map(index2.get, c1.ids))  # the row of each ID in c2, or None
+        del index2
+        rows1 = list(itertools.compress(range(len(c1)), map(operator.is_not, found, itertools.repeat(None))))
+        rows2 = list(map(found.__getitem__, rows1))
+        deleted = itertools.compress(range(len(c1)), map(operator.is_, found, itertools.repeat(None)))
+        matched2 = set(rows2)
+        added = itertools.compress(range(len(c2)), map(operator.not_, map(matched2.__contains__, range(len(c2)))))
+
+    def changed():
+        for k in _changed_rows(c1, c2, rows1, rows2):
+            row1 = k if rows1 is None else rows1[k]
+            row2 = k if rows2 is None else rows2[k]
+            if not c1.same_row(row1, c2, row2):
+                e1 = c1.entry(row1)
+                e2 = c2.entry(row2)
+                if not entries_equal(e1, e2):
+                    yield c1.ids[row1], e1, e2
+
+    # each of these is in order of the IDs, and each ID is in only one of them
+    yield from ((e1, e2) for _, e1, e2 in heapq.merge(
+        changed(), ((c1.ids[row], c1.entry(row), None) for row in deleted),
+        ((c2.ids[row], None, c2.entry(row)) for row in added), key=operator.itemgetter(0)))
+
+
+def _with_types(bulk, columnar_types: frozenset) -> ColumnarBulk:
+    # Returns bulk data (a dict or a ColumnarBulk) as a ColumnarBulk storing the card types in columnar_types in
+    # columns, or fewer if some of their entries can't be stored in columns. The columns of bulk are shared, not copied.
+    if isinstance(bulk, ColumnarBulk):
+        if bulk.columnar_types == columnar_types:
+            return bulk
+        result = ColumnarBulk(bulk.columnar_types)
+        result.generic_types = bulk.generic_types
+        result.generic = dict(bulk.generic)
+        result.columns = dict(bulk.columns)
+        for bde_name in bulk.columnar_types - columnar_types:
+            result.remove_columns(bde_name)
+        result.columnar_types = columnar_types - result.generic_types
+        entries = [(key, card) for key, card in bulk.generic.items() if card.name in result.columnar_types]
+        for key, _ in entries:
+            del result.generic[key]
+    else:
+        result = ColumnarBulk(columnar_types)
+        entries = bulk.items()
+    existing = set(result.columns)
+    result.merge(entries)  # only adds new columns, since the entries of the existing ones aren't stored in generic
+    for bde_name in result.columns:
+        if bde_name not in existing:
+            result.columns[bde_name].sort()  # the keys were unique, so there are no duplicates
+    return result
+
+
+def comparable(bulk1, bulk2) -> tuple:
+    """
+    Returns two parsed bulk data (each a dict or a ColumnarBulk, which may store different card types in columns) in
+    a form that can be compared by NastranDiff.compare_parsed_bulk: both dicts, or both ColumnarBulk with the same
+    columnar types. These are the card types stored in columns in either, apart from those that have entries that
+    can't be stored in columns in either, so that all of the entries of a card type are stored in the same way in
+    both.
+    """
+    columnar = [b for b in (bulk1, bulk2) if isinstance(b, ColumnarBulk)]
+    if len(columnar) == 0 or (len(columnar) == 2 and bulk1.columnar_types == bulk2.columnar_types):
+        return bulk1, bulk2
+    columnar_types = frozenset().union(*(b.columnar_types for b in columnar)) - \
+        frozenset().union(*(b.generic_types for b in columnar))
+    while True:
+        result1, result2 = _with_types(bulk1, columnar_types), _with_types(bulk2, columnar_types)
+        if result1.columnar_types == result2.columnar_types:
+            return result1, result2
+        # card types with entries that can't be stored in columns were found in one of them
+        columnar_types = result1.columnar_types & result2.columnar_types
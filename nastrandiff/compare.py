@@ -0,0 +1,133 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+
+import nastrandiff
+
+
+class Tolerances:
+    """
+    The tolerances used to compare the fields of bulk data entries.
+
+    Two real fields are equal if they differ by no more than the absolute tolerance or by no more than the relative
+    tolerance times the larger of their magnitudes. Integer and character fields must be identical, and an integer
+    field is always different from a real field (e.g. "1" and "1.0"), since the type of the field changed. Blank fields
+    at the end of an entry are ignored, so "GRID,2,,1.0" and "GRID    2               1.0     " are equal.
+
+    Fields are numbered from 1 for the first field after the BDE name, counting across continuations (so the
+    first field of the first continuation of a small-field entry is field 9).
+
+    Members:
+
+    - abs_tol: The default absolute tolerance
+    - rel_tol: The default relative tolerance
+    - card_tols: A dict mapping a BDE name to its (absolute, relative) tolerances
+    - field_tols: A dict mapping a (BDE name, field number) tuple to the (absolute, relative) tolerances of that field
+    """
+    def __init__(self, abs_tol: float = 0., rel_tol: float = 0.):
+        self.abs_tol = abs_tol
+        self.rel_tol = rel_tol
+        self.card_tols = {}
+        self.field_tols = {}
+        self._lookup = {}
+
+    def set_tolerance(self, bde_name: str, field: int = None, abs_tol: float = 0., rel_tol: float = 0.) -> None:
+        if field is None:
+            self.card_tols[bde_name] = (abs_tol, rel_tol)
+        else:
+            self.field_tols[(bde_name, field)] = (abs_tol, rel_tol)
+        self._lookup = {}
+
+    def parse_tolerance(self, spec: str) -> None:
+        """
+        Sets a tolerance from a string of the form NAME[:FIELD]=ABS[,REL], e.g. "GRID=1e-6" or "PSHELL:3=0,1e-4"
+        """
+        r = re.match("^\\s*([A-Za-z0-9]+)(?::([0-9]+))?\\s*=\\s*([^,\\s]+)\\s*(?:,\\s*([^,\\s]+))?\\s*$", spec)
+        if r is None:
+            raise ValueError("Invalid tolerance '{}': expected NAME[:FIELD]=ABS[,REL]".format(spec))
+        self.set_tolerance(r.group(1).upper(), None if r.group(2) is None else int(r.group(2)),
+                           float(r.group(3)), 0. if r.group(4) is None else float(r.group(4)))
+
+    def tolerance(self, bde_name: str, field: int) -> (float, float):
+        """
+        Returns the (absolute, relative) tolerances for a field
+        """
+        if (bde_name, field) in self.field_tols:
+            return self.field_tols[(bde_name, field)]
+        return self.card_tols.get(bde_name, (self.abs_tol, self.rel_tol))
+
+    def _card_lookup(self, bde_name: str) -> (tuple, dict):
+        # The default tolerances of a BDE name and the tolerances of its fields that are different, cached because this
+        # is needed for every entry compared
+        if bde_name not in self._lookup:
+            self._lookup[bde_name] = (self.card_tols.get(bde_name, (self.abs_tol, self.rel_tol)),
+                                      {f: t for (n, f), t in self.field_tols.items() if n == bde_name})
+        return self._lookup[bde_name]
+
+    @staticmethod
+    def _strip_blanks(fields: list) -> list:
+        end = len(fields)
+        while end > 0 and fields[end - 1] == "":
+            end -= 1
+        return fields if end == len(fields) else fields[:end]
+
+    def fields_equal(self, bde_name: str, fields1: list, fields2: list) -> bool:
+        fields1 = self._strip_blanks(fields1)
+        fields2 = self._strip_blanks(fields2)
+        if len(fields1) != len(fields2):
+            return False
+        card_tol = None
+        for i, (f1, f2) in enumerate(zip(fields1, fields2)):
+            if f1 == f2 and type(f1) is type(f2):
+                continue
+            if type(f1) is not float or type(f2) is not float:  # only reals have tolerances
+                return False
+            if card_tol is None:
+                card_tol, field_tols = self._card_lookup(bde_name)
+            abs_tol, rel_tol = field_tols.get(i + 1, card_tol)
+            if abs(f1 - f2) > max(abs_tol, rel_tol * max(abs(f1), abs(f2))):
+                return False
+        return True
+
+    def field_equal(self, bde_name: str, field: int, f1, f2) -> bool:
+        """
+        Compares one field (numbered as for tolerance) of two entries
+        """
+        if f1 == f2 and type(f1) is type(f2):
+            return True
+        if type(f1) is not float or type(f2) is not float:
+            return False
+        abs_tol, rel_tol = self.tolerance(bde_name, field)
+        return abs(f1 - f2) <= max(abs_tol, rel_tol * max(abs(f1), abs(f2)))
+
+
+def changed_fields(bde_name: str, fields1: tuple, fields2: tuple, tolerances: Tolerances = None) -> list:
+    """
+    Returns the numbers of the fields (from 1, as for Tolerances) that are different in two entries, treating missing
+    fields at the end of the shorter entry as blank. Without tolerances, fields are different if they're formatted
+    differently (see NastranDiff.format_bde).
+    """
+    changed = []
+    for i in range(max(len(fields1), len(fields2))):
+        f1 = fields1[i] if i < len(fields1) else ""
+        f2 = fields2[i] if i < len(fields2) else ""
+        if tolerances is not None:
+            if not tolerances.field_equal(bde_name, i + 1, f1, f2):
+                changed.append(i + 1)
+        elif not (f1 == f2 and type(f1) is type(f2)) and \
+                nastrandiff.NastranDiff.format_bde("", [f1]) != nastrandiff.NastranDiff.format_bde("", [f2]):
+            changed.append(i + 1)
+    return changed
@@ -0,0 +1,149 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Reads decks compressed with gzip, bzip2 or xz, so that archived decks can be diffed without decompressing them to
+disk first. Compressed files are recognized by their first bytes rather than by their names, and INCLUDE statements
+naming a file that was compressed in place (e.g. by gzip -r, which adds ".gz" to the name) find the compressed file
+(see resolve). Each compressed file is decompressed in a thread that runs ahead of the reader, so the decompression
+overlaps with the parsing.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+import typing
+
+# The first bytes of the files in each compression format, and the functions opening them
+_formats = ((b"\x1f\x8b", gzip.open),
+            (b"BZh", bz2.open),
+            (b"\xfd7zXZ\x00", lzma.open))
+
+# The suffixes added to the names of compressed files
+SUFFIXES = (".gz", ".bz2", ".xz")
+
+
+def _opener(file_name: str) -> typing.Union[None, typing.Callable]:
+    # Returns the function opening a compressed file, or None if the file isn't compressed
+    with open(file_name, "rb") as f:
+        start = f.read(6)
+    for magic, opener in _formats:
+        if start.startswith(magic):
+            return opener
+    return None
+
+
+def is_compressed(file_name: str) -> bool:
+    return _opener(file_name) is not None
+
+
+def resolve(file_name: str) -> str:
+    """
+    Returns file_name, or if there is no such file, the name of a compressed copy of it (file_name followed by one of
+    SUFFIXES) if one exists
+    """
+    if os.path.exists(file_name):
+        return file_name
+    for suffix in SUFFIXES:
+        if os.path.exists(file_name + suffix):
+            return file_name + suffix
+    return file_name
+
+
+class _DecompressedStream(io.RawIOBase):
+    """
+    The decompressed contents of a file as a raw stream. A thread decompresses the file in chunks of chunk_size bytes,
+    up to max_chunks chunks ahead of the reader. The decompression functions release the GIL, so the reader runs at
+    the same time.
+    """
+    def __init__(self, file_name: str, opener: typing.Callable, chunk_size: int = 1024 ** 2, max_chunks: int = 8):
+        super().__init__()
+        self.name = file_name
+        self._file = opener(file_name, "rb")
+        self._chunks = queue.Queue(max_chunks)
+        self._chunk = memoryview(b"")
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(chunk_size,), daemon=True)
+        self._thread.start()
+
+    def _run(self, chunk_size: int) -> None:
+        # Executed in the thread. Exceptions are passed to the reader.
+        try:
+            with self._file as f:
+                while not self._stop.is_set():
+                    chunk = f.read(chunk_size)
+                    self._chunks.put(chunk)
+                    if len(chunk) == 0:
+                        break
+        except Exception as e:
+            self._chunks.put(e)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self._chunk) == 0:
+            if self._eof:
+                return 0
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                self._eof = True
+                raise chunk
+            if len(chunk) == 0:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(chunk)
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            # make room for the chunk that the thread may be waiting to add, after which it sees _stop
+            while self._thread.is_alive():
+                try:
+                    self._chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        super().close()
+
+
+def open_binary(file_name: str) -> typing.BinaryIO:
+    """
+    Opens a file for reading in binary mode, decompressing it if it's compressed
+    """
+    opener = _opener(file_name)
+    if opener is None:
+        return open(file_name, "rb")
+    return io.BufferedReader(_DecompressedStream(file_name, opener))
+
+
+def open_deck(file_name: str) -> typing.TextIO:
+    """
+    Opens a file of a deck for reading in text mode (as open(file_name, "r") does), decompressing it if it's
+    compressed. The name of the returned file is file_name, so the files that it INCLUDEs are found relative to it.
+    """
+    opener = _opener(file_name)
+    if opener is None:
+        return open(file_name, "r")
+    return io.TextIOWrapper(io.BufferedReader(_DecompressedStream(file_name, opener)))
@@ -0,0 +1,243 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Compares bulk data without holding either deck in memory. The entries of each deck are collected in a buffer that is
+sorted and written to a spill run on disk whenever it reaches the memory limit. The runs of each deck are then merged
+into one sorted stream, and the two streams are joined to find the entries that are changed, deleted and added. The
+results are also written to disk, so memory use depends on the limit and not on the size of the decks.
+"""
+
+import heapq
+import itertools
+import operator
+import os
+import pickle
+import tempfile
+import typing
+
+import nastrandiff.card
+
+# The approximate memory used by an entry in a buffer, in addition to its fields (the Card, its key, its key string and
+# the buffer's tuple), and by each field
+_ENTRY_SIZE = 400
+_FIELD_SIZE = 60
+
+# The most memory used for one batch of records of a SpillFile, as a fraction of the memory limit. The merge reads one
+# batch from each of the runs being merged, so this sets how many runs can be merged at once.
+_BATCH_FRACTION = 64
+
+# The most runs of each deck that are merged at once. The runs of both decks are read at the same time, so this uses at
+# most half of the memory limit.
+_FAN_IN = _BATCH_FRACTION // 4
+
+
+def entry_size(card: nastrandiff.card.Card) -> int:
+    """
+    Returns an estimate of the memory used by a Card while it is buffered, in bytes
+    """
+    return _ENTRY_SIZE + _FIELD_SIZE * len(card.fields)
+
+
+class SpillFile:
+    """
+    A sequence of records stored in a file. Records are appended, then the file is closed, after which it can be
+    iterated over any number of times. The records are pickled in batches of up to batch_size bytes (estimated by the
+    size function), and only one batch is held in memory while writing or reading.
+
+    Members:
+
+    - path: The path of the file
+    - batch_size: The size of each batch, in bytes
+    """
+    def __init__(self, path: str, batch_size: int, size: typing.Callable[[object], int] = None):
+        self.path = path
+        self.batch_size = batch_size
+        self._size = size
+        self._file = open(path, "wb")
+        self._batch = []
+        self._batch_bytes = 0
+        self._length = 0
+
+    def append(self, record) -> None:
+        self._batch.append(record)
+        self._length += 1
+        self._batch_bytes += self._size(record) if self._size is not None else _ENTRY_SIZE
+        if self._batch_bytes >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._batch:
+            pickle.dump(self._batch, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            self._batch = []
+            self._batch_bytes = 0
+
+    def close(self) -> "SpillFile":
+        if self._file is not None:
+            self._flush()
+            self._file.close()
+            self._file = None
+        return self
+
+    def remove(self) -> None:
+        self.close()
+        os.remove(self.path)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        if self._file is not None:
+            raise ValueError("SpillFile {} is still being written".format(self.path))
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    return
+                yield from batch
+
+
+class ExternalSort:
+    """
+    Sorts the bulk data entries of one deck by key in natural order (see nastrandiff.card.natural_key) using spill runs
+    in directory. Duplicate keys are resolved
+    in the same way as by NastranDiff.merge_bulk_entries: the last entry in the deck is kept and a warning is printed.
+    The warnings are printed by sorted, in key order, rather than as the entries are added.
+
+    Members:
+
+    - directory: The directory holding the spill runs
+    - memory_limit: The most memory to use for the buffer, in bytes (approximately)
+    - runs: The SpillFiles holding the sorted runs written so far
+    """
+    def __init__(self, directory: str, memory_limit: int, name: str = "run"):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.runs = []
+        self._name = name
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._count = itertools.count()  # the position in the deck of each entry, to resolve duplicate keys
+
+    def _new_run(self) -> SpillFile:
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix="{}-".format(self._name), suffix=".run")
+        os.close(fd)
+        return SpillFile(path, max(1, self.memory_limit // _BATCH_FRACTION), lambda r: entry_size(r[2]))
+
+    def add(self, card: nastrandiff.card.Card) -> None:
+        self._buffer.append((nastrandiff.card.natural_key(card.key), next(self._count), card))
+        self._buffer_bytes += entry_size(card)
+        if self._buffer_bytes >= self.memory_limit:
+            self._spill()
+
+    def extend(self, cards: iter) -> "ExternalSort":
+        for card in cards:
+            self.add(card)
+        return self
+
+    def _spill(self) -> None:
+        self._buffer.sort(key=operator.itemgetter(0, 1))
+        run = self._new_run()
+        for record in self._buffer:
+            run.append(record)
+        self.runs.append(run.close())
+        self._buffer = []
+        self._buffer_bytes = 0
+
+    def _merged_runs(self) -> iter:
+        # Merges the runs until there are few enough to read at once, and returns the merge of what's left
+        if self._buffer:
+            self._spill()
+        while len(self.runs) > _FAN_IN:
+            merged = []
+            for i in range(0, len(self.runs), _FAN_IN):
+                group = self.runs[i:i + _FAN_IN]
+                run = self._new_run()
+                for record in heapq.merge(*group, key=operator.itemgetter(0, 1)):
+                    run.append(record)
+                merged.append(run.close())
+                for r in group:
+                    r.remove()
+            self.runs = merged
+        return heapq.merge(*self.runs, key=operator.itemgetter(0, 1))
+
+    def sorted(self) -> nastrandiff.card.Card:
+        """
+        Yields the entries in order. Of the entries with the same key, only the last one added is yielded.
+        """
+        for _, records in itertools.groupby(self._merged_runs(), operator.itemgetter(0)):
+            card = next(records)[2]
+            for _, _, card in records:  # in the order that they were added
+                print("""Warning: Multiple lines being saved as '{}'. This may indicate a problem in the BDF or a
+                          bug in this software""".format(card.key_string()))
+            yield card
+
+    def remove(self) -> None:
+        for run in self.runs:
+            run.remove()
+        self.runs = []
+
+
+def join_sorted(sorted1: ExternalSort, sorted2: ExternalSort, entries_equal: typing.Callable) -> \
+        (nastrandiff.card.Card, nastrandiff.card.Card):
+    """
+    Joins the sorted entries of two decks, yielding (card1, card2) for each entry that is different, in key order (as
+    NastranDiff.join_bulk). entries_equal is called with the Cards of entries with the same key.
+    """
+    cards1 = sorted1.sorted()
+    cards2 = sorted2.sorted()
+    card1 = next(cards1, None)
+    card2 = next(cards2, None)
+    while card1 is not None or card2 is not None:
+        key1 = nastrandiff.card.natural_key(card1.key) if card1 is not None else None
+        key2 = nastrandiff.card.natural_key(card2.key) if card2 is not None else None
+        if card2 is None or (card1 is not None and key1 < key2):
+            yield card1, None
+            card1 = next(cards1, None)
+        elif card1 is None or key2 < key1:
+            yield None, card2
+            card2 = next(cards2, None)
+        else:
+            if card1.digest != card2.digest and not entries_equal(card1, card2):
+                yield card1, card2
+            card1 = next(cards1, None)
+            card2 = next(cards2, None)
+
+
+def merge_join(sorted1: ExternalSort, sorted2: ExternalSort, entries_equal: typing.Callable, directory: str,
+               memory_limit: int) -> (SpillFile, SpillFile, SpillFile, SpillFile):
+    """
+    Joins the sorted entries of two decks (see join_sorted), returning SpillFiles (in directory) of the formatted
+    entries that are different in the first and in the second deck, and those that are only in the first and only in
+    the second, in the same order as NastranDiff.compare_parsed_bulk.
+    """
+    results = []
+    for name in ("changed1", "changed2", "deleted", "added"):
+        fd, path = tempfile.mkstemp(dir=directory, prefix="{}-".format(name), suffix=".out")
+        os.close(fd)
+        results.append(SpillFile(path, max(1, memory_limit // _BATCH_FRACTION), lambda r: _ENTRY_SIZE + len(r)))
+    diff1, diff2, unique1, unique2 = results
+
+    for card1, card2 in join_sorted(sorted1, sorted2, entries_equal):
+        if card2 is None:
+            unique1.append(card1.format())
+        elif card1 is None:
+            unique2.append(card2.format())
+        else:
+            diff1.append(card1.format())
+            diff2.append(card2.format())
+    return tuple(r.close() for r in results)
@@ -0,0 +1,262 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import mmap
+import os
+import re
+
+import nastrandiff
+import nastrandiff.compressed
+import nastrandiff.prefetch
+
+# The lines that read_file looks for, found with one scan of each file
+_index_regex = re.compile(b"^(?:CEND|BEGIN BULK|ENDDATA|INCLUDE)[^\n]*", re.MULTILINE)
+
+_section_breaks = (("exec", "CEND"), ("case", "BEGIN BULK"), ("bulk", "ENDDATA"))
+
+
+def split_lines(text: str) -> list:
+    """
+    Splits text into lines in the same way as iterating over a file opened in text mode
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    if len(lines[-1]) == 0:
+        lines.pop()
+    return lines
+
+
+def _line_after(data, pos: int, end: int) -> int:
+    # Returns the offset of the start of the line following the one containing pos (or end)
+    i = data.find(b"\n", pos, end)
+    return end if i < 0 else i + 1
+
+
+def _range_lines(data, start: int, end: int, chunk_size: int = 1 << 22) -> str:
+    # Yields the lines of data[start:end], decoding chunks of about chunk_size bytes that end after a newline (so a
+    # line, or a character, is never split between chunks). Only one chunk is held as text at a time.
+    while start < end:
+        cut = end if end - start <= chunk_size else _line_after(data, start + chunk_size, end)
+        with memoryview(data)[start:cut] as view:
+            text = str(view, "utf-8", "replace")
+        yield from split_lines(text)
+        start = cut
+
+
+class MappedFile:
+    """
+    A memory-mapped file with an index of the lines that begin a section break or an INCLUDE statement.
+
+    Members:
+
+    - name: The name of the file
+    - size: The size of the file in bytes
+    - data: The contents of the file (an mmap, or a bytes object for an empty file or a compressed file, which is
+      decompressed in memory since it can't be mapped)
+    - breaks: A dict mapping each section break (e.g. "CEND") to the sorted offsets of the lines starting with it
+    - includes: A list of (line start offset, line end offset, included file name) for each INCLUDE statement
+    """
+    def __init__(self, file_name: str):
+        self.name = file_name
+        if nastrandiff.compressed.is_compressed(file_name):
+            with nastrandiff.compressed.open_binary(file_name) as f:
+                self.data = f.read()
+            self.size = len(self.data)
+        else:
+            self.size = os.path.getsize(file_name)
+            if self.size > 0:
+                with open(file_name, "rb") as f:
+                    self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = b""
+        self.breaks = {b: [] for _, b in _section_breaks}
+        self.includes = []
+        for m in _index_regex.finditer(self.data):
+            line = m.group(0).decode(errors="replace")
+            if line.startswith("INCLUDE"):
+                include = nastrandiff.NastranDiff.check_for_include(line)
+                if include is not None:
+                    self.includes.append((m.start(), _line_after(self.data, m.start(), self.size), include))
+            else:
+                for b in self.breaks:
+                    if line.startswith(b):
+                        self.breaks[b].append(m.start())
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def find_break(self, break_at: str, start: int) -> (int, int):
+        """
+        Returns the offsets of the start and the end of the first line at or after start that starts with break_at.
+        If there is no such line, both offsets are the size of the file.
+        """
+        offsets = self.breaks[break_at]
+        i = bisect.bisect_left(offsets, start)
+        if i == len(offsets):
+            return self.size, self.size
+        return offsets[i], _line_after(self.data, offsets[i], self.size)
+
+
+class MappedDeck:
+    """
+    A deck whose files are memory-mapped. Each file is scanned once for the section breaks and INCLUDE statements, so
+    the executive control, case control and bulk data can be found without reading the deck line by line.
+
+    Each section is described by a list of (file name, start offset, end offset) ranges, which give the lines that
+    read_file would produce for that section in order. The ranges can be turned into zero-copy memoryviews with views,
+    into lines with lines, or split between worker processes with split (workers re-map the files with read_ranges).
+
+    Members:
+
+    - file_name: The name of the root file of the deck
+    - files: A dict mapping the real path of each file in the deck to its MappedFile
+    - sections: A dict mapping "exec", "case" and "bulk" to the ranges making up that section
+    """
+    def __init__(self, file_name: str, skip: dict = None):
+        """
+        skip has the same meaning as for read_file, and applies to the bulk data
+        """
+        self.file_name = file_name
+        self.files = {}
+        self.sections = {}
+        try:
+            root = self._open(file_name)
+            start = 0
+            for section, break_at in _section_breaks:
+                self.sections[section], start = self._ranges(root, start, break_at,
+                                                             skip if section == "bulk" else None,
+                                                             (os.path.realpath(file_name),))
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def _open(self, file_name: str) -> MappedFile:
+        path = os.path.realpath(file_name)
+        if path not in self.files:
+            self.files[path] = MappedFile(file_name)
+        return self.files[path]
+
+    def _ranges(self, f: MappedFile, start: int, break_at: str, skip: dict, parents: tuple) -> (list, int):
+        # Returns the ranges from start up to the next line starting with break_at (expanding INCLUDE statements) and
+        # the offset following that line. parents holds the real paths of f and the files including it.
+        end, after = f.find_break(break_at, start)
+        ranges = []
+        pos = start
+        i = bisect.bisect_left(f.includes, (start,))
+        while i < len(f.includes) and f.includes[i][0] < end:
+            line_start, line_end, include = f.includes[i]
+            i += 1
+            if line_start > pos:
+                ranges.append((f.name, pos, line_start))
+            pos = line_end
+            include_name = nastrandiff.compressed.resolve(os.path.dirname(parents[-1]) + os.path.sep + include)
+            include_path = os.path.realpath(include_name)
+            if skip and skip.get(include_path, 0) > 0:
+                skip[include_path] -= 1
+                continue
+            nastrandiff.prefetch.check_cycle(parents, include_path)
+            ranges += self._ranges(self._open(include_name), 0, break_at, skip, parents + (include_path,))[0]
+        if end > pos:
+            ranges.append((f.name, pos, end))
+        return ranges, after
+
+    def views(self, section: str) -> list:
+        """
+        Returns a list of memoryviews of the mapped files making up the section. These must be released before the
+        deck is closed.
+        """
+        return [memoryview(self._open(n).data)[start:end] for n, start, end in self.sections[section]]
+
+    def count(self, section: str) -> (int, int):
+        """
+        Returns the number of lines and the number of bytes in the section
+        """
+        lines = 0
+        n_bytes = 0
+        for n, start, end in self.sections[section]:
+            data = self._open(n).data
+            for chunk_start in range(start, end, 1 << 24):  # count in chunks so the section is never copied at once
+                lines += data[chunk_start:min(end, chunk_start + (1 << 24))].count(b"\n")
+            if end > start and data[end - 1:end] != b"\n":
+                lines += 1  # the last line of the file has no newline
+            n_bytes += end - start
+        return lines, n_bytes
+
+    def lines(self, section: str) -> str:
+        """
+        Yields the lines of the section, decoding the mapped files a chunk at a time
+        """
+        for n, start, end in self.sections[section]:
+            yield from _range_lines(self._open(n).data, start, end)
+
+    def split(self, section: str, n_chunks: int) -> list:
+        """
+        Splits the ranges of the section into (approximately) n_chunks lists of ranges with similar sizes. As with
+        NastranDiff.split_bulk_data, the splits are only made at the start of a bulk data entry.
+        """
+        ranges = self.sections[section]
+        chunk_size = max(1, -(-sum(end - start for _, start, end in ranges) // max(1, n_chunks)))
+        chunks = []
+        chunk = []
+        chunk_used = 0
+        for n, start, end in ranges:
+            data = self._open(n).data
+            while start < end:
+                # find the first line at or after the point where the chunk is full that starts a bulk data entry
+                cut = max(start, start + chunk_size - chunk_used)
+                if cut > start:
+                    cut = _line_after(data, cut - 1, end)
+                while cut < end:
+                    line_end = _line_after(data, cut, end)
+                    if nastrandiff.NastranDiff.is_card_start(data[cut:line_end].decode(errors="replace")):
+                        break
+                    cut = line_end
+                if cut > start:
+                    chunk.append((n, start, cut))
+                    chunk_used += cut - start
+                    start = cut
+                if cut < end:
+                    chunks.append(chunk)
+                    chunk = []
+                    chunk_used = 0
+        if len(chunk) > 0:
+            chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def read_ranges(ranges: list) -> str:
+        """
+        Yields the lines in the ranges, mapping each file again. This is used by worker processes.
+        """
+        for n, start, end in ranges:
+            f = MappedFile(n)
+            try:
+                yield from _range_lines(f.data, start, end)
+            finally:
+                f.close()
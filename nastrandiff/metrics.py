@@ -0,0 +1,256 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import time
+import typing
+
+import nastrandiff.card
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+METRICS_VERSION = 2
+
+
+def process_peak_rss() -> typing.Union[None, int]:
+    """
+    Returns the peak resident set size of this process or of any of its (finished) child processes in bytes, or None
+    if it isn't available. This is the peak over the life of the process, not of any one stage.
+    """
+    if resource is None:
+        return None
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return rss if sys.platform == "darwin" else rss * 1024  # ru_maxrss is in bytes on macOS and kB elsewhere
+
+
+def current_rss() -> typing.Union[None, int]:
+    """
+    Returns the current resident set size of this process in bytes, or None if it isn't available (it's read from
+    /proc, so only on Linux)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def cpu_time() -> float:
+    """
+    Returns the CPU time used by this process and its (finished) child processes, such as worker processes
+    """
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class StageMetrics:
+    """
+    The measurements of one stage of a diff.
+
+    Members:
+
+    - name: The name of the stage (e.g. "parse_bulk1")
+    - wall_time: The elapsed time in seconds
+    - cpu_time: The CPU time in seconds, including worker processes that finished during the stage
+    - lines: The number of lines processed
+    - bytes: The number of characters processed (the same as the number of bytes for ASCII decks)
+    - cards: A Counter of the bulk data entries processed, by card type
+    - rss_growth: The change in the resident set size in bytes between the start and the end of the stage (negative
+      if memory was freed), or None if it isn't available (see current_rss)
+    - process_peak_rss: The peak resident set size of the process in bytes at the end of the stage, which may have been
+      reached in an earlier stage (see process_peak_rss)
+    - info: A dict of other values describing the stage (e.g. the number of differences found)
+    - enabled: False if the measurements aren't being recorded, in which case counting is skipped
+    - nested: The stages timed (see timed) while this one runs, whose time is not counted in this stage
+    """
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        self.lines = 0
+        self.bytes = 0
+        self.cards = collections.Counter()
+        self.rss_growth = None
+        self.process_peak_rss = None
+        self.info = {}
+        self.enabled = enabled
+        self.nested = []
+        self._start_rss = current_rss() if enabled else None
+
+    def measure_memory(self) -> None:
+        """
+        Sets rss_growth (since the StageMetrics was created) and process_peak_rss, at the end of the stage
+        """
+        end_rss = current_rss()
+        if end_rss is not None and self._start_rss is not None:
+            self.rss_growth = end_rss - self._start_rss
+        self.process_peak_rss = process_peak_rss()
+
+    def count_lines(self, lines: iter) -> iter:
+        """
+        Returns lines, counting the lines and characters as they're consumed
+        """
+        if not self.enabled:
+            return lines
+        return self._count_lines(lines)
+
+    def _count_lines(self, lines: iter) -> str:
+        for line in lines:
+            self.lines += 1
+            self.bytes += len(line)
+            yield line
+
+    def timed(self, items: iter) -> iter:
+        """
+        Returns items, adding the time taken to produce each item (but not the time taken by the consumer of the items)
+        to wall_time and cpu_time. This measures a stage that runs lazily inside another one (e.g. comparing the bulk
+        data as the report is written), which should list this stage in nested.
+        """
+        if not self.enabled:
+            return items
+        return self._timed(iter(items))
+
+    def _timed(self, items: iter) -> object:
+        while True:
+            wall_start = time.perf_counter()
+            cpu_start = cpu_time()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.wall_time += time.perf_counter() - wall_start
+                self.cpu_time += cpu_time() - cpu_start
+            yield item
+
+    def count_cards(self, bulk) -> None:
+        """
+        Counts the bulk data entries of bulk data parsed by NastranDiff.parse_bulk_fields by card type
+        """
+        if not self.enabled:
+            return
+        if hasattr(bulk, "columns"):  # a ColumnarBulk
+            for bde_name, columns in bulk.columns.items():
+                self.cards[bde_name] += len(columns)
+            bulk = bulk.generic
+        for card_type, n in collections.Counter(card.type_id for card in bulk.values()).items():
+            self.cards[nastrandiff.card.type_name(card_type)] += n
+
+    def as_dict(self) -> dict:
+        return collections.OrderedDict([("name", self.name),
+                                        ("wall_time", self.wall_time),
+                                        ("cpu_time", self.cpu_time),
+                                        ("lines", self.lines),
+                                        ("bytes", self.bytes),
+                                        ("cards", dict(sorted(self.cards.items()))),
+                                        ("rss_growth", self.rss_growth),
+                                        ("process_peak_rss", self.process_peak_rss),
+                                        ("info", self.info)])
+
+
+class Metrics:
+    """
+    Records the measurements of each stage of a diff, calling the hooks as each stage finishes. Stages run in worker
+    processes may overlap, so the totals are measured separately (between begin and end).
+
+    Members:
+
+    - stages: A list of the StageMetrics of the stages that have finished, in the order that they finished
+    - hooks: A list of functions called with the StageMetrics of each stage as it finishes
+    - wall_time: The elapsed time in seconds between begin and end
+    - cpu_time: The CPU time in seconds between begin and end
+    """
+    def __init__(self):
+        self.stages = []
+        self.hooks = []
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        self._start = (0., 0.)
+
+    def begin(self) -> None:
+        """
+        Starts measuring a diff, removing any stages recorded before
+        """
+        self.stages = []
+        self._start = (time.perf_counter(), cpu_time())
+
+    def end(self) -> None:
+        self.wall_time = time.perf_counter() - self._start[0]
+        self.cpu_time = cpu_time() - self._start[1]
+
+    def add_hook(self, hook: typing.Callable[[StageMetrics], None]) -> None:
+        self.hooks.append(hook)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> StageMetrics:
+        """
+        A context manager that measures a stage, yielding its StageMetrics so that the lines, cards, etc. can be
+        counted. The stage is recorded when the context exits without an exception.
+        """
+        stage = StageMetrics(name)
+        wall_start = time.perf_counter()
+        cpu_start = cpu_time()
+        yield stage
+        stage.wall_time = time.perf_counter() - wall_start - sum(s.wall_time for s in stage.nested)
+        stage.cpu_time = cpu_time() - cpu_start - sum(s.cpu_time for s in stage.nested)
+        stage.measure_memory()
+        self.record(stage)
+
+    def record(self, stage: StageMetrics) -> None:
+        """
+        Records a stage that was measured elsewhere (e.g. in a worker process)
+        """
+        self.stages.append(stage)
+        for hook in self.hooks:
+            hook(stage)
+
+    def as_dict(self) -> dict:
+        return collections.OrderedDict([("version", METRICS_VERSION),
+                                        ("wall_time", self.wall_time),
+                                        ("cpu_time", self.cpu_time),
+                                        ("process_peak_rss", process_peak_rss()),
+                                        ("stages", [s.as_dict() for s in self.stages])])
+
+    def write_json(self, file_name: str, **extra) -> None:
+        """
+        Writes the measurements to a JSON file. extra is added to the top level (e.g. the names of the decks).
+        """
+        d = self.as_dict()
+        d.update(extra)
+        with open(file_name, "w") as f:
+            json.dump(d, f, indent=2)
+
+
+def stage(metrics: typing.Union[None, Metrics], name: str) -> typing.ContextManager[StageMetrics]:
+    """
+    Returns metrics.stage(name), or a context manager yielding a StageMetrics that isn't recorded if metrics is None
+    """
+    if metrics is None:
+        return _unrecorded(name)
+    return metrics.stage(name)
+
+
+@contextlib.contextmanager
+def _unrecorded(name: str) -> StageMetrics:
+    yield StageMetrics(name, enabled=False)
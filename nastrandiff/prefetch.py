@@ -0,0 +1,330 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Reads the files INCLUDEd by a deck for NastranDiff.read_file. An IncludeReader opens each included file when its
+INCLUDE statement is reached; an IncludePrefetcher reads them ahead of time in a pool of threads, so that on slow (e.g.
+network) file systems the parser doesn't wait for each file in turn.
+"""
+
+import concurrent.futures
+import contextlib
+import heapq
+import os
+import threading
+import typing
+
+import nastrandiff
+import nastrandiff.compressed
+
+
+def check_cycle(parents: tuple, path: str) -> None:
+    """
+    Raises a ValueError if the real path of an included file is one of the real paths of the files including it
+    """
+    if path in parents:
+        raise ValueError("INCLUDE cycle: {}".format(" -> ".join(parents[parents.index(path):] + (path,))))
+
+
+class _BufferedFile:
+    # The lines of an included file that was read by an IncludePrefetcher
+    def __init__(self, name: str, lines: list):
+        self.name = name
+        self.lines = lines
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+class IncludeReader:
+    """
+    Yields the lines of a deck, replacing INCLUDE statements with the lines of the included files. Each included file
+    is opened when its INCLUDE statement is reached and closed when it has been read (or when the generator is closed).
+    Compressed files are decompressed as they're read (see nastrandiff.compressed).
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def read(self, f: typing.TextIO, break_at: str, skip: dict = None, located: bool = False) -> iter:
+        """
+        Yields the lines of f up to the line starting with break_at, as described for NastranDiff.read_file. If
+        located is True, f is a nastrandiff.structured._NumberedFile and (file name, line number, line) tuples are
+        yielded instead. Raises a ValueError if a file includes itself, directly or through other files.
+        """
+        return self._read(f, self._root(f), break_at, skip, located, ())
+
+    def _root(self, f: typing.TextIO):
+        # The node of the root file in the tree of included files (see IncludePrefetcher)
+        return None
+
+    def _child(self, node, include_name: str, read: bool = True):
+        # The node of the next file included by node, which should be include_name. read is False if the file is
+        # skipped.
+        return None
+
+    def _release(self, node) -> None:
+        # Called for included files that are skipped
+        pass
+
+    def _open(self, node, include_name: str) -> typing.ContextManager[typing.Iterable[str]]:
+        return nastrandiff.compressed.open_deck(include_name)
+
+    def _read(self, f, node, break_at: str, skip: typing.Union[None, dict], located: bool, parents: tuple) -> iter:
+        # parents holds the real paths of the files including f
+        directory = None
+        for line in f:
+            if line.startswith(break_at):
+                break
+            include = nastrandiff.NastranDiff.check_for_include(line)
+            if include is None:
+                yield (f.name, f.line_number, line) if located else line
+                continue
+            if directory is None:
+                path = os.path.realpath(f.name)
+                directory = os.path.dirname(path) + os.path.sep
+                parents += (path,)
+            include_name = nastrandiff.compressed.resolve(directory + include)
+            include_path = os.path.realpath(include_name)
+            skipped = bool(skip) and skip.get(include_path, 0) > 0
+            child = self._child(node, include_name, not skipped)
+            if skipped:
+                skip[include_path] -= 1
+                self._release(child)
+                continue
+            check_cycle(parents, include_path)
+            with self._open(child, include_name) as include_f:
+                if located:
+                    include_f = nastrandiff.structured._NumberedFile(include_f)
+                yield from self._read(include_f, child, break_at, skip, located, parents)
+
+
+class _Node:
+    # A file in the tree of included files of an IncludePrefetcher. order is the position of the file in the deck (a
+    # tuple of the index of the INCLUDE statement in each of the files including it), so nodes sort in deck order.
+    __slots__ = ("name", "path", "order", "parents", "children", "next_child", "lines", "size", "error", "future",
+                 "state", "streamed")
+
+    PENDING = 0
+    READING = 1
+    DONE = 2
+    RELEASED = 3
+
+    def __init__(self, name: str, order: tuple, parents: tuple):
+        self.name = name
+        self.path = os.path.realpath(name)
+        self.order = order
+        self.parents = parents
+        self.children = []
+        self.next_child = 0
+        self.lines = None
+        self.size = 0
+        self.error = None
+        self.future = None
+        self.state = _Node.PENDING
+        self.streamed = False  # True if the file is read by the parser as it goes, rather than ahead of time
+
+
+class IncludePrefetcher(IncludeReader):
+    """
+    An IncludeReader for one deck that reads its included files ahead of the parser in a pool of threads. The root file
+    is only read by the parser (so it isn't held in memory, or read twice): each file that it includes starts being
+    read when the parser reaches its INCLUDE statement. Each file that is read is scanned for the files that it
+    includes in turn, so the tree of files below an INCLUDE of the root file is found ahead of time. The files are read
+    in the order that they appear in the deck, and their lines are kept until the parser reaches them.
+
+    Each file is opened by one thread, read at once and closed, so at most threads files are open at a time (plus one
+    if the parser reaches a file before a thread has started reading it, in which case the parser reads it as it goes).
+    Reading ahead stops while more than max_buffered bytes are waiting for the parser, and a file is only read ahead if
+    it is smaller than max_buffered divided by threads: a larger file is left for the parser to read as it goes (and
+    the files that it includes aren't read ahead), so that no more than about twice max_buffered bytes are held
+    however large the files are. Included files that are skipped, or that are after the end of a section in the file
+    including them, are dropped. Call close (or use a with statement) when the deck has been read.
+
+    The same IncludePrefetcher must be used to read all of the sections of the deck, since it follows the INCLUDE
+    statements in order.
+
+    Members:
+
+    - threads: The number of threads reading files
+    - max_buffered: The number of bytes of lines that can wait for the parser before reading ahead stops
+    - buffered: The number of bytes of lines waiting for the parser
+    - prefetched: The number of files whose lines were ready when the parser reached them
+    """
+    def __init__(self, file_name: str, threads: int = 4, max_buffered: int = 64 * 1024 ** 2):
+        self.threads = threads
+        self.max_buffered = max_buffered
+        self.buffered = 0
+        self.prefetched = 0
+        self._lock = threading.Lock()
+        self._pending = []  # a heap of (order, node) of the files that can be read
+        self._reading = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.root = _Node(file_name, (), ())
+        self.root.state = _Node.DONE  # its children are added as the parser reaches them (see _child)
+
+    def close(self) -> None:
+        with self._lock:
+            self._pending = []
+            self._drop(self.root)
+        self._executor.shutdown(wait=True)  # the files being read are closed before this returns
+
+    def _fill(self) -> None:
+        # Starts reading files until all of the threads are busy. Called with the lock held.
+        while len(self._pending) > 0 and self._reading < self.threads and self.buffered < self.max_buffered:
+            node = heapq.heappop(self._pending)[1]
+            if node.state == _Node.PENDING:
+                node.state = _Node.READING
+                self._reading += 1
+                node.future = self._executor.submit(self._run, node)
+
+    def _run(self, node: _Node) -> None:
+        # Executed in a thread
+        try:
+            self._load(node)
+        finally:
+            with self._lock:
+                self._reading -= 1
+                self._fill()
+
+    def _load(self, node: _Node) -> None:
+        # Reads a file and finds the files that it includes. A file larger than the budget of each thread is streamed.
+        lines = []
+        children = []
+        try:
+            budget = max(1, self.max_buffered // self.threads)
+            size = 0
+            with nastrandiff.compressed.open_deck(node.name) as f:
+                for line in f:
+                    lines.append(line)
+                    size += len(line)
+                    if size > budget:
+                        lines = []
+                        node.streamed = True
+                        break
+            directory = os.path.dirname(node.path) + os.path.sep
+            parents = node.parents + (node.path,)
+            for line in lines:
+                if line.startswith("INCLUDE"):
+                    include = nastrandiff.NastranDiff.check_for_include(line)
+                    if include is not None:
+                        children.append(_Node(nastrandiff.compressed.resolve(directory + include),
+                                              node.order + (len(children),), parents))
+        except Exception as e:
+            node.error = e  # raised when the parser reaches the file
+        with self._lock:
+            if node.state == _Node.RELEASED:
+                return
+            node.state = _Node.DONE
+            node.children = children
+            node.lines = lines
+            node.size = sum(len(line) for line in lines)
+            self.buffered += node.size
+            for child in children:
+                if child.path not in child.parents:  # a cycle is reported when the parser reaches it
+                    heapq.heappush(self._pending, (child.order, child))
+
+    def _drop(self, node: _Node) -> None:
+        # Drops the lines of a file and the files it includes. Called with the lock held.
+        nodes = [node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            node.state = _Node.RELEASED
+            if node.lines is not None:
+                self.buffered -= node.size
+                node.lines = None
+            nodes.extend(node.children)
+
+    def _root(self, f: typing.TextIO) -> typing.Union[None, _Node]:
+        if os.path.realpath(getattr(f, "name", "")) != self.root.path:
+            return None  # not the deck this was made for
+        return self.root
+
+    def _child(self, node: typing.Union[None, _Node], include_name: str,
+               read: bool = True) -> typing.Union[None, _Node]:
+        if node is self.root:
+            child = _Node(include_name, (len(node.children),), (node.path,))
+            with self._lock:
+                node.children.append(child)
+                node.next_child += 1
+                if read and child.path not in child.parents:  # a cycle is reported by the parser
+                    heapq.heappush(self._pending, (child.order, child))
+                    self._fill()
+            return child
+        if node is not None and node.future is not None:
+            node.future.result()  # wait for the file to be scanned
+        if node is None or node.next_child >= len(node.children) or \
+                node.children[node.next_child].name != include_name:
+            return None  # the file was changed after it was scanned, so it's read as for an IncludeReader
+        node.next_child += 1
+        return node.children[node.next_child - 1]
+
+    def _release(self, node: typing.Union[None, _Node]) -> None:
+        if node is not None:
+            with self._lock:
+                self._drop(node)
+                self._fill()
+
+    @contextlib.contextmanager
+    def _open(self, node: typing.Union[None, _Node], include_name: str) -> typing.Iterable[str]:
+        if node is None:
+            with nastrandiff.compressed.open_deck(include_name) as f:
+                yield f
+            return
+        with self._lock:
+            if node.state == _Node.PENDING:
+                node.state = _Node.READING  # read here as the parser goes, rather than waiting for a thread
+                node.streamed = True
+            else:
+                self.prefetched += node.future is not None and node.future.done()
+        if node.future is not None:
+            node.future.result()
+        if node.streamed:
+            # the files that it includes are read as for an IncludeReader (see _child)
+            with nastrandiff.compressed.open_deck(include_name) as f:
+                yield f
+            return
+        with self._lock:
+            lines = node.lines
+            node.lines = None
+            self.buffered -= node.size
+            self._fill()
+        if node.error is not None:
+            raise node.error
+        try:
+            yield _BufferedFile(include_name, lines)
+        finally:
+            # the files after the end of the section in this file are never read
+            with self._lock:
+                for child in node.children[node.next_child:]:
+                    self._drop(child)
+                self._fill()
+
+
+def include_reader(file_name: typing.Union[None, str], threads: int = 0,
+                   max_buffered: int = 64 * 1024 ** 2) -> IncludeReader:
+    """
+    Returns an IncludePrefetcher (holding about max_buffered bytes, see IncludePrefetcher) for the deck in file_name if
+    threads is more than 0, and an IncludeReader otherwise (or if the deck isn't a named file)
+    """
+    if threads > 0 and file_name is not None:
+        return IncludePrefetcher(file_name, threads, max_buffered)
+    return IncludeReader()
@@ -0,0 +1,159 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import itertools
+import os
+import re
+import tempfile
+
+import nastrandiff.external
+
+# The memory used for the rows of each card type when NastranDiff.memory_limit isn't set, in bytes
+_DEFAULT_BATCH_MEMORY = 64 * 1024 ** 2
+
+
+def card_type(bde: str) -> str:
+    """
+    Returns the name of a formatted bulk data entry (e.g. "GRID")
+    """
+    return bde[0:8].strip()
+
+
+class PaginatedReport:
+    """
+    Writes the differences between two decks as a directory of small HTML pages rather than one (possibly huge) page.
+
+    - index.html lists the number of changed, added and deleted bulk data entries of each card type, with links to the
+      pages for that card type
+    - control.html holds the executive control and case control tables
+    - [card type]-[page].html holds up to page_size rows of the bulk data table for one card type
+
+    Members:
+
+    - nd: The NastranDiff used to format the rows of the tables
+    - directory: The directory where the pages are written
+    - page_size: The maximum number of bulk data entries on each page
+    - counts: A Counter of the number of "changed", "deleted" and "added" entries, after write
+    """
+    def __init__(self, nd, directory: str, page_size: int = 1000):
+        self.nd = nd
+        self.directory = directory
+        self.page_size = page_size
+        self.counts = collections.Counter()
+
+    _page_template = """
+    <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+              "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+    <html>
+    <head>
+        <meta http-equiv="Content-Type"
+              content="text/html; charset=ISO-8859-1" />
+        <title>%(title)s</title>
+        <style type="text/css">%(styles)s
+        </style>
+    </head>
+    <body>
+        <p>%(navigation)s</p>
+        <h2>%(title)s</h2>
+    %(content)s
+        <p>%(navigation)s</p>
+    </body>
+    </html>"""
+
+    _index_row_template = """
+            <tr><td>%(card_type)s</td><td class="diff_chg">%(changed)d</td><td class="diff_add">%(added)d</td>
+                <td class="diff_sub">%(deleted)d</td><td>%(links)s</td></tr>"""
+
+    @staticmethod
+    def page_name(name: str, page: int) -> str:
+        return "{}-{}.html".format(re.sub("[^A-Za-z0-9_]", "_", name), page)
+
+    def _write_page(self, file_name: str, title: str, navigation: str, content) -> None:
+        # content may be a string or a function that writes the content to the file
+        head, tail = self._page_template.split("%(content)s")
+        with open(os.path.join(self.directory, file_name), "w") as f:
+            f.write(head % dict(title=title, styles=self.nd._styles, navigation=navigation))
+            if callable(content):
+                content(f)
+            else:
+                f.write(content)
+            f.write(tail % dict(navigation=navigation))
+
+    def _spill_file(self, directory: str, kind: str) -> nastrandiff.external.SpillFile:
+        # A SpillFile holding the rows of one kind for one card type. Only one batch of rows is held in memory, so
+        # memory_limit holds for the report as well.
+        memory_limit = self.nd.memory_limit if self.nd.memory_limit is not None else _DEFAULT_BATCH_MEMORY
+        return nastrandiff.external.SpillFile(os.path.join(directory, kind + ".out"),
+                                              max(1, memory_limit // nastrandiff.external._BATCH_FRACTION),
+                                              lambda r: len(r[0] or "") + len(r[1] or ""))
+
+    def write(self, table_exec: str, table_case: str, differences, from_desc: str, to_desc: str) -> str:
+        """
+        Writes the report of differences (as from NastranDiff.bulk_differences, in key order so that the entries of
+        each card type are together) and returns the path of the index page. The rows of one card type at a time are
+        written to spill files, so that it's known how many pages there are before they're written.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        index_rows = []
+        with tempfile.TemporaryDirectory(prefix="nastrandiff-", dir=self.nd.spill_dir) as spill_dir:
+            for name, type_differences in itertools.groupby(differences, lambda d: card_type(d[0] or d[1])):
+                # the rows of each kind, in the order of write_table_differences
+                spills = collections.OrderedDict((kind, self._spill_file(spill_dir, kind))
+                                                 for kind in ("chg", "sub", "add"))
+                try:
+                    for d1, d2 in type_differences:
+                        spills["sub" if d2 is None else "add" if d1 is None else "chg"].append((d1, d2))
+                    kinds = {kind: len(spill.close()) for kind, spill in spills.items()}
+                    n_rows = sum(kinds.values())
+                    n_pages = max(1, -(-n_rows // self.page_size))
+                    rows = itertools.chain.from_iterable(spills.values())
+                    for page in range(n_pages):
+                        navigation = ['<a href="index.html">Index</a>']
+                        if page > 0:
+                            navigation.append('<a href="{}">Previous</a>'.format(self.page_name(name, page)))
+                        if page < n_pages - 1:
+                            navigation.append('<a href="{}">Next</a>'.format(self.page_name(name, page + 2)))
+
+                        def content(f):
+                            self.nd.write_table_differences(f, itertools.islice(rows, self.page_size),
+                                                            from_desc=from_desc, to_desc=to_desc)
+
+                        self._write_page(self.page_name(name, page + 1),
+                                         "{} (page {} of {})".format(name, page + 1, n_pages),
+                                         " | ".join(navigation), content)
+                finally:
+                    for spill in spills.values():
+                        spill.remove()
+
+                self.counts.update(changed=kinds["chg"], deleted=kinds["sub"], added=kinds["add"])
+                links = " ".join('<a href="{}">{}</a>'.format(self.page_name(name, page + 1), page + 1)
+                                 for page in range(n_pages))
+                index_rows.append(self._index_row_template % dict(
+                    card_type=name, changed=kinds["chg"], added=kinds["add"], deleted=kinds["sub"], links=links))
+
+        self._write_page("control.html", "Executive and Case Control", '<a href="index.html">Index</a>',
+                         "<h2>Executive Control</h2>\n%s\n<h2>Case Control</h2>\n%s" % (table_exec, table_case))
+
+        index = """
+        <p><a href="control.html">Executive and Case Control</a></p>
+        <p>Bulk data: %(changed)d changed, %(added)d added, %(deleted)d deleted</p>
+        <table class="diff" summary="Bulk data differences by card type">
+            <tr><th>Card type</th><th>Changed</th><th>Added</th><th>Deleted</th><th>Pages</th></tr>%(rows)s
+        </table>""" % dict(changed=self.counts["changed"], added=self.counts["added"], deleted=self.counts["deleted"],
+                           rows="".join(index_rows))
+        self._write_page("index.html", "%s vs. %s" % (from_desc, to_desc), "", self.nd._legend + index)
+        return os.path.join(self.directory, "index.html")
@@ -0,0 +1,595 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+A long-running diff server, so that programs that diff decks often (e.g. after every save) don't pay for starting
+Python and parsing unchanged decks each time. The server listens on localhost or a Unix socket and keeps recently
+parsed files in memory (see DeckLRU and DiffService). Diffs are requested with a POST to /diff (see DiffService.diff
+and request_diff) and are answered in any of the report formats.
+"""
+
+import collections
+import functools
+import hashlib
+import http.client
+import http.server
+import io
+import ipaddress
+import json
+import os
+import socket
+import socketserver
+import threading
+import typing
+
+import nastrandiff
+import nastrandiff.columnar
+import nastrandiff.compare
+import nastrandiff.compressed
+import nastrandiff.external
+import nastrandiff.prefetch
+import nastrandiff.snapshot
+import nastrandiff.structured
+
+_DeckEntry = collections.namedtuple("_DeckEntry", ["states", "value", "size"])
+
+
+class _Unsplittable(Exception):
+    # Raised when a deck can't be read one file at a time (see DiffService)
+    pass
+
+
+def scan_file(file_name: str) -> (tuple, list, typing.Union[None, list]):
+    """
+    Reads a file, returning its state, the names of the files that it INCLUDEs before its bulk data, and the names of
+    those that it INCLUDEs in its bulk data (None if the bulk data doesn't start in the file). The state is a tuple of
+    the file name, modification time, size and SHA-256 digest (of the decompressed contents, for a compressed file).
+    The file is checked before it's read, so a change made while it's read makes the state out of date.
+    """
+    st = os.stat(file_name)
+    h = hashlib.sha256()
+    directory = os.path.dirname(os.path.realpath(file_name)) + os.path.sep
+    control = []
+    bulk = None
+    # the sections end at the first lines starting with these in this file (see NastranDiff.read_deck)
+    breaks = [b"CEND", b"BEGIN BULK", b"ENDDATA"]
+    with nastrandiff.compressed.open_binary(file_name) as f:
+        for line in f:
+            h.update(line)
+            if len(breaks) > 0 and line.startswith(breaks[0]):
+                breaks.pop(0)
+                if len(breaks) == 1:
+                    bulk = []
+            elif line.startswith(b"INCLUDE") and len(breaks) > 0:
+                include = nastrandiff.NastranDiff.check_for_include(line.decode(errors="replace"))
+                if include is not None:
+                    (control if bulk is None else bulk).append(nastrandiff.compressed.resolve(directory + include))
+    return (file_name, st.st_mtime_ns, st.st_size, h.hexdigest()), control, bulk
+
+
+def tree_states(file_name: str, parents: tuple = ()) -> list:
+    """
+    Returns the states (see scan_file) of a file and of all of the files that it INCLUDEs. parents holds the real
+    paths of the files including file_name, so that cycles raise a ValueError.
+    """
+    path = os.path.realpath(file_name)
+    nastrandiff.prefetch.check_cycle(parents, path)
+    state, control, bulk = scan_file(file_name)
+    states = [state]
+    for include in control + (bulk or []):
+        states.extend(tree_states(include, parents + (path,)))
+    return states
+
+
+def bulk_size(bulk: typing.Union[dict, nastrandiff.columnar.ColumnarBulk]) -> int:
+    """
+    Returns an estimate of the memory used by parsed bulk data, in bytes
+    """
+    if isinstance(bulk, nastrandiff.columnar.ColumnarBulk):
+        return bulk_size(bulk.generic) + sum(9 * len(c) * (len(c.values) + 2) for c in bulk.columns.values())
+    return sum(nastrandiff.external.entry_size(card) for card in bulk.values())
+
+
+def _lines_size(lines: list) -> int:
+    return sum(100 + len(line if isinstance(line, str) else line[2]) for line in lines)
+
+
+class DeckLRU:
+    """
+    An in-memory cache of parsed files. When they take more than max_size bytes, the least recently used ones are
+    removed. It can be used from several threads.
+
+    Each entry records the state (see scan_file) of the files that it was read from. An entry is used if the
+    modification time and size of these files are the same. If any of them changed, the digest of its contents is
+    computed again, and the entry is still used if the contents are the same; otherwise the file is read again.
+
+    Members:
+
+    - max_size: The maximum total size of the entries, in bytes
+    - size: The total size of the entries, in bytes
+    - hits: The number of entries found without reading any file
+    - revalidations: The number of entries found after checking that the contents of changed files are the same
+    - misses: The number of entries that had to be read
+    - evictions: The number of entries removed to stay below max_size
+    """
+    def __init__(self, max_size: int = 1024 ** 3):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _check(states: list) -> typing.Union[None, list]:
+        # Returns the current states if the contents of the files are the same (None otherwise)
+        current = []
+        for state in states:
+            try:
+                st = os.stat(state[0])
+            except OSError:
+                return None
+            if (st.st_mtime_ns, st.st_size) != state[1:3]:
+                if st.st_size != state[2]:
+                    return None
+                new_state = scan_file(state[0])[0]
+                if new_state[3] != state[3]:
+                    return None
+                state = new_state
+            current.append(state)
+        return current
+
+    def get(self, file_name: str, kind: str, load: typing.Callable[[str], tuple]):
+        """
+        Returns the value read from file_name by load, which is called with file_name if there's no usable entry for
+        its real path. load returns the value, the states (see scan_file) of the files that it was read from, and an
+        estimate of its size in bytes. kind distinguishes values read in different ways.
+        """
+        key = (os.path.realpath(file_name), kind)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            states = self._check(entry.states)
+            if states is not None:
+                with self._lock:
+                    if states == entry.states:
+                        self.hits += 1
+                        if key in self._entries:
+                            self._entries.move_to_end(key)
+                    else:
+                        self.revalidations += 1
+                        self._store(key, entry._replace(states=states))
+                return entry.value
+
+        value, states, size = load(file_name)
+        with self._lock:
+            self.misses += 1
+            self._store(key, _DeckEntry(states, value, size))
+        return value
+
+    def _store(self, key: tuple, entry: _DeckEntry) -> None:
+        # Called with the lock held
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_size and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.size -= old.size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(entries=len(self._entries), size=self.size, max_size=self.max_size, hits=self.hits,
+                        revalidations=self.revalidations, misses=self.misses, evictions=self.evictions)
+
+
+def _file_lines(f: "nastrandiff.structured._NumberedFile", includes: list, located: bool) -> iter:
+    # Yields the rest of the lines of f up to ENDDATA (as (file name, line number, line) tuples if located is True),
+    # leaving out the INCLUDEd files, whose names are appended to includes. Raises _Unsplittable if an entry continues
+    # across an INCLUDE statement, since the files couldn't then be parsed separately.
+    directory = os.path.dirname(os.path.realpath(f.name)) + os.path.sep
+    boundary = True
+    for line in f:
+        if line.startswith("ENDDATA"):
+            break
+        include = nastrandiff.NastranDiff.check_for_include(line)
+        if include is not None:
+            includes.append(nastrandiff.compressed.resolve(directory + include))
+            boundary = True
+            continue
+        if boundary:
+            if nastrandiff.NastranDiff.is_card_start(line):
+                boundary = False
+            elif len((line[0:line.find("$")] if "$" in line else line).strip()) > 0:
+                raise _Unsplittable()
+        yield (f.name, f.line_number, line) if located else line
+
+
+def _parse_part(lines: iter, located: bool, options: dict) -> (typing.Union[dict, tuple], int):
+    # Parses the bulk data lines of one file with the card filter in options, returning the bulk data (with the
+    # locations if located is True) and an estimate of its size
+    options = dict(include_cards=options["include_cards"], exclude_cards=options["exclude_cards"])
+    if located:
+        bulk, locations = nastrandiff.structured.parse_located(lines, options)
+        return (bulk, locations), bulk_size(bulk) + 150 * len(locations)
+    bulk = nastrandiff.NastranDiff.parse_bulk_fields(lines, options=options)
+    return bulk, bulk_size(bulk)
+
+
+class DiffService:
+    """
+    Answers diff requests using a DeckLRU.
+
+    Decks are cached one file at a time where possible, so that when a file of a deck is edited, only that file is read
+    again. The root file of a deck holds the control sections and the start of the bulk data, and each file that it
+    INCLUDEs in the bulk data (and each file that those include) holds part of the bulk data. The parts are merged for
+    each request. If the bulk data can't be split this way (because an entry continues across an INCLUDE statement,
+    the bulk data doesn't start in the root file, the same key is in more than one file or the card types are stored
+    in columns) the whole deck is cached instead.
+
+    Members:
+
+    - decks: The DeckLRU holding the parsed files
+    - options: The NastranDiff members set for every request (e.g. columnar_types)
+    - verbose: A boolean indicating whether to log each request
+    """
+    # The options that a request can set, and their types
+    request_options = dict(context=(int, type(None)), separators=bool, abs_tol=(int, float), rel_tol=(int, float),
+                           tolerances=list, format=str, include_cards=(list, type(None)), exclude_cards=list)
+
+    def __init__(self, max_size: int = 1024 ** 3, options: dict = None):
+        self.decks = DeckLRU(max_size)
+        self.options = {} if options is None else options
+        self.verbose = False
+
+    @staticmethod
+    def _load_root(located: bool, options: dict, file_name: str) -> (typing.Union[None, tuple], list, int):
+        # Reads the root file of a deck for DeckLRU.get: the control sections and the bulk data in the file, with the
+        # names of the files it INCLUDEs in the bulk data. The value is None if the deck can't be split.
+        state, control, bulk = scan_file(file_name)
+        states = [state]
+        for include in control:
+            states.extend(tree_states(include))
+        if bulk is None:
+            return None, states, 0
+        with nastrandiff.compressed.open_deck(file_name) as f:
+            if located:
+                f = nastrandiff.structured._NumberedFile(f)
+                exec_lines = list(nastrandiff.structured.read_located(f, "CEND"))
+                case_lines = list(nastrandiff.structured.read_located(f, "BEGIN BULK"))
+            else:
+                exec_lines = list(nastrandiff.NastranDiff.read_file(f, "CEND"))
+                case_lines = list(nastrandiff.NastranDiff.read_file(f, "BEGIN BULK"))
+                f = nastrandiff.structured._NumberedFile(f)
+            includes = []
+            try:
+                part, size = _parse_part(_file_lines(f, includes, located), located, options)
+            except _Unsplittable:
+                return None, states, 0
+        return (exec_lines, case_lines, part, includes), states, size + _lines_size(exec_lines + case_lines)
+
+    @staticmethod
+    def _load_part(located: bool, options: dict, file_name: str) -> (typing.Union[None, tuple], list, int):
+        # Reads a file INCLUDEd in the bulk data for DeckLRU.get, returning its bulk data and the names of the files
+        # it INCLUDEs. The value is None if the deck can't be split.
+        state = scan_file(file_name)[0]
+        with nastrandiff.compressed.open_deck(file_name) as f:
+            includes = []
+            try:
+                part, size = _parse_part(_file_lines(nastrandiff.structured._NumberedFile(f), includes, located),
+                                         located, options)
+            except _Unsplittable:
+                return None, [state], 0
+        return (part, includes), [state], size
+
+    @staticmethod
+    def _kind(nd: "nastrandiff.NastranDiff", name: str, located: bool) -> str:
+        # The kind of the DeckLRU entries of a file, which depends on how it's parsed
+        kind = ("located " if located else "") + name
+        variant = nd.cache_variant()
+        return kind + ":" + variant if variant else kind
+
+    def _add_parts(self, nd: "nastrandiff.NastranDiff", includes: list, located: bool, parts: list,
+                   stack: list) -> None:
+        # Appends the bulk data of each included file, and of the files it includes, to parts
+        for include in includes:
+            path = os.path.realpath(include)
+            if path in stack:
+                raise _Unsplittable()  # an INCLUDE cycle, which is reported when the whole deck is read
+            value = self.decks.get(include, self._kind(nd, "part", located),
+                                   functools.partial(self._load_part, located, nd.parse_options()))
+            if value is None:
+                raise _Unsplittable()
+            parts.append(value[0])
+            self._add_parts(nd, value[1], located, parts, stack + [path])
+
+    def _split_deck(self, nd: "nastrandiff.NastranDiff", file_name: str, located: bool) -> tuple:
+        # Returns a deck merged from the cached files, or raises _Unsplittable
+        root = self.decks.get(file_name, self._kind(nd, "root", located),
+                              functools.partial(self._load_root, located, nd.parse_options()))
+        if root is None:
+            raise _Unsplittable()
+        exec_lines, case_lines, part, includes = root
+        parts = [part]
+        self._add_parts(nd, includes, located, parts, [os.path.realpath(file_name)])
+        bulk = {}
+        locations = {}
+        for part in parts:
+            if located:
+                bulk.update(part[0])
+                locations.update(part[1])
+            else:
+                bulk.update(part)
+        if len(bulk) != sum(len(part[0] if located else part) for part in parts):
+            # an entry replaces one in another file, which must be done in the order of the deck
+            raise _Unsplittable()
+        return exec_lines, case_lines, (bulk, locations) if located else bulk
+
+    @staticmethod
+    def _load_deck(nd: "nastrandiff.NastranDiff", located: bool, file_name: str) -> (tuple, list, int):
+        # Reads a whole deck for DeckLRU.get
+        states = tree_states(file_name)
+        if nd.memory_map and not located:
+            deck = nastrandiff.NastranDiff.read_mapped_deck(file_name, options=nd.parse_options())
+        else:
+            with nastrandiff.compressed.open_deck(file_name) as f:
+                if located:
+                    deck = nastrandiff.structured.read_located_deck(f, options=nd.parse_options())
+                else:
+                    deck = nastrandiff.NastranDiff.read_deck(f, options=nd.parse_options())
+        bulk = deck[2][0] if located else deck[2]
+        size = _lines_size(deck[0] + deck[1]) + bulk_size(bulk) + (150 * len(deck[2][1]) if located else 0)
+        return deck, states, size
+
+    def _get(self, nd: "nastrandiff.NastranDiff", file_name: str, located: bool) -> tuple:
+        try:
+            if nastrandiff.snapshot.is_snapshot(file_name):
+                # a snapshot is mapped rather than parsed, so it's read again for each request instead of being kept
+                if located:
+                    return nastrandiff.snapshot.read_located_snapshot(file_name, nd.parse_options())
+                return nastrandiff.snapshot.read_snapshot(file_name, nd.parse_options())
+            if located or not nd.columnar_types:
+                try:
+                    return self._split_deck(nd, file_name, located)
+                except _Unsplittable:
+                    pass
+            kind = self._kind(nd, "deck", located)
+            return self.decks.get(file_name, kind, functools.partial(self._load_deck, nd, located))
+        except Exception as e:
+            raise nastrandiff.DeckError(file_name, "{}: {}".format(type(e).__name__, e)) from e
+
+    def diff(self, request: dict) -> (str, str):
+        """
+        Diffs the decks named by "file1" and "file2" in request, returning the content type and the report. The
+        request may also give the "format" ("html", "jsonl" or "csv"), "context", "separators", "abs_tol", "rel_tol",
+        "tolerances" (a list of strings, as for --tolerance), "include_cards" and "exclude_cards" (lists of card types;
+        see NastranDiff.include_cards). Raises a ValueError if the request is invalid, or a DeckError if a deck can't be
+        read.
+        """
+        for name in ("file1", "file2"):
+            if not isinstance(request.get(name), str):
+                raise ValueError("The request must give '{}' as a string".format(name))
+        for name, value in request.items():
+            if name not in ("file1", "file2"):
+                if name not in self.request_options:
+                    raise ValueError("Unknown option '{}'".format(name))
+                if not isinstance(value, self.request_options[name]):
+                    raise ValueError("Invalid value of '{}': {!r}".format(name, value))
+        if not all(isinstance(spec, str) for spec in request.get("tolerances", [])):
+            raise ValueError("The tolerances must be strings")
+        for name in ("include_cards", "exclude_cards"):
+            if not all(isinstance(bde_name, str) for bde_name in request.get(name) or []):
+                raise ValueError("The card types must be strings")
+        output_format = request.get("format", "html")
+        if output_format not in ("html",) + nastrandiff.structured.FORMATS:
+            raise ValueError("Unknown format '{}'".format(output_format))
+
+        nd = nastrandiff.NastranDiff()
+        for name, value in self.options.items():
+            setattr(nd, name, value)
+        for name in ("include_cards", "exclude_cards"):
+            if name in request:
+                setattr(nd, name, None if request[name] is None else set(request[name]))
+        nd.context = request.get("context")
+        nd.separators = request.get("separators", False)
+        if "abs_tol" in request or "rel_tol" in request or request.get("tolerances"):
+            nd.tolerances = nastrandiff.compare.Tolerances(request.get("abs_tol", 0.), request.get("rel_tol", 0.))
+            for spec in request.get("tolerances", []):
+                nd.tolerances.parse_tolerance(spec)
+        file1 = request["file1"]
+        file2 = request["file2"]
+        located = output_format != "html"
+        deck1 = self._get(nd, file1, located)
+        deck2 = self._get(nd, file2, located)
+
+        nd.output = io.StringIO()
+        if output_format == "html":
+            table_exec, table_case = nd.make_control_tables(deck1[0], deck2[0], deck1[1], deck2[1],
+                                                            from_desc=file1, to_desc=file2)
+            nd.write_report(table_exec, table_case, nd.bulk_differences(deck1[2], deck2[2]), from_desc=file1,
+                            to_desc=file2)
+            return "text/html; charset=utf-8", nd.output.getvalue()
+        writer = nastrandiff.structured.make_writer(output_format, nd.output)
+        nastrandiff.structured.write_deck_diff(nd, writer, deck1, deck2)
+        content_type = "application/x-ndjson" if output_format == "jsonl" else "text/csv"
+        return content_type + "; charset=utf-8", nd.output.getvalue()
+
+
+class DiffRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests to a diff server: POST /diff with a JSON object (see DiffService.diff) and GET /stats, which
+    returns the statistics of the DeckLRU as JSON
+    """
+    server_version = "NASTRAN-Diff"
+
+    def _send(self, status: int, content_type: str, body: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status: int, value) -> None:
+        self._send(status, "application/json", json.dumps(value))
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.service.decks.stats())
+        else:
+            self._send_json(404, dict(error="Not found: {}".format(self.path)))
+
+    def do_POST(self):
+        if self.path != "/diff":
+            self._send_json(404, dict(error="Not found: {}".format(self.path)))
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("The request must be a JSON object")
+            content_type, body = self.server.service.diff(request)
+        except nastrandiff.DeckError as e:
+            self._send_json(422, dict(error=str(e), file=e.file_name))
+        except ValueError as e:  # including invalid JSON
+            self._send_json(400, dict(error=str(e)))
+        else:
+            self._send(200, content_type, body)
+
+    def log_message(self, format, *args):
+        if self.server.service.verbose:
+            super().log_message(format, *args)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects the client address to be a (host, port) tuple
+        request, _ = super().get_request()
+        return request, ("localhost", 0)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def is_loopback(host: str) -> bool:
+    """
+    Returns True if all of the addresses of host are loopback addresses, so that only this machine can connect to a
+    server listening on it
+    """
+    try:
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(info[4][0].split("%")[0]).is_loopback for info in infos)
+
+
+def make_server(address: str, service: DiffService, allow_remote: bool = False) -> socketserver.BaseServer:
+    """
+    Returns a server (call serve_forever to run it) answering requests with service. address is "HOST:PORT" (e.g.
+    "localhost:8765"; port 0 picks a free port) or "unix:PATH" for a Unix socket.
+
+    The server reads any file named in a request, so anyone who can connect to it can read the files of the user
+    running it. Unless allow_remote is True, a ValueError is raised if HOST isn't a loopback address.
+    """
+    if address.startswith("unix:"):
+        path = address[5:]
+        if os.path.exists(path):
+            os.remove(path)  # left by a server that wasn't shut down
+        server = _ThreadingUnixHTTPServer(path, DiffRequestHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        host = host or "localhost"
+        if not allow_remote and not is_loopback(host):
+            raise ValueError("{} isn't a loopback address, so other machines could connect to the server".format(
+                host))
+        server = _ThreadingHTTPServer((host, int(port)), DiffRequestHandler)
+    server.service = service
+    return server
+
+
+def server_address(server: socketserver.BaseServer) -> str:
+    """
+    Returns the address of a server from make_server in the form accepted by make_server and request_diff
+    """
+    if isinstance(server.server_address, str):
+        return "unix:" + server.server_address
+    host, port = server.server_address[:2]
+    return "{}:{}".format(host, port)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def _connection(address: str, timeout: float) -> http.client.HTTPConnection:
+    if address.startswith("unix:"):
+        return _UnixHTTPConnection(address[5:], timeout)
+    host, _, port = address.rpartition(":")
+    return http.client.HTTPConnection(host or "localhost", int(port), timeout=timeout)
+
+
+def request(address: str, method: str, path: str, body: dict = None, timeout: float = None) -> (int, str):
+    """
+    Sends a request to a diff server, returning the status and the body of the response
+    """
+    connection = _connection(address, timeout)
+    try:
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        connection.request(method, path, body=data, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, response.read().decode("utf-8")
+    finally:
+        connection.close()
+
+
+def request_diff(address: str, file1: str, file2: str, timeout: float = None, **options) -> str:
+    """
+    Asks a diff server to diff two decks, returning the report. options are the options of DiffService.diff (e.g.
+    format="jsonl"). The file names are sent as absolute paths, since the server may have a different working
+    directory. Raises a RuntimeError with the server's message if the diff fails, or a DeckError naming the address if
+    the answer isn't one from a diff server (e.g. an error page from a proxy).
+    """
+    options.update(file1=os.path.abspath(file1), file2=os.path.abspath(file2))
+    status, body = request(address, "POST", "/diff", options, timeout)
+    if status == 200:
+        return body
+    try:
+        error = json.loads(body)["error"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise nastrandiff.DeckError(address, "The server answered {} with {!r}".format(status, body[:200])) from e
+    raise RuntimeError(error)
@@ -0,0 +1,307 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Snapshots of parsed decks. A snapshot is a binary file holding the executive and case control lines and the bulk data
+of a deck, with where each line and entry came from, so that it can be diffed in place of the deck without parsing it
+(or keeping its INCLUDEd files) again.
+
+A snapshot starts with MAGIC, the version and the size of a JSON header. The header holds the control lines, the
+names of the files of the deck, the entries of the card types that can't be stored in columns and a description of
+a block for each other card type. The blocks follow the header, aligned to 8 bytes: the entries of each card type
+are sorted by ID and stored in columns as for nastrandiff.columnar.CardColumns (the IDs, the layout of each entry,
+and the values and kinds of each field position), followed by the file and line number of each entry. When a
+snapshot is read, the file is mapped and the columns are memoryviews of it, so the bulk data is read without being
+copied or turned into Python objects.
+"""
+
+import array
+import contextlib
+import mmap
+import json
+import os
+import struct
+import sys
+import typing
+
+import nastrandiff
+import nastrandiff.card
+import nastrandiff.columnar
+import nastrandiff.compressed
+import nastrandiff.structured
+
+MAGIC = b"\x89NDSNAP\n"
+
+# Increment this whenever the layout of snapshots changes. Snapshots of other versions can't be read.
+SNAPSHOT_VERSION = 2
+
+# The magic, the version and the size of the header
+_prefix = struct.Struct("<8sIQ")
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def is_snapshot(file_name: typing.Union[None, str]) -> bool:
+    """
+    Returns True if file_name is the name of a snapshot. file_name can be the name of any open file (such as None, or
+    "<stdin>"), so that the files given to NastranDiff can be checked.
+    """
+    if not isinstance(file_name, str):
+        return False
+    try:
+        with open(file_name, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _card_filter(options: typing.Union[None, dict]) -> typing.Callable[[str], bool]:
+    # Returns a function that is True for the card types kept by the filter in options (see NastranDiff.parse_options)
+    include = None if options is None or options.get("include_cards") is None else \
+        frozenset(name.upper() for name in options["include_cards"])
+    exclude = frozenset(name.upper() for name in (options or {}).get("exclude_cards") or ())
+    return lambda bde_name: (include is None or bde_name.upper() in include) and bde_name.upper() not in exclude
+
+
+def write_snapshot(file_name: str, deck: tuple, source: str = None) -> None:
+    """
+    Writes a deck read by nastrandiff.structured.read_located_deck to a snapshot. source is the name of the deck.
+    Every card type except those in nastrandiff.card.multi_field_keys is stored in columns, apart from the card types
+    with entries that can't be stored without loss (see CardColumns.can_store), as for ColumnarBulk.
+    """
+    exec_lines, case_lines, (bulk, locations) = deck
+    files = {}
+    blocks = {}  # the CardColumns of each card type, with the file index and line number of each entry
+    generic = []
+    cards = nastrandiff.NastranDiff.sorted_cards(bulk)
+    generic_types = set(card.name for card in cards if card.name not in nastrandiff.card.multi_field_keys and
+                        not nastrandiff.columnar.CardColumns.can_store(card))
+    for card in cards:
+        location = locations.get(card.key, ("", 0))
+        file_index = files.setdefault(location[0], len(files))
+        bde_name = card.name
+        if bde_name not in nastrandiff.card.multi_field_keys and bde_name not in generic_types:
+            if bde_name not in blocks:
+                blocks[bde_name] = (nastrandiff.columnar.CardColumns(bde_name), array.array("I"), array.array("I"))
+            columns, entry_files, entry_lines = blocks[bde_name]
+            columns.append(card)
+            entry_files.append(file_index)
+            entry_lines.append(location[1])
+        else:
+            generic.append([bde_name, list(card.key[1:]), list(card.fields), card.layout, file_index, location[1]])
+
+    # the arrays are written in order after the header, each at the offset recorded in the header
+    arrays = []
+    offset = 0
+
+    def add(a: array.array) -> int:
+        nonlocal offset
+        start = offset
+        arrays.append((start, a))
+        offset = _aligned(offset + len(a) * a.itemsize)
+        return start
+
+    header_blocks = []
+    for bde_name in sorted(blocks):
+        columns, entry_files, entry_lines = blocks[bde_name]
+        header_blocks.append(dict(card_type=bde_name, rows=len(columns), layouts=columns.layouts,
+                                  strings=columns.strings, ids=add(columns.ids), layout=add(columns.layout),
+                                  values=[add(v) for v in columns.values], kinds=[add(k) for k in columns.kinds],
+                                  files=add(entry_files), lines=add(entry_lines)))
+    header = dict(source=source, byteorder=sys.byteorder,
+                  exec=[[files.setdefault(n, len(files)), i, line] for n, i, line in exec_lines],
+                  case=[[files.setdefault(n, len(files)), i, line] for n, i, line in case_lines],
+                  columnar_types=sorted(blocks), generic_types=sorted(generic_types), blocks=header_blocks,
+                  generic=generic)
+    header["files"] = list(files)  # after the control lines have added their files
+    header_data = json.dumps(header).encode()
+
+    # write to a temporary file first so that a snapshot that is being replaced is never partially written
+    tmp = "{}.{}.tmp".format(file_name, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_prefix.pack(MAGIC, SNAPSHOT_VERSION, len(header_data)))
+            f.write(header_data)
+            start = _aligned(_prefix.size + len(header_data))
+            for array_offset, a in arrays:
+                f.write(bytes(start + array_offset - f.tell()))
+                a.tofile(f)
+        os.replace(tmp, file_name)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)  # open may have failed
+        raise
+
+
+def make_snapshot(deck_name: str, file_name: str, options: dict = None) -> None:
+    """
+    Reads a deck (which may be compressed, see nastrandiff.compressed) with options (see NastranDiff.parse_options)
+    and writes it to a snapshot
+    """
+    with nastrandiff.compressed.open_deck(deck_name) as f:
+        deck = nastrandiff.structured.read_located_deck(f, options=options)
+    write_snapshot(file_name, deck, deck_name)
+
+
+class Snapshot:
+    """
+    A snapshot file. The file is mapped when it's opened, and stays mapped until it's closed (see close), or until the
+    columns read from it are no longer in use if that's later. A Snapshot can be used as a context manager that closes
+    it.
+
+    Members:
+
+    - file_name: The name of the snapshot file
+    - source: The name of the deck that the snapshot was made from
+    - files: The names of the files of the deck, in the order that they were first used
+    - columnar_types: The card types whose entries are stored in columns
+    - generic_types: The card types that aren't stored in columns because they have entries that can't be (see
+      ColumnarBulk.generic_types)
+    """
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        with open(file_name, "rb") as f:
+            prefix = f.read(_prefix.size)
+            if len(prefix) < _prefix.size or not prefix.startswith(MAGIC):
+                raise ValueError("{} isn't a snapshot".format(file_name))
+            _, version, header_size = _prefix.unpack(prefix)
+            if version != SNAPSHOT_VERSION:
+                raise ValueError("{} is a version {} snapshot, but only version {} can be read".format(
+                    file_name, version, SNAPSHOT_VERSION))
+            self._header = json.loads(f.read(header_size).decode())
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._start = _aligned(_prefix.size + header_size)
+        self._swap = self._header["byteorder"] != sys.byteorder
+        self.source = self._header["source"]
+        self.files = self._header["files"]
+        self.columnar_types = frozenset(self._header["columnar_types"])
+        self.generic_types = frozenset(self._header["generic_types"])
+
+    def close(self) -> None:
+        """
+        Unmaps the file. If columns read from it (see bulk) are still in use, it's unmapped once they no longer are.
+        """
+        try:
+            self._data.close()
+        except BufferError:
+            pass  # memoryviews of the mapped file still exist, and they keep it mapped
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _array(self, offset: int, typecode: str, n: int) -> typing.Union[memoryview, array.array]:
+        # Returns an array of the snapshot as a memoryview of the mapped file (or as a copy, if the byte order of the
+        # snapshot is different)
+        itemsize = array.array(typecode).itemsize
+        view = memoryview(self._data)[self._start + offset:self._start + offset + n * itemsize]
+        if not self._swap:
+            return view.cast(typecode)
+        copy = array.array(typecode)
+        copy.frombytes(view)
+        copy.byteswap()
+        return copy
+
+    def lines(self, section: str, located: bool = False) -> list:
+        """
+        Returns the lines of the "exec" or "case" section, as (file name, line number, line) tuples if located is True
+        (as from nastrandiff.structured.read_located)
+        """
+        if located:
+            return [(self.files[i], line_number, line) for i, line_number, line in self._header[section]]
+        return [line for _, _, line in self._header[section]]
+
+    def _columns(self, block: dict) -> nastrandiff.columnar.CardColumns:
+        columns = nastrandiff.columnar.CardColumns(block["card_type"])
+        rows = block["rows"]
+        columns.ids = self._array(block["ids"], "q", rows)
+        columns.layout = self._array(block["layout"], "H", rows)
+        columns.values = [self._array(offset, "d", rows) for offset in block["values"]]
+        columns.kinds = [self._array(offset, "b", rows) for offset in block["kinds"]]
+        columns.layouts = [tuple(layout) for layout in block["layouts"]]
+        columns.strings = block["strings"]
+        columns._layout_index = {layout: i for i, layout in enumerate(columns.layouts)}
+        columns._string_index = {s: i for i, s in enumerate(columns.strings)}
+        return columns
+
+    def _generic(self, keep: typing.Callable[[str], bool]) -> (nastrandiff.card.Card, (str, int)):
+        # Yields the entries that aren't stored in columns, with their locations
+        for bde_name, key_fields, fields, layout, file_index, line_number in self._header["generic"]:
+            if keep(bde_name):
+                card = nastrandiff.card.Card.from_fields(bde_name, tuple(key_fields), tuple(fields),
+                                                         None if layout is None else tuple(layout))
+                yield card, (self.files[file_index], line_number)
+
+    def bulk(self, options: dict = None) -> nastrandiff.columnar.ColumnarBulk:
+        """
+        Returns the bulk data as a ColumnarBulk, leaving out the card types filtered out by options (see
+        NastranDiff.parse_options). The columnar types are columnar_types and those in options, which must be the
+        columnar types of the bulk data that this is compared with (see NastranDiff.compare_parsed_bulk).
+        """
+        keep = _card_filter(options)
+        bulk = nastrandiff.columnar.ColumnarBulk((self.columnar_types |
+                                                  frozenset((options or {}).get("columnar_types") or ())) -
+                                                 self.generic_types)
+        bulk.generic_types = self.generic_types
+        for block in self._header["blocks"]:
+            if keep(block["card_type"]):
+                bulk.columns[block["card_type"]] = self._columns(block)
+        for card, _ in self._generic(keep):
+            bulk.generic[card.key] = card
+        return bulk
+
+    def cards(self, options: dict = None) -> (nastrandiff.card.Card, (str, int)):
+        """
+        Yields each entry of the bulk data as a Card, with the (file name, line number) where it starts, leaving out
+        the card types filtered out by options. This makes a Python object for each entry, so it's much slower than
+        bulk.
+        """
+        keep = _card_filter(options)
+        for block in self._header["blocks"]:
+            if keep(block["card_type"]):
+                columns = self._columns(block)
+                entry_files = self._array(block["files"], "I", len(columns))
+                entry_lines = self._array(block["lines"], "I", len(columns))
+                for row in range(len(columns)):
+                    yield columns.entry(row), (self.files[entry_files[row]], entry_lines[row])
+        yield from self._generic(keep)
+
+
+def read_snapshot(file_name: str, options: dict = None) -> (list, list, nastrandiff.columnar.ColumnarBulk):
+    """
+    Reads a snapshot, returning the executive control lines, the case control lines and the bulk data (see
+    Snapshot.bulk) in the same form as NastranDiff.read_deck. The file stays mapped while the columns of the bulk data
+    are in use.
+    """
+    with Snapshot(file_name) as snapshot:
+        return snapshot.lines("exec"), snapshot.lines("case"), snapshot.bulk(options)
+
+
+def read_located_snapshot(file_name: str, options: dict = None) -> (list, list, (dict, dict)):
+    """
+    Reads a snapshot in the same form as nastrandiff.structured.read_located_deck
+    """
+    bulk = {}
+    locations = {}
+    with Snapshot(file_name) as snapshot:
+        for card, location in snapshot.cards(options):
+            bulk[card.key] = card
+            locations[card.key] = location
+        return snapshot.lines("exec", True), snapshot.lines("case", True), (bulk, locations)
@@ -0,0 +1,281 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+import csv
+import difflib
+import functools
+import json
+import typing
+
+import nastrandiff
+import nastrandiff.casecontrol
+import nastrandiff.compare
+import nastrandiff.metrics
+import nastrandiff.prefetch
+import nastrandiff.snapshot
+
+FORMATS = ("jsonl", "csv")
+
+
+class _NumberedFile:
+    # Iterates over the lines of a file, keeping the number of the last line read
+    def __init__(self, f: typing.TextIO):
+        self.f = f
+        self.name = f.name
+        self.line_number = 0
+
+    def __iter__(self):
+        for line in self.f:
+            self.line_number += 1
+            yield line
+
+
+def read_located(f: _NumberedFile, break_at: str, skip: dict = None,
+                 includes: "nastrandiff.prefetch.IncludeReader" = None) -> (str, int, str):
+    """
+    The same as NastranDiff.read_file, but yields a (file name, line number, line) tuple for each line, giving where
+    the line is in the INCLUDE tree
+    """
+    includes = nastrandiff.prefetch.IncludeReader() if includes is None else includes
+    yield from includes.read(f, break_at, skip, located=True)
+
+
+def parse_located(lines: iter, options: dict = None) -> (dict, dict):
+    """
+    Parses located lines (from read_located) as NastranDiff.parse_bulk_fields does (skipping the card types filtered out
+    in options), returning the dict of Cards and a dict mapping the key of each Card to the (file name, line number)
+    where the entry starts
+    """
+    starts = collections.deque()
+    locations = {}
+    location = None
+
+    def located_lines():
+        nonlocal location
+        for file_name, line_number, line in lines:
+            location = (file_name, line_number)
+            yield line
+
+    def bulk_lines():
+        # the filter yields each line that it keeps before reading the next, so location is where the line is
+        for line in nastrandiff.NastranDiff._filter_bulk(located_lines(), options):
+            if nastrandiff.NastranDiff.is_card_start(line):
+                starts.append(location)
+            yield line
+
+    def entries():
+        # each entry is yielded after its lines have been read, so its start is the first one not yet used
+        for card in nastrandiff.NastranDiff.generate_bulk_cards(bulk_lines()):
+            locations[card.key] = starts.popleft()
+            yield card.key, card
+
+    return nastrandiff.NastranDiff.merge_bulk_entries({}, entries()), locations
+
+
+class RecordWriter:
+    """
+    Writes records describing the differences between two decks, one at a time. A record is a dict with:
+
+    - section: "exec", "case" or "bulk"
+    - kind: "changed", "added" or "deleted"
+    - card_type: The BDE name of the entry (bulk data only)
+    - key: A list of the fields making up the key of the entry, i.e. the ID and, for some card types (e.g. FORCE),
+      the other fields that distinguish entries with the same ID (bulk data only)
+    - file1, line1, file2, line2: Where the entry (or the first line of the change) is in each deck, following
+      INCLUDE statements, or None for the deck that doesn't have it
+    - fields: A list of {"field", "before", "after"} dicts. For bulk data, field is the field number (from 1, counting
+      across continuations) and only the fields that differ are included. For control sections, field is None and
+      before and after are the lines (without line endings) that were replaced
+    """
+    def __init__(self, output: typing.TextIO):
+        self.output = output
+        self.count = 0
+
+    def write(self, record: dict) -> None:
+        self.count += 1
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesWriter(RecordWriter):
+    """
+    Writes each record as a line of JSON
+    """
+    def write(self, record: dict) -> None:
+        super().write(record)
+        self.output.write(json.dumps(record) + "\n")
+
+
+class CsvWriter(RecordWriter):
+    """
+    Writes a row of CSV for each changed field of each record (or one row, if the record has no fields). The key is
+    written as its fields separated by spaces.
+    """
+    columns = ("section", "kind", "card_type", "key", "file1", "line1", "file2", "line2", "field", "before", "after")
+
+    def __init__(self, output: typing.TextIO):
+        super().__init__(output)
+        self.writer = csv.writer(output, lineterminator="\n")
+        self.writer.writerow(self.columns)
+
+    def write(self, record: dict) -> None:
+        super().write(record)
+        common = [record["section"], record["kind"], record.get("card_type"),
+                  None if record.get("key") is None else " ".join(str(k) for k in record["key"]),
+                  record["file1"], record["line1"], record["file2"], record["line2"]]
+        for field in record["fields"] or [dict(field=None, before=None, after=None)]:
+            before = field["before"]
+            after = field["after"]
+            if isinstance(before, list):
+                before = "\n".join(before)
+            if isinstance(after, list):
+                after = "\n".join(after)
+            self.writer.writerow(common + [field["field"], before, after])
+
+
+def make_writer(output_format: str, output: typing.TextIO) -> RecordWriter:
+    if output_format == "jsonl":
+        return JsonLinesWriter(output)
+    if output_format == "csv":
+        return CsvWriter(output)
+    raise ValueError("Unknown output format '{}'; expected one of {}".format(output_format, ", ".join(FORMATS)))
+
+
+def control_records(section: str, lines1: list, lines2: list) -> dict:
+    """
+    Yields a record for each block of lines that differs between two control sections, given as located lines
+    """
+    text1 = [line for _, _, line in lines1]
+    text2 = [line for _, _, line in lines2]
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, text1, text2, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        kind = "changed" if tag == "replace" else "deleted" if tag == "delete" else "added"
+        yield dict(section=section, kind=kind,
+                   file1=lines1[i1][0] if i1 < i2 else None, line1=lines1[i1][1] if i1 < i2 else None,
+                   file2=lines2[j1][0] if j1 < j2 else None, line2=lines2[j1][1] if j1 < j2 else None,
+                   fields=[dict(field=None, before=[line.rstrip("\r\n") for line in text1[i1:i2]],
+                                after=[line.rstrip("\r\n") for line in text2[j1:j2]])])
+
+
+def case_records(lines1: list, lines2: list) -> dict:
+    """
+    Yields a record for each block of lines that differs between two case control sections, given as located lines.
+    The sections are compared by subcase (see nastrandiff.casecontrol), so reordered subcases aren't differences.
+    """
+    blocks1 = nastrandiff.casecontrol.split_blocks([line for _, _, line in lines1])
+    blocks2 = nastrandiff.casecontrol.split_blocks([line for _, _, line in lines2])
+    for block1, block2 in nastrandiff.casecontrol.changed_blocks(blocks1, blocks2):
+        yield from control_records("case",
+                                   [] if block1 is None else lines1[block1.start:block1.start + len(block1.lines)],
+                                   [] if block2 is None else lines2[block2.start:block2.start + len(block2.lines)])
+
+
+def bulk_records(nd: "nastrandiff.NastranDiff", bulk1: dict, bulk2: dict, locations1: dict, locations2: dict) -> dict:
+    """
+    Yields a record for each bulk data entry that is changed, deleted (only in bulk1) or added (only in bulk2), in the
+    same order as in the HTML report within each kind. The entries are found in one pass over both decks (see
+    NastranDiff.join_bulk), so the kinds are interleaved.
+    """
+    def record(kind, card1, card2):
+        card = card1 if card1 is not None else card2
+        location1 = locations1[card.key] if card1 is not None else (None, None)
+        location2 = locations2[card.key] if card2 is not None else (None, None)
+        if kind == "changed":
+            fields = [dict(field=i, before=_field(card1.fields, i), after=_field(card2.fields, i))
+                      for i in nastrandiff.compare.changed_fields(card.name, card1.fields, card2.fields,
+                                                                  nd.tolerances)]
+        else:
+            fields = [dict(field=i + 1, before=f if kind == "deleted" else None, after=f if kind == "added" else None)
+                      for i, f in enumerate(card.fields) if f != ""]
+        return dict(section="bulk", kind=kind, card_type=card.name, key=list(card.key[1:]),
+                    file1=location1[0], line1=location1[1], file2=location2[0], line2=location2[1], fields=fields)
+
+    for card1, card2 in nd.join_bulk(bulk1, bulk2):
+        yield record("deleted" if card2 is None else "added" if card1 is None else "changed", card1, card2)
+
+
+def _field(fields: tuple, i: int):
+    return fields[i - 1] if i <= len(fields) else ""
+
+
+def read_located_deck(f: typing.TextIO, skip: dict = None, stage: "nastrandiff.metrics.StageMetrics" = None,
+                      options: dict = None) -> (list, list, (dict, dict)):
+    """
+    Reads a whole deck, returning the located executive and case control lines (from read_located) and the parsed
+    bulk data with the locations of the entries (from parse_located with options). The lines and entries are counted
+    in stage, if it is given. The included files are read ahead in the number of threads given by "include_threads" in
+    options (see nastrandiff.prefetch).
+    """
+    stage = nastrandiff.metrics.StageMetrics("read_deck", enabled=False) if stage is None else stage
+    threads = 0 if options is None else options.get("include_threads", 0)
+    with nastrandiff.prefetch.include_reader(getattr(f, "name", None), threads) as includes:
+        f = _NumberedFile(f)
+        exec_lines = list(_count_located(stage, read_located(f, "CEND", includes=includes)))
+        case_lines = list(_count_located(stage, read_located(f, "BEGIN BULK", includes=includes)))
+        bulk = parse_located(_count_located(stage, read_located(f, "ENDDATA", skip, includes)), options)
+    stage.count_cards(bulk[0])
+    return exec_lines, case_lines, bulk
+
+
+def _count_located(stage: "nastrandiff.metrics.StageMetrics", lines: iter) -> (str, int, str):
+    # Counts located lines in stage as they're consumed
+    if not stage.enabled:
+        yield from lines
+        return
+    for located in lines:
+        stage.lines += 1
+        stage.bytes += len(located[2])
+        yield located
+
+
+def write_diff(nd: "nastrandiff.NastranDiff", writer: RecordWriter, skips: (dict, dict) = (None, None)) -> None:
+    """
+    Writes the differences between nd.file1 and nd.file2 to writer, one record at a time (see write_deck_diff)
+    """
+    decks = []
+    for i, (f, skip) in enumerate(zip((nd.file1, nd.file2), skips)):
+        if nd.progress:
+            print("Reading file {}...".format(i + 1))
+        with nd._stage("read_deck{}".format(i + 1)) as stage:
+            if nastrandiff.snapshot.is_snapshot(getattr(f, "name", None)):
+                decks.append(nastrandiff.snapshot.read_located_snapshot(f.name, nd.parse_options()))
+                stage.count_cards(decks[-1][2][0])
+            else:
+                decks.append(read_located_deck(f, skip, stage, nd.parse_options()))
+    write_deck_diff(nd, writer, decks[0], decks[1])
+
+
+def write_deck_diff(nd: "nastrandiff.NastranDiff", writer: RecordWriter, deck1: tuple, deck2: tuple) -> None:
+    """
+    Writes the differences between two decks read by read_located_deck to writer, one record at a time. The control
+    sections are compared first, then the bulk data. The writer is closed.
+    """
+    for i, section in enumerate(("exec", "case")):
+        with nd._stage(section + "_diff") as stage:
+            stage.lines = len(deck1[i]) + len(deck2[i])
+            records = case_records if section == "case" else functools.partial(control_records, section)
+            for record in records(deck1[i], deck2[i]):
+                writer.write(record)
+    if nd.progress:
+        print("Comparing bulk data...")
+    with nd._stage("compare") as stage:
+        for record in bulk_records(nd, deck1[2][0], deck2[2][0], deck1[2][1], deck2[2][1]):
+            writer.write(record)
+        stage.info["records"] = writer.count
+    writer.close()
@@ -0,0 +1,175 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import random
+
+import nastrandiff
+
+# The fraction of the bulk data entries of each card type
+_card_mix = (("GRID", 0.5), ("CQUAD4", 0.35), ("CHEXA", 0.15))
+
+_formats = ("small", "large", "free")
+
+
+def _fixed_line(name: str, fields: list, width: int, continuation: str = "") -> str:
+    # name is padded to 8 characters, and the fields to width characters; continuation goes in columns 73-80
+    line = "{:<8}".format(name) + "".join(_format_field(f, width) for f in fields)
+    if continuation:
+        line = "{:<72}".format(line) + continuation
+    return line.rstrip() + "\n"
+
+
+def _format_field(f, width: int) -> str:
+    if type(f) is float:
+        return nastrandiff.NastranDiff.format_float_nastran(f, width)
+    return "{:<{width}}".format(f, width=width)
+
+
+def format_card(name: str, fields: list, fmt: str) -> str:
+    """
+    Formats a bulk data entry in small field ("small"), large field ("large") or free field ("free") format, with as
+    many continuation lines as needed
+    """
+    if fmt == "free":
+        per_line = 8
+        lines = [",".join([name if i == 0 else "+"] +
+                          [nastrandiff.NastranDiff.format_float_nastran(f, 16).strip() if type(f) is float else str(f)
+                           for f in fields[i:i + per_line]])
+                 for i in range(0, len(fields), per_line)]
+        return "\n".join(lines) + "\n"
+    per_line = 8 if fmt == "small" else 4
+    width = 8 if fmt == "small" else 16
+    chunks = [fields[i:i + per_line] for i in range(0, len(fields), per_line)]
+    text = ""
+    for i, chunk in enumerate(chunks):
+        marker = "*" if fmt == "large" else "+"
+        line_name = (name + "*" if fmt == "large" else name) if i == 0 else "{}C{}".format(marker, i)
+        continuation = "{}C{}".format(marker, i + 1) if i + 1 < len(chunks) else ""
+        text += _fixed_line(line_name, chunk, width, continuation)
+    return text
+
+
+class SyntheticDecks:
+    """
+    Generates a pair of realistic decks for benchmarking. The decks have the same GRID, CQUAD4 and CHEXA entries, in a
+    mix of small field, large field and free field formats, spread over a tree of INCLUDEd files. A fraction of the
+    entries (changed_fraction) have a different field in the second deck. The decks only depend on the arguments, so
+    the same seed always gives the same decks.
+
+    Members:
+
+    - n_cards: The number of bulk data entries in each deck
+    - seed: The seed of the random number generator
+    - changed_fraction: The fraction of the entries that are different in the second deck
+    - depth: The depth of the tree of included files (0 puts all of the entries in the root file)
+    - fanout: The number of files included by each file that isn't a leaf of the tree
+    - n_changed: The number of entries that are different in the files that were written (set by write)
+    """
+    def __init__(self, n_cards: int, seed: int = 0, changed_fraction: float = 0.01, depth: int = 2,
+                 fanout: int = 3):
+        self.n_cards = n_cards
+        self.seed = seed
+        self.changed_fraction = changed_fraction
+        self.depth = depth
+        self.fanout = fanout
+        self.n_changed = 0
+
+    def cards(self) -> (str, list, list, str):
+        """
+        Yields (BDE name, fields in deck 1, fields in deck 2, format) for each bulk data entry
+        """
+        rnd = random.Random(self.seed)
+        n_grids = max(8, int(self.n_cards * _card_mix[0][1]))
+        counts = [n_grids] + [int(self.n_cards * fraction) for _, fraction in _card_mix[1:]]
+        counts[-1] = max(0, self.n_cards - sum(counts[:-1]))
+        for (name, _), count in zip(_card_mix, counts):
+            for i in range(count):
+                eid = i + 1
+                if name == "GRID":
+                    fields = [eid, "", rnd.uniform(-1000., 1000.), rnd.uniform(-1000., 1000.),
+                              rnd.uniform(-1000., 1000.)]
+                else:
+                    n_nodes = 4 if name == "CQUAD4" else 8
+                    fields = [eid, rnd.randint(1, 20)] + [rnd.randint(1, n_grids) for _ in range(n_nodes)]
+                changed = list(fields)
+                if rnd.random() < self.changed_fraction:
+                    if name == "GRID":
+                        # large enough to be seen when the real is formatted in 8 characters
+                        k = 2 + rnd.randrange(3)
+                        changed[k] = changed[k] * 1.25 + 1.
+                    else:
+                        changed[1] += 1
+                fmt = _formats[rnd.randrange(len(_formats))]
+                yield name, fields, changed, fmt
+
+    def _file_names(self) -> list:
+        # Returns the tree of included files as a list of (file name, names of the files it includes)
+        files = []
+        level = ["mesh.bdf"] if self.depth > 0 else []
+        for d in range(self.depth):
+            next_level = []
+            for name in level:
+                children = [] if d == self.depth - 1 else \
+                    ["{}_{}.bdf".format(name[:-4], k) for k in range(self.fanout)]
+                files.append((name, children))
+                next_level += children
+            level = next_level
+        return files
+
+    def write(self, directory1: str, directory2: str) -> (str, str):
+        """
+        Writes the decks to two directories, returning the paths of the two root files
+        """
+        files = self._file_names()
+        leaves = [name for name, children in files if len(children) == 0]
+        roots = []
+        for d in (directory1, directory2):
+            os.makedirs(d, exist_ok=True)
+            for name, children in files:
+                if len(children) > 0:
+                    with open(os.path.join(d, name), "w") as f:
+                        f.write("".join("INCLUDE '{}'\n".format(c) for c in children))
+            roots.append(open(os.path.join(d, "deck.bdf"), "w"))
+            roots[-1].write("SOL 101\nCEND\nTITLE = SYNTHETIC DECK\nSUBCASE 1\n    SPC = 1\n    LOAD = 1\n"
+                            "BEGIN BULK\nPARAM   POST    0\n")
+            if leaves:
+                roots[-1].write("INCLUDE 'mesh.bdf'\n")
+
+        # the entries are split evenly between the leaves of the tree, or written to the root file if there are none
+        outputs = [[open(os.path.join(d, name), "w") for d in (directory1, directory2)] for name in leaves] or [roots]
+        self.n_changed = 0
+        try:
+            per_file = max(1, -(-self.n_cards // len(outputs)))
+            for i, (name, fields1, fields2, fmt) in enumerate(self.cards()):
+                f1, f2 = outputs[i // per_file]
+                if i % 100 == 0:
+                    f1.write("$ entries from {}\n".format(i))
+                    f2.write("$ entries from {}\n".format(i))
+                text1 = format_card(name, fields1, fmt)
+                text2 = format_card(name, fields2, fmt) if fields2 != fields1 else text1
+                f1.write(text1)
+                f2.write(text2)
+                self.n_changed += text1 != text2
+            for f in roots:
+                f.write("ENDDATA\n")
+        finally:
+            for f1, f2 in outputs:
+                f1.close()
+                f2.close()
+            for f in roots:
+                f.close()
+        return roots[0].name, roots[1].name
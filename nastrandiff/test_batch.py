@@ -0,0 +1,106 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import contextlib
+import csv
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from nastrandiff import NastranDiff
+from nastrandiff.batch import BatchDiff, expand_candidates, report_names
+from nastrandiff.synthetic import SyntheticDecks
+
+
+class TestBatch(unittest.TestCase):
+    def test_names(self):
+        with tempfile.TemporaryDirectory() as d:
+            for name in ("b.bdf", "a.bdf", "c.dat"):
+                open(os.path.join(d, name), "w").close()
+            pattern = os.path.join(d, "*.bdf")
+            self.assertEqual(expand_candidates([os.path.join(d, "c.dat"), pattern, os.path.join(d, "a.bdf")]),
+                             [os.path.join(d, n) for n in ("c.dat", "a.bdf", "b.bdf")])
+        self.assertEqual(report_names(["x/a.bdf", "x/b.bdf"]), ["a.html", "b.html"])
+        self.assertEqual(report_names(["x/1/deck.bdf", "x/2/deck.bdf", "x/2/deck.dat", "summary.bdf"]),
+                         ["x_1_deck.html", "x_2_deck.html", "x_2_deck-2.html", "summary-2.html"])
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as d:
+            generator = SyntheticDecks(300, seed=1, changed_fraction=0.1, depth=1, fanout=2)
+            baseline, candidate = generator.write(os.path.join(d, "base"), os.path.join(d, "cand0"))
+            shutil.copytree(os.path.join(d, "base"), os.path.join(d, "cand1"))
+            shutil.copytree(os.path.join(d, "cand0"), os.path.join(d, "cand2"))
+            candidates = [os.path.join(d, "cand{}".format(i), "deck.bdf") for i in range(3)]
+            n_changed = [generator.n_changed, 0, generator.n_changed]
+            self.assertGreater(generator.n_changed, 0)
+            candidates.append(os.path.join(d, "missing.bdf"))
+
+            for jobs in (1, 2):
+                nd = NastranDiff()
+                nd.jobs = jobs
+                out = os.path.join(d, "out{}".format(jobs))
+                with contextlib.redirect_stdout(io.StringIO()) as messages:
+                    results = BatchDiff(nd, baseline, candidates, out).run()
+                self.assertIn("missing.bdf", messages.getvalue())
+                self.assertEqual([sum(sum(c) for c in r.cards.values()) for r in results[:3]], n_changed)
+                self.assertIsNotNone(results[3].error)
+                self.assertEqual(sorted(os.listdir(out)), ["cand0_deck.html", "cand1_deck.html", "cand2_deck.html",
+                                                           "summary.csv", "summary.html"])
+
+                # the report is the same as diffing the candidate on its own
+                single = NastranDiff()
+                single.output = io.StringIO()
+                with open(baseline) as single.file1, open(candidates[0]) as single.file2:
+                    single.calculate_diff()
+                with open(os.path.join(out, "cand0_deck.html")) as f:
+                    report = f.read()
+                self.assertEqual(report.count("diff_chg"), single.output.getvalue().count("diff_chg"))
+
+                with open(os.path.join(out, "summary.csv")) as f:
+                    rows = list(csv.DictReader(f))
+                self.assertEqual([int(r["bulk"]) for r in rows[:3]], n_changed)
+                self.assertEqual(rows[0]["report"], "cand0_deck.html")
+                self.assertTrue(rows[3]["error"])
+
+    def test_error(self):
+        # an unexpected error diffing one candidate is recorded, and the others are still diffed
+        with tempfile.TemporaryDirectory() as d:
+            generator = SyntheticDecks(100, seed=2, changed_fraction=0.1)
+            baseline, candidate = generator.write(os.path.join(d, "base"), os.path.join(d, "cand"))
+            write_report = NastranDiff.write_report
+
+            def fail_first(nd, *args, **kwargs):
+                if not fail_first.failed:
+                    fail_first.failed = True
+                    raise RuntimeError("failed")
+                write_report(nd, *args, **kwargs)
+            fail_first.failed = False
+
+            out = os.path.join(d, "out")
+            with mock.patch.object(NastranDiff, "write_report", fail_first), \
+                    contextlib.redirect_stdout(io.StringIO()) as messages:
+                results = BatchDiff(NastranDiff(), baseline, [candidate, candidate], out).run()
+            self.assertEqual(results[0].error, "{}: RuntimeError: failed".format(candidate))
+            self.assertIn("RuntimeError: failed", messages.getvalue())
+            self.assertIsNone(results[0].report)
+            self.assertIsNone(results[1].error)
+            self.assertEqual(sorted(os.listdir(out)), ["deck-2.html", "summary.csv", "summary.html"])
+
+
+if __name__ == '__main__':
+    unittest.main()
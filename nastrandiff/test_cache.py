@@ -0,0 +1,83 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import difflib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.cache import DeckCache
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "test-data")
+
+
+class TestDeckCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = DeckCache(os.path.join(self.tmp, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_key_follows_includes(self):
+        for f in ("file2.dat", "file2a.dat"):
+            shutil.copy(os.path.join(TEST_DATA, f), self.tmp)
+        file2 = os.path.join(self.tmp, "file2.dat")
+
+        tree = NastranDiff.include_tree(file2)
+        self.assertEqual(os.path.basename(tree[0]), "file2.dat")
+        self.assertEqual([os.path.basename(n[0]) for n in tree[2]], ["file2a.dat"])
+        key = self.cache.key(tree)
+
+        with open(os.path.join(self.tmp, "file2a.dat"), "a") as f:
+            f.write("FORCE    3       6       0       1300.  -1.      0.      0.\n")
+        self.assertNotEqual(self.cache.key(NastranDiff.include_tree(file2)), key)
+
+    def test_get_put_evict(self):
+        self.assertIsNone(self.cache.get("a"))
+        deck = (["SOL 101\n"], ["TITLE = A\n"], {"GRID       1": "GRID    1       "})
+        self.cache.put("a", deck)
+        self.assertEqual(self.cache.get("a"), deck)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.cache.max_size = self.cache.stats()["size"]
+        os.utime(os.path.join(self.cache.directory, "a" + DeckCache._suffix), (0, 0))  # make "a" the oldest
+        self.cache.put("b", deck)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), deck)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_calculate_diff_with_cache(self):
+        def diff():
+            nd = NastranDiff()
+            nd.cache = self.cache
+            nd.output = io.StringIO()
+            difflib.HtmlDiff._default_prefix = 0
+            with open(os.path.join(TEST_DATA, "file1.dat")) as nd.file1, \
+                    open(os.path.join(TEST_DATA, "file2.dat")) as nd.file2:
+                nd.calculate_diff()
+            return nd.output.getvalue()
+
+        cold = diff()
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        warm = diff()
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+        self.assertEqual(cold, warm)
+
+
+if __name__ == '__main__':
+    unittest.main()
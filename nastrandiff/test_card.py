@@ -0,0 +1,71 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import pickle
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.card import Card, natural_key, type_id, type_name
+
+BULK = ["GRID*                  2                             1.0            -2.0+",
+        "*                    3.0                             136",
+        "FORCE   10      5       0       1.0     1.0",
+        "FORCE,10,6,0,2.0,1.0"]
+
+
+class TestCard(unittest.TestCase):
+    def test_type_id(self):
+        self.assertEqual(type_id("GRID"), type_id("GRID"))
+        self.assertNotEqual(type_id("GRID"), type_id("CQUAD4"))
+        self.assertLess(type_id("CBAR"), type_id("CQUAD4"))
+        self.assertEqual(type_name(type_id("CQUAD4")), "CQUAD4")
+        self.assertEqual(type_name(type_id("CTRIAX6") + 0), "CTRIAX6")
+
+    def test_cards(self):
+        entries = list(NastranDiff.generate_bulk_fields(BULK))
+        cards = list(NastranDiff.generate_bulk_cards(BULK))
+        self.assertEqual(len(cards), 3)
+        for (key, bde_name, lines), card in zip(entries, cards):
+            self.assertEqual(card.name, bde_name)
+            self.assertEqual(card.lines(), lines)
+            self.assertEqual(card.key_string(), key)
+            self.assertEqual(card.format(), NastranDiff.format_entry(bde_name, lines))
+        self.assertEqual(cards[0].key, (type_id("GRID"), 2))
+        self.assertEqual(cards[0].layout, (4, 4))
+        self.assertIsNone(cards[1].layout)
+        self.assertEqual(cards[1].key, (type_id("FORCE"), 10, 5))
+        self.assertNotEqual(cards[1].key, cards[2].key)
+
+    def test_natural_key(self):
+        keys = [(type_id("GRID"), "A"), (type_id("GRID"), 10), (type_id("CBAR"), 2), (type_id("GRID"), 9.5)]
+        self.assertEqual(sorted(keys, key=natural_key), [keys[2], keys[3], keys[1], keys[0]])
+
+    def test_digest(self):
+        cards = list(NastranDiff.generate_bulk_cards(["GRID    1               1.0     2.0     3.0",
+                                                      "GRID,1,,1.,2.0,3.,,,",
+                                                      "GRID    1               1       2.0     3.0"]))
+        self.assertEqual(cards[0].digest, cards[1].digest)
+        self.assertNotEqual(cards[0].digest, cards[2].digest)  # 1 is an integer
+        self.assertEqual(Card.from_fields("GRID", (1,), cards[0].fields, None).digest, cards[0].digest)
+
+    def test_pickle(self):
+        card = list(NastranDiff.generate_bulk_cards(BULK))[0]
+        copy = pickle.loads(pickle.dumps(card))
+        self.assertEqual(copy, card)
+        self.assertEqual(copy.key, card.key)
+        self.assertEqual(copy.digest, card.digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
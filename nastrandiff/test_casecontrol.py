@@ -0,0 +1,119 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import difflib
+import unittest
+from unittest import mock
+from nastrandiff import casecontrol
+from nastrandiff.structured import case_records
+
+CASE1 = ["TITLE = A\n",
+         "SUBCASE 1\n",
+         "  LOAD = 1\n",
+         "SUBCASE 2\n",
+         "  LOAD = 2\n",
+         "SUBCASE 3\n",
+         "  LOAD = 3\n",
+         "OUTPUT(PLOT)\n",
+         "  SET 1 = ALL\n"]
+CASE2 = ["TITLE = A\n",
+         "SUBCASE 2\n",
+         "  LOAD = 2\n",
+         "SUBCASE = 1\n",
+         "  LOAD = 1\n",
+         "SUBCASE 3\n",
+         "  LOAD = 4\n",
+         "SUBC 4\n",
+         "  LOAD = 4\n"]
+
+
+class TestCaseControl(unittest.TestCase):
+    def test_split_blocks(self):
+        self.assertEqual(casecontrol.block_start("subcase 10"), ("SUBCASE", 10))
+        self.assertEqual(casecontrol.block_start("SUBCOM 5"), ("SUBCOM", 5))
+        self.assertEqual(casecontrol.block_start("OUTPUT ( XYPLOT )"), ("OUTPUT", "XYPLOT"))
+        self.assertIsNone(casecontrol.block_start("  LOAD = 1"))
+
+        blocks = casecontrol.split_blocks(CASE1)
+        self.assertEqual([b.key for b in blocks], [("", 0, 0), ("SUBCASE", 1, 0), ("SUBCASE", 2, 0),
+                                                   ("SUBCASE", 3, 0), ("OUTPUT", "PLOT", 0)])
+        self.assertEqual(blocks[3], casecontrol.Block(("SUBCASE", 3, 0), 5, ("SUBCASE 3\n", "  LOAD = 3\n")))
+        self.assertEqual(casecontrol.split_blocks(["SUBCASE 1\n", "SUBCASE 1\n"])[2].key, ("SUBCASE", 1, 1))
+        self.assertEqual(casecontrol.split_blocks([]), [casecontrol.Block(("", 0, 0), 0, ())])
+
+    def test_changed_blocks(self):
+        changed = list(casecontrol.changed_blocks(casecontrol.split_blocks(CASE1), casecontrol.split_blocks(CASE2)))
+        self.assertEqual([(b1 and b1.key, b2 and b2.key) for b1, b2 in changed],
+                         [(("SUBCASE", 1, 0), ("SUBCASE", 1, 0)),  # "SUBCASE = 1"
+                          (("SUBCASE", 3, 0), ("SUBCASE", 3, 0)),
+                          (None, ("SUBCASE", 4, 0)),
+                          (("OUTPUT", "PLOT", 0), None)])
+
+    def test_make_table(self):
+        df = difflib.HtmlDiff()
+        table = casecontrol.make_table(df, CASE1, CASE2, "a", "b", context=True)
+        self.assertIn("The subcases are in a different order", table)
+        self.assertIn("The same in both files: the lines before the first subcase; SUBCASE 2.", table)
+        self.assertIn("<h3>SUBCASE 3 (lines 6-7 of a, lines 6-7 of b)</h3>", table)
+        self.assertIn("<h3>SUBCASE 4 (lines 8-9 of b)</h3>", table)
+        self.assertEqual(table.count('<table class="diff"'), 4)
+        self.assertIn("No differences", casecontrol.make_table(df, CASE1, CASE1, context=True))
+        self.assertIn("SUBCASE 1-3", casecontrol.make_table(df, CASE1, CASE1, context=True))
+
+        # without context, there is a single table with the blocks in order of their IDs, including those that are
+        # the same, which aren't diffed
+        table = casecontrol.make_table(df, CASE1, CASE2, "a", "b")
+        self.assertIn("The subcases are in a different order", table)
+        self.assertEqual(table.count('<table class="diff"'), 1)
+        self.assertEqual(table.count("<tbody>"), 6)
+        self.assertNotIn("The same in both files", table)
+        self.assertLess(table.index(">4</td><td nowrap=\"nowrap\">SUBCASE&nbsp;2</td>"),
+                        table.index(">6</td><td nowrap=\"nowrap\">SUBCASE&nbsp;3</td>"))
+        self.assertIn(">2</td><td nowrap=\"nowrap\">SUBCASE&nbsp;2</td></tr>", table)
+        self.assertIn('<span class="diff_chg">3</span>', table)
+        self.assertIn('<span class="diff_add">SUBC&nbsp;4</span>', table)
+        with mock.patch("difflib._mdiff", wraps=difflib._mdiff) as mdiff:
+            table = casecontrol.make_table(df, CASE1, CASE1)
+        mdiff.assert_not_called()
+        self.assertNotIn("No differences", table)
+        self.assertEqual(table.count('<table class="diff"'), 1)
+
+        # the rows are the same as those of df.make_table when the blocks are in the same order
+        lines1 = ["TITLE = A\n", "SUBCASE 1\n", "  LOAD = 1\n", "SUBCASE 2\n", "  LOAD = 2\n"]
+        lines2 = ["TITLE = A\n", "SUBCASE 1\n", "  LOAD = 1\n", "SUBCASE 2\n", "  LOAD = 3\n", "  SPC = 1\n"]
+        difflib.HtmlDiff._default_prefix = 0
+        expected = df.make_table(lines1, lines2, "a", "b", numlines=0)
+        difflib.HtmlDiff._default_prefix = 0
+        table = casecontrol.make_table(df, lines1, lines2, "a", "b", numlines=0)
+        self.assertEqual(table.replace("        </tbody>        \n        <tbody>\n", ""), expected)
+
+        # sections without subcases are compared in the same way as the executive control
+        lines = ["TITLE = A\n", "LOAD = 1\n"]
+        difflib.HtmlDiff._default_prefix = 0
+        expected = df.make_table(lines, lines[:1])
+        difflib.HtmlDiff._default_prefix = 0
+        self.assertEqual(casecontrol.make_table(df, lines, lines[:1]), expected)
+
+    def test_case_records(self):
+        lines1 = [("a.dat", i + 7, line) for i, line in enumerate(CASE1)]
+        lines2 = [("b.dat", i + 7, line) for i, line in enumerate(CASE2)]
+        records = list(case_records(lines1, lines2))
+        self.assertEqual([(r["kind"], r["line1"], r["line2"]) for r in records],
+                         [("changed", 8, 10), ("changed", 13, 13), ("added", None, 14), ("deleted", 14, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import io
+import os
+import tempfile
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.check import bulk_fingerprint, case_fingerprint, control_fingerprint, control_fingerprints, \
+    normalize_control_line
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "test-data")
+
+DECK = """SOL 101
+CEND
+SUBCASE 1
+    LOAD = 1 $ the load
+BEGIN BULK
+GRID    1               0.0     0.0     0.0
+GRID*   2                               1.0             0.0             *G2
+*G2     0.0
+CROD    1       1       1       2
+ENDDATA
+"""
+# the same deck, with the entries in a different order and format
+EQUIVALENT = """SOL 101
+CEND
+SUBCASE 1
+LOAD=1
+
+BEGIN BULK
+CROD,1,1,1,2,,,,
+GRID,2,,1.,0.,0.,,,
+GRID    1               0.      0.      0.
+ENDDATA
+"""
+
+
+class TestCheck(unittest.TestCase):
+    def check(self, deck1: str, deck2: str, fail_fast: bool = False, **kwargs):
+        nd = NastranDiff()
+        for k, v in kwargs.items():
+            setattr(nd, k, v)
+        nd.file1 = io.StringIO(deck1)
+        nd.file2 = io.StringIO(deck2)
+        return nd.check(fail_fast)
+
+    def test_normalize(self):
+        self.assertEqual(normalize_control_line("  LOAD = 1  $ comment\n"), "LOAD=1")
+        self.assertEqual(normalize_control_line("$ comment\n"), "")
+        self.assertEqual(control_fingerprint(["A\n", "B\n"]).count, 2)
+        self.assertNotEqual(control_fingerprint(["A\n", "B\n"]), control_fingerprint(["B\n", "A\n"]))
+
+    def test_control_fingerprints(self):
+        lines1 = ["A\n", "B\n", "C\n"]
+        lines2 = ["A\n", "X\n", "C\n"]
+        self.assertEqual(control_fingerprints(lines1, lines2), (control_fingerprint(lines1),
+                                                                control_fingerprint(lines2)))
+        lines2 = iter(lines2)
+        fingerprints = control_fingerprints(lines1, lines2, fail_fast=True)
+        self.assertNotEqual(*fingerprints)
+        self.assertEqual(fingerprints[1].count, 2)
+        self.assertEqual(list(lines2), ["C\n"])  # not read after the difference
+
+    def test_case_fingerprint(self):
+        lines = ["ECHO = NONE\n", "SUBCASE 1\n", "LOAD = 1\n", "SUBCASE 2\n", "LOAD = 2 $ comment\n"]
+        reordered = ["ECHO=NONE\n", "SUBCASE 2\n", "LOAD=2\n", "\n", "SUBCASE 1\n", "LOAD=1\n"]
+        self.assertEqual(case_fingerprint(lines), case_fingerprint(reordered))
+        self.assertEqual(case_fingerprint(lines).count, 5)
+        moved = ["ECHO = NONE\n", "SUBCASE 1\n", "SUBCASE 2\n", "LOAD = 1\n", "LOAD = 2\n"]
+        self.assertNotEqual(case_fingerprint(lines), case_fingerprint(moved))
+
+    def test_bulk_fingerprint(self):
+        lines = DECK.splitlines()[5:9]
+        self.assertEqual(bulk_fingerprint(lines), bulk_fingerprint(lines[3:] + lines[:3]))
+        self.assertEqual(bulk_fingerprint(lines).count, 3)
+        self.assertNotEqual(bulk_fingerprint(lines), bulk_fingerprint(lines + lines[:1]))  # duplicates count
+
+    def test_check(self):
+        result = self.check(DECK, EQUIVALENT)
+        self.assertTrue(result.equivalent, result.format())
+        self.assertEqual(list(result.sections), ["exec", "case", "bulk"])
+
+        different = DECK.replace("CROD    1       1       1       2", "CROD    1       1       1       3")
+        result = self.check(DECK, different)
+        self.assertFalse(result.equivalent)
+        self.assertEqual(result.different_sections(), ["bulk"])
+        self.assertTrue(self.check(DECK, different, exclude_cards={"CROD"}).equivalent)
+
+        different = DECK.replace("LOAD = 1", "LOAD = 2").replace("CROD    1       1       1       2", "")
+        result = self.check(DECK, different, fail_fast=True)
+        self.assertEqual(list(result.sections), ["exec", "case"])
+        self.assertEqual(result.different_sections(), ["case"])
+        self.assertIn("not checked: bulk", result.format())
+
+        # the same subcases in a different order
+        subcase_2_first = DECK.replace("SUBCASE 1\n    LOAD = 1 $ the load\n",
+                                       "SUBCASE 2\nLOAD = 2\nSUBCASE 1\n    LOAD = 1 $ the load\n")
+        subcase_2_last = DECK.replace("SUBCASE 1\n    LOAD = 1 $ the load\n",
+                                      "SUBCASE 1\n    LOAD = 1 $ the load\nSUBCASE 2\nLOAD = 2\n")
+        self.assertTrue(self.check(subcase_2_first, subcase_2_last).equivalent)
+
+    def test_check_files(self):
+        nd = NastranDiff()
+        with open(os.path.join(TEST_DATA, "file1.dat")) as nd.file1, \
+                open(os.path.join(TEST_DATA, "file2.dat")) as nd.file2:
+            self.assertEqual(nd.check().different_sections(), ["bulk"])
+        with tempfile.TemporaryDirectory() as d:
+            # the same deck in one file, with the included file copied in
+            with open(os.path.join(TEST_DATA, "file1.dat")) as f:
+                lines = list(NastranDiff.read_file(f, "NOT A BREAK"))
+            with open(os.path.join(d, "deck.dat"), "w") as f:
+                f.writelines(lines)
+            with open(os.path.join(TEST_DATA, "file1.dat")) as nd.file1, open(os.path.join(d, "deck.dat")) as nd.file2:
+                self.assertTrue(nd.check().equivalent)
+
+
+if __name__ == '__main__':
+    unittest.main()
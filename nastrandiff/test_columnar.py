@@ -0,0 +1,143 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import unittest
+from unittest import mock
+from nastrandiff import NastranDiff
+from nastrandiff.card import Card, type_id
+from nastrandiff.columnar import CardColumns, ColumnarBulk, DEFAULT_COLUMNAR_TYPES, comparable
+from nastrandiff.compare import Tolerances
+
+BULK1 = ["GRID    3               1.0     2.0     3.0",
+         "GRID*                  2                             1.0            -2.0+",
+         "*                    3.0                             136",
+         "GRID    1       5       1.0     2.0     3.0     ",
+         "CQUAD4  1       1       1       2       3       4",
+         "CROD    1       1       1       2",
+         "CROD    2       1       TWO     3",
+         "PROD    1       1       5.25"]
+BULK2 = ["GRID    1       5       1.0     2.0     3.0000001",
+         "GRID,2,,1.0,-2.0,3.0,,136",
+         "GRID    4               1.0     2.0     3.0",
+         "CQUAD4  1       1       1       2       3       4",
+         "CROD    2       1       2       3",
+         "PROD    1       1       5.5"]
+
+
+class TestColumnarBulk(unittest.TestCase):
+    def test_columns(self):
+        entries = list(NastranDiff.generate_bulk_cards(BULK1))
+        c = CardColumns("GRID")
+        for card in entries[:3]:
+            self.assertTrue(c.can_store(card))
+            c.append(card)
+        self.assertTrue(c.can_store(entries[5]))
+        self.assertFalse(c.can_store(Card("CROD", [["X", 1]])))
+
+        self.assertEqual(c.sort(), [])
+        self.assertEqual(list(c.ids), [1, 2, 3])
+        for row, i in ((0, 2), (1, 1), (2, 0)):
+            self.assertEqual(c.entry(row), entries[i])
+            self.assertEqual(c.entry(row).key, entries[i].key)
+            self.assertEqual(type(c.entry(row).fields[1]), type(entries[i].fields[1]))
+        self.assertTrue(c.same_row(0, c, 0))
+        self.assertFalse(c.same_row(0, c, 2))
+
+    def test_duplicates(self):
+        bulk = ColumnarBulk()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            bulk.merge(NastranDiff._generate_entries(BULK1 + ["GRID    3               9.0"], typed=True))
+            bulk.finalize()
+        self.assertIn("GRID       3", out.getvalue())
+        self.assertEqual(len(bulk), 7)
+        self.assertEqual(len(bulk.generic), 1)
+        self.assertEqual(bulk.columns["GRID"].entry(2), Card("GRID", [[3, "", 9.0, "", "", "", "", ""]]))
+        self.assertEqual(bulk.columns["CROD"].entry(1), Card("CROD", [[2, 1, "TWO", 3, "", "", "", ""]]))
+
+    def test_compare(self):
+        nd = NastranDiff()
+        for tolerances in (None, Tolerances(abs_tol=1e-3)):
+            nd.tolerances = tolerances
+            expected = nd.compare_parsed_bulk(nd.parse_bulk_fields(BULK1), nd.parse_bulk_fields(BULK2))
+            options = dict(columnar_types=DEFAULT_COLUMNAR_TYPES)
+            bulk1 = nd.parse_bulk_fields(BULK1, options=options)
+            bulk2 = nd.parse_bulk_fields(BULK2, options=options)
+            self.assertIsInstance(bulk1, ColumnarBulk)
+            self.assertEqual(nd.compare_parsed_bulk(bulk1, bulk2), expected)
+            self.assertEqual(nd.compare_parsed_bulk(bulk1, bulk1), ([], [], [], []))
+
+    def test_join_columns(self):
+        # the strings and layouts are in a different order in each, and some of the IDs are in only one
+        bulk_a = ["CROD    7       1       1", "+       8", "CROD    1       1       TWO     3",
+                  "CROD    2       1       ONE     3", "CROD    3       1       1",
+                  "CROD    4       1       1       2       5", "CROD    6       1       1"]
+        bulk_b = ["CROD    2       1       ONE     3", "CROD    1       1       ONE     3",
+                  "CROD    3       1       1       2", "+       7", "CROD    4       1       1       2       5",
+                  "CROD    5       1       1", "CROD    7       1       1", "+       8"]
+        nd = NastranDiff()
+        options = dict(columnar_types=DEFAULT_COLUMNAR_TYPES)
+        bulk1 = nd.parse_bulk_fields(bulk_a, options=options)
+        bulk2 = nd.parse_bulk_fields(bulk_b, options=options)
+        self.assertNotEqual(bulk1.columns["CROD"].strings, bulk2.columns["CROD"].strings)
+        self.assertNotEqual(bulk1.columns["CROD"].layouts, bulk2.columns["CROD"].layouts)
+        with mock.patch.object(CardColumns, "entry", autospec=True, side_effect=CardColumns.entry) as entry:
+            pairs = list(bulk1.join_columns(bulk2, nd.entries_equal))
+        self.assertEqual([(c1 and c1.fields[0], c2 and c2.fields[0]) for c1, c2 in pairs],
+                         [(1, 1), (3, 3), (None, 5), (6, None)])
+        self.assertEqual(entry.call_count, 6)  # only for the rows that differ
+        self.assertEqual(nd.compare_parsed_bulk(bulk1, bulk2),
+                         nd.compare_parsed_bulk(nd.parse_bulk_fields(bulk_a), nd.parse_bulk_fields(bulk_b)))
+        self.assertEqual(list(bulk2.join_columns(bulk2, nd.entries_equal)), [])
+
+    def test_card_types(self):
+        # the GRIDs are stored in generic when any of them can't be stored in columns without loss
+        grid = "{:<8}{:<16}{:<16}{:<16}".format("GRID*", 1, "", 9999999999999999)
+        options = dict(columnar_types=DEFAULT_COLUMNAR_TYPES)
+        nd = NastranDiff()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            bulk1 = nd.parse_bulk_fields(BULK1 + [grid], options=options)
+        self.assertIn("Multiple lines being saved as 'GRID       1'", out.getvalue())
+        self.assertNotIn("GRID", bulk1.columns)
+        self.assertNotIn("GRID", bulk1.columnar_types)
+        self.assertEqual(bulk1.generic_types, {"GRID"})
+        self.assertEqual(len(bulk1), 7)
+        self.assertEqual(sorted(card.fields[0] for card in bulk1.generic.values() if card.name == "GRID"), [1, 2, 3])
+
+        # and in the bulk data that it's compared with, so that the GRID is changed rather than deleted and added
+        bulk2 = nd.parse_bulk_fields(BULK1, options=options)
+        self.assertIn("GRID", bulk2.columns)
+        expected = nd.compare_parsed_bulk(nd.parse_bulk_fields(BULK1 + [grid]), nd.parse_bulk_fields(BULK1))
+        self.assertEqual(expected[0], [nd.parse_bulk_fields([grid])[(type_id("GRID"), 1)].format()])
+        self.assertEqual(nd.compare_parsed_bulk(bulk1, bulk2), expected)
+        self.assertEqual(nd.compare_parsed_bulk(nd.parse_bulk_fields(BULK1), bulk1),
+                         tuple(expected[i] for i in (1, 0, 3, 2)))
+        comparable1, comparable2 = comparable(bulk2, bulk1)
+        self.assertEqual(comparable1.columnar_types, comparable2.columnar_types)
+        self.assertNotIn("GRID", comparable1.columns)
+        self.assertIn("GRID", bulk2.columns)  # bulk2 isn't changed
+
+        # the GRIDs found to be stored in generic when a dict is converted
+        bulk3 = nd.parse_bulk_fields(BULK1, options=dict(columnar_types=frozenset(["CROD"])))
+        comparable1, comparable2 = comparable(nd.parse_bulk_fields(BULK1 + [grid]), bulk3)
+        self.assertEqual(comparable1.columnar_types, comparable2.columnar_types)
+        self.assertEqual(comparable(bulk2, bulk3)[1].columnar_types, DEFAULT_COLUMNAR_TYPES)
+
+
+if __name__ == '__main__':
+    unittest.main()
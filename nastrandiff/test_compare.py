@@ -0,0 +1,96 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.compare import Tolerances, changed_fields
+
+
+class TestTolerances(unittest.TestCase):
+    def test_fields_equal(self):
+        t = Tolerances(abs_tol=1e-9)
+        self.assertTrue(t.fields_equal("GRID", [1, "", 1.0, 2.0], [1, "", 1.0 + 1e-12, 2.0, ""]))
+        self.assertFalse(t.fields_equal("GRID", [1, "", 1.0], [2, "", 1.0]))
+        self.assertFalse(t.fields_equal("GRID", [1, "", 1.0], [1, "", 1.1]))
+        self.assertFalse(t.fields_equal("GRID", [1, "", 1.0], [1, "", ""]))
+        self.assertFalse(t.fields_equal("GRID", [1, "A"], [1, "B"]))
+
+        t.parse_tolerance("GRID:3=0.2")
+        self.assertTrue(t.fields_equal("GRID", [1, "", 1.0], [1, "", 1.1]))
+        self.assertFalse(t.fields_equal("GRID", [1, "", 1.0, 1.0], [1, "", 1.0, 1.1]))
+        # a change between an integer and a real is a difference, however close the values are
+        self.assertFalse(t.fields_equal("GRID", [1, "", 1.0], [1, "", 1]))
+        self.assertFalse(t.fields_equal("GRID", [1, "", 1], [1, "", 1.0]))
+        self.assertFalse(t.field_equal("GRID", 3, 1, 1.0))
+        self.assertTrue(t.field_equal("GRID", 3, 1.0, 1.1))
+        self.assertEqual(changed_fields("GRID", (1, "", 1, 2.0), (1, "", 1.0, 2.0), t), [3])
+
+        t.parse_tolerance("MAT1=0,1e-3")
+        self.assertEqual(t.tolerance("MAT1", 2), (0., 1e-3))
+        self.assertTrue(t.fields_equal("MAT1", [1, 1.76e6], [1, 1.7605e6]))
+        self.assertFalse(t.fields_equal("MAT1", [1, 1.76e6], [1, 1.77e6]))
+
+        with self.assertRaises(ValueError):
+            t.parse_tolerance("GRID:x=1")
+
+    def test_compare_parsed_bulk(self):
+        nd = NastranDiff()
+        bulk1 = nd.parse_bulk_fields(["GRID    1               1.0     2.0     3.0",
+                                      "GRID    2               1.0     2.0     3.0",
+                                      "MAT1    1       1.76+6"])
+        bulk2 = nd.parse_bulk_fields(["GRID,1,,1.0000000001,2.0,3.0",
+                                      "GRID    2               1.1     2.0     3.0",
+                                      "MAT1    1       1760000."])
+
+        diff1, diff2, unique1, unique2 = nd.compare_parsed_bulk(bulk1, bulk2)
+        self.assertEqual(len(diff1), 2)  # the free-field GRID 1 has fewer (blank) fields
+
+        nd.tolerances = Tolerances(abs_tol=1e-6)
+        diff1, diff2, unique1, unique2 = nd.compare_parsed_bulk(bulk1, bulk2)
+        self.assertEqual(diff1, [nd.format_bde("GRID", [2, "", 1.0, 2.0, 3.0, "", "", ""])])
+        self.assertEqual(len(diff2), 1)
+        self.assertEqual(unique1 + unique2, [])
+
+    def test_join_bulk(self):
+        nd = NastranDiff()
+        bulk1 = nd.parse_bulk_fields(["GRID,123456789,,1.0",
+                                      "GRID    99              1.0",
+                                      "GRID    -5              1.0",
+                                      "CROD    10      1       1       2",
+                                      "CROD    9       1       1       2",
+                                      "PROD    A       1       5.25"])
+        bulk2 = nd.parse_bulk_fields(["GRID    99              1.0",
+                                      "GRID,123456789,,2.0",
+                                      "CROD    10      1       1       3",
+                                      "CROD    9       1       1       2",
+                                      "PROD    1       1       5.25",
+                                      "PROD    A       1       5.5"])
+        self.assertEqual([c.fields[0] for c in nd.sorted_cards(bulk1)], [9, 10, -5, 99, 123456789, "A"])
+
+        joined = [(c1 is not None and c1.key_string(), c2 is not None and c2.key_string())
+                  for c1, c2 in nd.join_bulk(bulk1, bulk2)]
+        self.assertEqual(joined, [("CROD      10", "CROD      10"),
+                                  ("GRID      -5", False),
+                                  ("GRID123456789", "GRID123456789"),
+                                  (False, "PROD       1"),
+                                  ("PRODA       ", "PRODA       ")])
+
+        diff1, diff2, unique1, unique2 = nd.compare_parsed_bulk(bulk1, bulk2)
+        self.assertEqual([d[:16] for d in diff1], ["CROD    10      ", "GRID    12345678", "PROD    A       "])
+        self.assertEqual(len(unique1 + unique2), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.compressed import is_compressed, open_deck
+from nastrandiff.synthetic import SyntheticDecks
+
+
+class TestCompressed(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_open_deck(self):
+        text = "GRID    1\r\nGRID    2\n" * 1000
+        for suffix, opener in (("", open), (".gz", gzip.open), (".bz2", bz2.open), (".xz", lzma.open)):
+            path = os.path.join(self.directory.name, "deck.bdf" + suffix)
+            with opener(path, "wb") as f:
+                f.write(text.encode())
+            self.assertEqual(is_compressed(path), suffix != "")
+            with open_deck(path) as f:
+                self.assertEqual(f.name, path)
+                self.assertEqual(list(f), ["GRID    1\n", "GRID    2\n"] * 1000)
+
+        # errors in the compressed data are raised by the reader
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) // 2)
+        with self.assertRaises(EOFError), open_deck(path) as f:
+            f.read()
+
+        # closing a file that hasn't been read to the end stops the thread decompressing it
+        threads = threading.active_count()
+        with gzip.open(path, "wb") as f:
+            f.write(os.urandom(1024 ** 2).hex().encode())
+        f = open_deck(path)
+        f.readline()
+        f.close()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_compressed_deck(self):
+        plain = SyntheticDecks(300, seed=4, depth=2, fanout=2).write(os.path.join(self.directory.name, "a"),
+                                                                    os.path.join(self.directory.name, "b"))[0]
+        # a copy of the deck with every file compressed in place, as gzip -r does (with a mix of formats)
+        directory = os.path.join(self.directory.name, "c")
+        shutil.copytree(os.path.dirname(plain), directory)
+        openers = ((".gz", gzip.open), (".bz2", bz2.open), (".xz", lzma.open))
+        for i, name in enumerate(sorted(os.listdir(directory))):
+            suffix, opener = openers[i % len(openers)]
+            with open(os.path.join(directory, name), "rb") as f, opener(os.path.join(directory, name + suffix),
+                                                                        "wb") as out:
+                shutil.copyfileobj(f, out)
+            os.remove(os.path.join(directory, name))
+        compressed = [os.path.join(directory, n) for n in os.listdir(directory) if n.startswith("deck.bdf")][0]
+
+        self.assertEqual(NastranDiff.include_tree(compressed)[1], NastranDiff.include_tree(plain)[1])
+        with open(plain) as f:
+            expected = NastranDiff.read_deck(f)
+        for threads in (0, 4):
+            with open_deck(compressed) as f:
+                self.assertEqual(NastranDiff.read_deck(f, options=dict(include_threads=threads)), expected)
+        self.assertEqual(NastranDiff.read_mapped_deck(compressed), expected)
+
+        nd = NastranDiff()
+        with open(plain) as nd.file1, open_deck(compressed) as nd.file2:
+            self.assertTrue(nd.check().equivalent)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import contextlib
+import difflib
+import io
+import os
+import tempfile
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.external import ExternalSort, SpillFile
+from nastrandiff.synthetic import SyntheticDecks
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "test-data")
+
+BULK1 = ["GRID    3               1.0     2.0     3.0",
+         "GRID    1       5       1.0     2.0     3.0",
+         "FORCE   3       6       0       1300.   -1.     0.      0.",
+         "FORCE   3       7       0       1300.   -1.     0.      0.",
+         "GRID    2               1.0     2.0     3.0",
+         "GRID    3               1.0     2.0     4.0",
+         "PROD    1       1       5.25"]
+BULK2 = ["PROD    1       1       5.5",
+         "GRID    4               1.0     2.0     3.0",
+         "FORCE   3       7       0       1300.   -1.     0.      0.",
+         "GRID    3               1.0     2.0     4.0",
+         "GRID    1       5       1.0     2.0     3.0"]
+
+
+def diff_files(file1: str, file2: str, **kwargs) -> str:
+    nd = NastranDiff()
+    for k, v in kwargs.items():
+        setattr(nd, k, v)
+    nd.output = io.StringIO()
+    difflib.HtmlDiff._default_prefix = 0
+    with open(file1) as nd.file1, open(file2) as nd.file2:
+        nd.calculate_diff()
+    return nd.output.getvalue()
+
+
+class TestExternal(unittest.TestCase):
+    def test_spill_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            spill = SpillFile(os.path.join(d, "a"), 1000, size=len)
+            for i in range(100):
+                spill.append("x" * i)
+            with self.assertRaises(ValueError):
+                list(spill)
+            spill.close()
+            self.assertEqual(len(spill), 100)
+            self.assertEqual(list(spill), ["x" * i for i in range(100)])
+            self.assertEqual(list(spill), list(spill))
+
+    def test_sort(self):
+        with tempfile.TemporaryDirectory() as d:
+            sort = ExternalSort(d, 1000).extend(NastranDiff.generate_bulk_cards(BULK1))
+            self.assertGreater(len(sort.runs), 1)
+            messages = io.StringIO()
+            with contextlib.redirect_stdout(messages):
+                cards = list(sort.sorted())
+            self.assertEqual([c.key for c in cards], sorted(c.key for c in cards))
+            self.assertEqual(len(cards), 6)  # the second GRID 3 replaces the first
+            self.assertEqual(cards[-2].fields[:5], (3, "", 1.0, 2.0, 4.0))
+            self.assertIn("GRID       3", messages.getvalue())
+            sort.remove()
+            self.assertEqual(os.listdir(d), [])
+
+    def test_compare_bulk_external(self):
+        nd = NastranDiff()
+        expected = nd.compare_bulk(BULK1, BULK2)
+        for memory_limit in (1, 1000, 10 ** 6):
+            nd.memory_limit = memory_limit
+            with tempfile.TemporaryDirectory() as d, contextlib.redirect_stdout(io.StringIO()):
+                results = nd.compare_bulk_external(BULK1, BULK2, d)
+                self.assertEqual([list(r) for r in results], [list(r) for r in expected])
+                self.assertEqual([len(r) for r in results], [1, 1, 2, 1])
+                self.assertEqual(len(os.listdir(d)), 4)  # the runs have been removed
+
+    def test_external_differences(self):
+        nd = NastranDiff()
+        nd.memory_limit = 1
+        expected = list(nd.bulk_differences(*nd._parse_bulks(BULK1, BULK2)))
+        with tempfile.TemporaryDirectory() as d, contextlib.redirect_stdout(io.StringIO()):
+            differences = nd.external_differences(*nd.sort_bulk_external(BULK1, BULK2, d))
+            self.assertEqual(list(differences), expected)
+            self.assertEqual(os.listdir(d), [])  # the runs have been removed
+
+    def test_calculate_diff(self):
+        file1 = os.path.join(TEST_DATA, "file1.dat")
+        file2 = os.path.join(TEST_DATA, "file2.dat")
+        self.assertEqual(diff_files(file1, file2),
+                         diff_files(file1, file2, memory_limit=2000))
+
+        with tempfile.TemporaryDirectory() as d:
+            generator = SyntheticDecks(2000, seed=5, changed_fraction=0.05)
+            decks = generator.write(os.path.join(d, "1"), os.path.join(d, "2"))
+            spill_dir = os.path.join(d, "spill")
+            os.mkdir(spill_dir)
+            self.assertEqual(diff_files(*decks),
+                             diff_files(*decks, memory_limit=50000, spill_dir=spill_dir))
+            self.assertEqual(os.listdir(spill_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
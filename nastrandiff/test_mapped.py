@@ -0,0 +1,78 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.mapped import MappedDeck, _range_lines, split_lines
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "test-data")
+
+
+class TestMappedDeck(unittest.TestCase):
+    @staticmethod
+    def read_sections(file_name: str) -> dict:
+        with open(file_name) as f:
+            return {"exec": list(NastranDiff.read_file(f, "CEND")),
+                    "case": list(NastranDiff.read_file(f, "BEGIN BULK")),
+                    "bulk": list(NastranDiff.read_file(f, "ENDDATA"))}
+
+    def test_sections_match_read_file(self):
+        for name in ("file1.dat", "file2.dat", "file2a.dat"):
+            file_name = os.path.join(TEST_DATA, name)
+            expected = self.read_sections(file_name)
+            with MappedDeck(file_name) as deck:
+                for section in ("exec", "case", "bulk"):
+                    self.assertEqual(list(deck.lines(section)), expected[section])
+                views = deck.views("bulk")
+                self.assertEqual(b"".join(bytes(v) for v in views).decode(), "".join(expected["bulk"]))
+                for v in views:
+                    v.release()
+
+        with tempfile.TemporaryDirectory() as d:
+            file_name = os.path.join(d, "crlf.dat")
+            with open(file_name, "wb") as f:
+                f.write(b"SOL 101\r\nCEND\r\nBEGIN BULK\r\nGRID     1\r\nENDDATA")
+            with MappedDeck(file_name) as deck:
+                self.assertEqual(list(deck.lines("exec")), ["SOL 101\n"])
+                self.assertEqual(list(deck.lines("case")), [])
+                self.assertEqual(list(deck.lines("bulk")), ["GRID     1\n"])
+
+    def test_range_lines(self):
+        # the lines are the same whatever the size of the chunks that are decoded
+        data = "GRID     1\r\n$ \u00e9t\u00e9\r\n\nCROD     2\rPROD     3".encode() * 5
+        expected = split_lines(data.decode())
+        for chunk_size in (1, 7, 16, 1 << 22):
+            self.assertEqual(list(_range_lines(data, 0, len(data), chunk_size)), expected)
+        self.assertEqual(list(_range_lines(data, 0, 12, 4)), ["GRID     1\n"])
+
+    def test_split(self):
+        file_name = os.path.join(TEST_DATA, "file2.dat")
+        expected = self.read_sections(file_name)["bulk"]
+        with MappedDeck(file_name) as deck:
+            for n in (1, 3, 8, 100):
+                chunks = deck.split("bulk", n)
+                lines = [list(MappedDeck.read_ranges(c)) for c in chunks]
+                self.assertEqual(sum(lines, []), expected)
+                for l in lines[1:]:
+                    self.assertTrue(NastranDiff.is_card_start(l[0]))
+
+            self.assertEqual(NastranDiff.parse_bulk_ranges(deck.split("bulk", 4), 2),
+                             NastranDiff.parse_bulk_data(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.cache import DeckCache
+from nastrandiff.metrics import Metrics, StageMetrics, current_rss
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "test-data")
+
+
+class TestMetrics(unittest.TestCase):
+    def diff(self, **kwargs) -> list:
+        nd = NastranDiff()
+        for k, v in kwargs.items():
+            setattr(nd, k, v)
+        stages = []
+        nd.add_hook(stages.append)
+        nd.output = io.StringIO()
+        with open(os.path.join(TEST_DATA, "file1.dat")) as nd.file1, \
+                open(os.path.join(TEST_DATA, "file2.dat")) as nd.file2:
+            nd.calculate_diff()
+        self.assertEqual(stages, nd.metrics.stages)
+        self.assertGreater(nd.metrics.wall_time, 0.)
+        return stages
+
+    def test_stages(self):
+        stages = {s.name: s for s in self.diff()}
+        # the bulk data is compared as the report is written, but timed as a stage of its own
+        self.assertEqual(list(stages), ["exec_diff", "case_diff", "parse_bulk1", "parse_bulk2", "compare", "render"])
+        with open(os.path.join(TEST_DATA, "file1.dat")) as f:
+            exec_lines = list(NastranDiff.read_file(f, "CEND"))
+            list(NastranDiff.read_file(f, "BEGIN BULK"))
+            bulk = list(NastranDiff.read_file(f, "ENDDATA"))
+        self.assertEqual(stages["exec_diff"].lines, 2 * len(exec_lines))
+        self.assertEqual(stages["parse_bulk1"].lines, len(bulk))
+        self.assertEqual(stages["parse_bulk1"].bytes, sum(len(line) for line in bulk))
+        self.assertEqual(stages["parse_bulk1"].cards["GRID"], 7)
+        self.assertEqual(stages["compare"].info, dict(changed=1, added=0, deleted=0))
+        self.assertEqual(stages["render"].info, dict(changed=1))
+        self.assertEqual(stages["render"].lines, 1)
+        for s in stages.values():
+            self.assertGreaterEqual(s.wall_time, 0.)
+            self.assertGreaterEqual(s.cpu_time, 0.)
+
+    def test_read_decks(self):
+        serial = {s.name: s for s in self.diff()}
+        with tempfile.TemporaryDirectory() as d:
+            for kwargs in (dict(jobs=2), dict(jobs=2, memory_map=True)):
+                stages = {s.name: s for s in self.diff(**kwargs)}
+                self.assertIn("read_deck1", stages)
+                self.assertEqual(stages["read_deck2"].cards, serial["parse_bulk2"].cards)
+                self.assertEqual(stages["read_deck1"].lines, serial["exec_diff"].lines // 2 +
+                                 serial["case_diff"].lines // 2 + serial["parse_bulk1"].lines)
+
+            cache = DeckCache(d)
+            self.diff(cache=cache)
+            stages = {s.name: s for s in self.diff(cache=cache)}
+            self.assertEqual(stages["include_resolution"].info["files"], 3)
+            self.assertEqual(stages["cache_lookup"].info["hits"], 2)
+            self.assertNotIn("read_deck1", stages)
+
+    def test_write_json(self):
+        metrics = Metrics()
+        metrics.begin()
+        with metrics.stage("parse") as stage:
+            list(stage.count_lines(["GRID    1\n", "GRID    2\n"]))
+        metrics.end()
+        with tempfile.TemporaryDirectory() as d:
+            metrics.write_json(os.path.join(d, "metrics.json"), file1="a.bdf")
+            with open(os.path.join(d, "metrics.json")) as f:
+                result = json.load(f)
+        self.assertEqual(result["file1"], "a.bdf")
+        self.assertEqual(result["stages"][0]["name"], "parse")
+        self.assertEqual(result["stages"][0]["lines"], 2)
+        self.assertEqual(result["stages"][0]["bytes"], 20)
+        self.assertEqual(result["version"], 2)
+        self.assertIn("rss_growth", result["stages"][0])
+        self.assertIn("process_peak_rss", result)
+
+    @unittest.skipIf(current_rss() is None, "the resident set size isn't available")
+    def test_rss_growth(self):
+        metrics = Metrics()
+        with metrics.stage("allocate") as stage:
+            data = bytearray(64 * 1024 ** 2)
+            data[::4096] = b"x" * len(data[::4096])  # touch each page so that it's resident
+        with metrics.stage("free"):
+            del data
+        allocate, free = metrics.stages
+        self.assertGreater(allocate.rss_growth, 32 * 1024 ** 2)
+        self.assertLess(free.rss_growth, -32 * 1024 ** 2)
+        # the process peak is still the one reached in the allocate stage
+        self.assertGreaterEqual(free.process_peak_rss, allocate.process_peak_rss)
+
+    def test_timed(self):
+        def slow(n):
+            for i in range(n):
+                time.sleep(0.02)
+                yield i
+
+        metrics = Metrics()
+        with metrics.stage("outer") as outer:
+            inner = StageMetrics("inner")
+            outer.nested.append(inner)
+            for i in inner.timed(slow(3)):
+                time.sleep(0.02)  # the consumer's time isn't counted in inner
+        self.assertGreaterEqual(inner.wall_time, 0.05)
+        self.assertLess(inner.wall_time, 0.1)
+        self.assertGreaterEqual(outer.wall_time, 0.05)
+        self.assertLess(outer.wall_time, 0.1)
+
+    def test_disabled(self):
+        lines = ["GRID    1\n"]
+        self.assertIs(StageMetrics("x", enabled=False).count_lines(lines), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
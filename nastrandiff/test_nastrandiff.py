@@ -13,8 +13,18 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
 
+import contextlib
+import difflib
+import io
+import os
+import tempfile
 import unittest
-from nastrandiff import NastranDiff
+from unittest import mock
+
+import nastrandiff.tokenizer
+from nastrandiff import DeckError, NastranDiff
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "test-data")
 
 
 class TestNastranDiff(unittest.TestCase):
@@ -117,6 +127,196 @@ class TestNastranDiff(unittest.TestCase):
             self.strip_trailing_whitespace(res["GRID       2"]),
             self.strip_trailing_whitespace(expected_res))
 
+    def test_split_bulk_data(self):
+        nd = NastranDiff()
+
+        bd = ["GRID*                  2                             1.0            -2.0+",
+              "*                    3.0                             136",
+              "$ comment",
+              "RBE3     8000175         1050116  123456      1.     123 1000941 1000935+       ",
+              "+        1000942 1000936",
+              "GRID,3,,1.0,-2.0,3.0,,136"]
+        self.assertEqual([nd.is_card_start(l) for l in bd], [True, False, False, True, False, True])
+
+        chunks = nd.split_bulk_data(bd, 6)
+        self.assertEqual(sum(chunks, []), bd)
+        for c in chunks[1:]:
+            self.assertTrue(nd.is_card_start(c[0]))
+
+    def test_filter_bulk_lines(self):
+        nd = NastranDiff()
+
+        bd = ["GRID*                  2                             1.0            -2.0+",
+              "*                    3.0                             136",
+              "$ comment",
+              "RBE3     8000175         1050116  123456      1.     123 1000941 1000935+       ",
+              "+        1000942 1000936",
+              "grid,3,,1.0,-2.0,3.0,,136",
+              "MAT1     1       2.1+5           0.3     $ GRID,1"]
+        self.assertEqual(list(nd.filter_bulk_lines(bd, exclude_cards=["GRID"])), bd[3:5] + bd[6:])
+        self.assertEqual(list(nd.filter_bulk_lines(bd, include_cards={"grid", "MAT1"}, exclude_cards={"MAT1"})),
+                         bd[0:3] + bd[5:6])
+        self.assertEqual(list(nd.filter_bulk_lines(bd, include_cards=())), [])
+
+        # the lines that are filtered out aren't parsed
+        with mock.patch("nastrandiff.tokenizer.parse_fixed_field_format_line",
+                        wraps=nastrandiff.tokenizer.parse_fixed_field_format_line) as parse_line:
+            bulk = nd.parse_bulk_fields(bd, options=dict(include_cards={"RBE3"}))
+        self.assertEqual([card.name for card in bulk.values()], ["RBE3"])
+        self.assertEqual(parse_line.call_count, 2)
+
+    def test_filter_cards(self):
+        with tempfile.TemporaryDirectory() as d:
+            decks = []
+            for i, thickness in enumerate(("0.1", "0.2")):
+                decks.append(os.path.join(d, "deck{}.dat".format(i + 1)))
+                with open(decks[-1], "w") as f:
+                    f.write("SOL 101\nCEND\nBEGIN BULK\n")
+                    for j in range(1, 50):
+                        f.write("GRID*    {:<16}{:<16}{:<16}{:<16}+\n*       {:<16}\n".format(j, "", j + i, 0., 0.))
+                        f.write("CQUAD4   {:<8}1       {:<8}{:<8}{:<8}{:<8}\n".format(j, j, j + 1, j + 2, j + 3))
+                    f.write("PSHELL   1       1       {:<8}1\n".format(thickness))
+                    f.write("MAT1     1       2.1+5           0.3\n")
+                    f.write("ENDDATA\n")
+
+            def compare(**kwargs) -> list:
+                nd = NastranDiff()
+                for k, v in kwargs.items():
+                    setattr(nd, k, v)
+                with tempfile.TemporaryDirectory() as spill, open(decks[0]) as nd.file1, open(decks[1]) as nd.file2:
+                    for f in (nd.file1, nd.file2):
+                        for _ in nd.read_file(f, "BEGIN BULK"):
+                            pass
+                    bulk = (nd.read_file(nd.file1, "ENDDATA"), nd.read_file(nd.file2, "ENDDATA"))
+                    res = nd.compare_bulk(*bulk) if nd.memory_limit is None else nd.compare_bulk_external(*bulk, spill)
+                    return [sorted(entry.split()[0] for entry in r) for r in res]
+
+            self.assertEqual(compare(), [["GRID"] * 49 + ["PSHELL"]] * 2 + [[], []])
+            expected = [["PSHELL"], ["PSHELL"], [], []]
+            self.assertEqual(compare(include_cards={"PSHELL", "MAT1"}), expected)
+            self.assertEqual(compare(exclude_cards={"GRID"}), expected)
+            self.assertEqual(compare(exclude_cards={"GRID"}, memory_limit=10 ** 6), expected)
+
+            nd = NastranDiff()
+            nd.exclude_cards = {"GRID"}
+            nd.jobs = 2
+            nd.memory_map = True
+            deck = nd.read_mapped_deck(decks[0], nd.jobs, options=nd.parse_options())
+            self.assertEqual(sorted(card.name for card in deck[2].values()), ["CQUAD4"] * 49 + ["MAT1", "PSHELL"])
+
+    def test_parse_bulk_data_parallel(self):
+        nd = NastranDiff()
+
+        with open(os.path.join(TEST_DATA, "file1.dat")) as f:
+            bd = list(nd.read_file(f, "BEGIN BULK"))  # skip the executive and case control
+            bd = list(nd.read_file(f, "ENDDATA"))
+        bd += ["GRID     1               1.      0.      0.             123456"]  # duplicate key
+
+        serial_out = io.StringIO()
+        with contextlib.redirect_stdout(serial_out):
+            serial = nd.parse_bulk_data(bd)
+        parallel_out = io.StringIO()
+        with contextlib.redirect_stdout(parallel_out):
+            parallel = nd.parse_bulk_data(bd, jobs=2)
+
+        self.assertEqual(list(serial.items()), list(parallel.items()))
+        self.assertEqual(serial_out.getvalue(), parallel_out.getvalue())
+        self.assertIn("GRID       1", serial_out.getvalue())
+
+    @staticmethod
+    def diff_files(file1: str, file2: str, **kwargs) -> str:
+        nd = NastranDiff()
+        for k, v in kwargs.items():
+            setattr(nd, k, v)
+        nd.output = io.StringIO()
+        difflib.HtmlDiff._default_prefix = 0  # the anchors in the tables are numbered using a class-level counter
+        with open(file1) as nd.file1, open(file2) as nd.file2:
+            nd.calculate_diff()
+        return nd.output.getvalue()
+
+    def test_calculate_diff_concurrent(self):
+        file1 = os.path.join(TEST_DATA, "file1.dat")
+        file2 = os.path.join(TEST_DATA, "file2.dat")
+        self.assertEqual(self.diff_files(file1, file2), self.diff_files(file1, file2, jobs=2))
+
+        with tempfile.TemporaryDirectory() as d:
+            missing = os.path.join(d, "missing.dat")
+            with open(missing, "w") as f:
+                f.write("SOL 101\nCEND\nBEGIN BULK\nINCLUDE 'nothere.dat'\nENDDATA\n")
+            with self.assertRaises(DeckError) as cm:
+                self.diff_files(file1, missing, jobs=2)
+            self.assertEqual(cm.exception.file_name, missing)
+            self.assertIn("nothere.dat", str(cm.exception))
+
+    def test_write_table_bulk(self):
+        nd = NastranDiff()
+        nd.separators = True
+        diff1 = ["GRID    1       1.0     ", "MAT1    1       1.76E+06\n        1900.0  "]
+        diff2 = ["GRID    1       2.0     ", "MAT1    1       1.77E+06\n        1900.0  "]
+        unique1 = ["CROD    1       1       1       2       "]
+        unique2 = ["PROD    1       1       5.25    "]
+
+        rows = "".join(list(nd.generate_html_difference(diff1, diff2)) + list(nd.generate_html_subtractions(unique1)) +
+                       list(nd.generate_html_additions(unique2)))
+        header_row = '<thead><tr><th class="diff_header">a</th><th class="diff_header">b</th></tr></thead>'
+        expected = nd._table_template % dict(data_rows=rows, header_row=header_row)
+
+        output = io.StringIO()
+        nd.write_table_bulk(output, diff1, diff2, unique1, unique2, "a", "b")
+        self.assertEqual(output.getvalue(), expected)
+        self.assertEqual(nd.make_table_bulk(diff1, diff2, unique1, unique2, "a", "b"), expected)
+
+        # the rows are in the same order when the differences are in key order
+        differences = [(unique1[0], None), (diff1[0], diff2[0]), (diff1[1], diff2[1]), (None, unique2[0])]
+        output = io.StringIO()
+        counts = nd.write_table_differences(output, differences, "a", "b")
+        self.assertEqual(output.getvalue(), expected)
+        self.assertEqual(counts, dict(changed=2, deleted=1, added=1))
+
+    def test_incremental(self):
+        with tempfile.TemporaryDirectory() as d:
+            def write(name, lines):
+                with open(os.path.join(d, name), "w") as f:
+                    f.write("\n".join(lines) + "\n")
+
+            grids = ["GRID     {}               0.      0.      0.".format(i) for i in range(1, 5)]
+            write("deck1.dat", ["CEND", "BEGIN BULK", "INCLUDE 'mesh.dat'", "INCLUDE 'props1.dat'", "ENDDATA"])
+            write("deck2.dat", ["CEND", "BEGIN BULK", "INCLUDE 'mesh.dat'", "INCLUDE 'props2.dat'",
+                                "PSHELL   2       1       0.2", "ENDDATA"])
+            write("mesh.dat", grids + ["INCLUDE 'sub/elements.dat'"])
+            os.mkdir(os.path.join(d, "sub"))
+            write("sub/elements.dat", ["CROD     1       1       1       2"])
+            write("props1.dat", ["PROD     1       1       5.25", "PSHELL   2       1       0.1"])  # PSHELL moves
+            write("props2.dat", ["PROD     1       1       5.75"])
+
+            deck1 = os.path.join(d, "deck1.dat")
+            deck2 = os.path.join(d, "deck2.dat")
+            nd = NastranDiff()
+            with open(deck1) as nd.file1, open(deck2) as nd.file2:
+                skip1, skip2 = nd.plan_incremental()
+            self.assertEqual(skip1, {os.path.realpath(os.path.join(d, "mesh.dat")): 1})
+            self.assertEqual(skip1, skip2)
+
+            for incremental in (False, True):
+                nd.incremental = incremental
+                with open(deck1) as nd.file1, open(deck2) as nd.file2:
+                    skip1, skip2 = nd.plan_incremental() if incremental else (None, None)
+                    for _ in nd.read_file(nd.file1, "BEGIN BULK"):
+                        pass
+                    for _ in nd.read_file(nd.file2, "BEGIN BULK"):
+                        pass
+                    res = nd.compare_bulk(nd.read_file(nd.file1, "ENDDATA", skip1),
+                                          nd.read_file(nd.file2, "ENDDATA", skip2))
+                self.assertEqual([len(r) for r in res], [2, 2, 0, 0])
+
+            # identical files aren't parsed at all, so an entry that can't be parsed is never seen
+            write("sub/elements.dat", ["CROD     1.2.3   1       1       2"])
+            nd.incremental = True
+            nd.output = io.StringIO()
+            with open(deck1) as nd.file1, open(deck2) as nd.file2:
+                nd.calculate_diff()
+            self.assertIn("5.75", nd.output.getvalue())
+
     def test_format_bde(self):
         nd = NastranDiff()
 
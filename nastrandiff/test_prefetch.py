@@ -0,0 +1,131 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+import builtins
+import os
+import tempfile
+import unittest
+import unittest.mock
+from nastrandiff import NastranDiff
+from nastrandiff.prefetch import IncludePrefetcher, IncludeReader
+from nastrandiff.structured import _NumberedFile, read_located
+from nastrandiff.synthetic import SyntheticDecks
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name: str, lines: list) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    @staticmethod
+    def read(file_name: str, includes: IncludeReader, skip: dict = None, located: bool = False) -> list:
+        # Reads the sections of a deck, with the section that each line is in
+        lines = []
+        with open(file_name) as f:
+            if located:
+                f = _NumberedFile(f)
+            for break_at in ("CEND", "BEGIN BULK", "ENDDATA"):
+                if located:
+                    section = read_located(f, break_at, skip, includes)
+                else:
+                    section = NastranDiff.read_file(f, break_at, skip, includes)
+                lines.extend((break_at, line) for line in section)
+        return lines
+
+    def test_same_lines(self):
+        deck = SyntheticDecks(500, seed=2, depth=2, fanout=3).write(os.path.join(self.directory.name, "a"),
+                                                                   os.path.join(self.directory.name, "b"))[0]
+        expected = self.read(deck, IncludeReader())
+        self.assertGreater(len(expected), 500)
+        for threads in (1, 4):
+            with IncludePrefetcher(deck, threads) as includes:
+                self.assertEqual(self.read(deck, includes), expected)
+                self.assertEqual(includes.buffered, 0)
+        with IncludePrefetcher(deck, 2) as includes:
+            self.assertEqual(self.read(deck, includes, located=True), self.read(deck, IncludeReader(), located=True))
+
+    def test_large_files_streamed(self):
+        # files larger than each thread's share of max_buffered are read by the parser as it goes, with their includes
+        deck = SyntheticDecks(500, seed=2, depth=2, fanout=3).write(os.path.join(self.directory.name, "a"),
+                                                                   os.path.join(self.directory.name, "b"))[0]
+        expected = self.read(deck, IncludeReader())
+        with IncludePrefetcher(deck, 2, max_buffered=200) as includes:
+            lines = []
+            most = 0
+            with open(deck) as f:
+                for break_at in ("CEND", "BEGIN BULK", "ENDDATA"):
+                    for line in NastranDiff.read_file(f, break_at, includes=includes):
+                        lines.append((break_at, line))
+                        most = max(most, includes.buffered)
+            self.assertEqual(lines, expected)
+            self.assertLessEqual(most, 400)
+
+    def test_skip_and_breaks(self):
+        self.write("exec.dat", ["SOL 101", "CEND", "TITLE = IGNORED"])
+        self.write("mesh.dat", ["GRID     1               0.      0.      0.", "INCLUDE 'sub.dat'",
+                                "ENDDATA", "INCLUDE 'unread.dat'"])
+        self.write("sub.dat", ["GRID     2               0.      0.      0."])
+        self.write("props.dat", ["PROD     1       1       5.25"])
+        self.write("unread.dat", ["PROD     2       1       5.25"])
+        deck = self.write("deck.dat", ["INCLUDE 'exec.dat'", "CEND", "BEGIN BULK", "INCLUDE 'mesh.dat'",
+                                       "INCLUDE 'props.dat'", "INCLUDE 'mesh.dat'", "ENDDATA"])
+        for skip in (None, {os.path.realpath(os.path.join(self.directory.name, "mesh.dat")): 1}):
+            expected = self.read(deck, IncludeReader(), None if skip is None else dict(skip))
+            self.assertEqual(len(expected), 6 if skip is None else 4)
+
+            opened = []
+
+            def tracking_open(*args, **kwargs):
+                f = builtins.open(*args, **kwargs)
+                opened.append(f)
+                return f
+            with unittest.mock.patch("nastrandiff.compressed.open", tracking_open, create=True):
+                with IncludePrefetcher(deck, 2) as includes:
+                    self.assertEqual(self.read(deck, includes, None if skip is None else dict(skip)), expected)
+                    self.assertEqual(includes.buffered, 0)
+            self.assertGreater(len(opened), 0)
+            self.assertTrue(all(f.closed for f in opened))
+
+    def test_root_not_read_ahead(self):
+        # the root file is only read by the parser, so a deck without INCLUDEs is read once and nothing is buffered
+        deck = self.write("deck.dat", ["SOL 101", "CEND", "BEGIN BULK", "GRID     1               0.      0.      0.",
+                                       "ENDDATA"])
+        with unittest.mock.patch("nastrandiff.compressed.open") as mock_open:
+            with IncludePrefetcher(deck, 2) as includes:
+                self.assertEqual(len(self.read(deck, includes)), 2)
+                self.assertEqual(includes.buffered, 0)
+        mock_open.assert_not_called()
+
+    def test_cycle(self):
+        self.write("a.dat", ["GRID     1               0.      0.      0.", "INCLUDE 'b.dat'"])
+        self.write("b.dat", ["INCLUDE 'a.dat'"])
+        deck = self.write("deck.dat", ["CEND", "BEGIN BULK", "INCLUDE 'a.dat'", "ENDDATA"])
+        for includes in (IncludeReader(), IncludePrefetcher(deck, 2)):
+            with includes, self.assertRaisesRegex(ValueError, "INCLUDE cycle: .*a.dat -> .*b.dat -> .*a.dat"):
+                self.read(deck, includes)
+        with self.assertRaisesRegex(ValueError, "INCLUDE cycle"):
+            NastranDiff.include_tree(deck)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.report import PaginatedReport
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "test-data")
+
+
+class TestPaginatedReport(unittest.TestCase):
+    def test_pages(self):
+        nd = NastranDiff()
+        # in key order, as from bulk_differences
+        differences = [("CROD    1       1       1       2       ", None)] + \
+            [("GRID    {:<8}1.0     ".format(i), "GRID    {:<8}2.0     ".format(i)) for i in range(5)] + \
+            [(None, "GRID    9       1.0     "),
+             ("PROD    1       1       5.25    ", "PROD    1       1       5.5     ")]
+
+        with tempfile.TemporaryDirectory() as d:
+            report = PaginatedReport(nd, d, page_size=2)
+            index = report.write("<table>exec</table>", "<table>case</table>", iter(differences), "a.dat", "b.dat")
+            self.assertEqual(report.counts, dict(changed=6, deleted=1, added=1))
+            self.assertEqual(index, os.path.join(d, "index.html"))
+            self.assertEqual(sorted(os.listdir(d)),
+                             ["CROD-1.html", "GRID-1.html", "GRID-2.html", "GRID-3.html", "PROD-1.html",
+                              "control.html", "index.html"])
+            with open(index) as f:
+                html = f.read()
+            self.assertIn("<td>GRID</td><td class=\"diff_chg\">5</td><td class=\"diff_add\">1</td>", html)
+            with open(os.path.join(d, "GRID-3.html")) as f:
+                html = f.read()
+            self.assertIn("GRID-2.html", html)
+            self.assertIn("diff_chg", html)  # GRID 4 is changed
+            self.assertIn("diff_add", html)  # GRID 9 is added
+
+    def test_calculate_diff(self):
+        nd = NastranDiff()
+        with tempfile.TemporaryDirectory() as d:
+            nd.report_dir = d
+            with open(os.path.join(TEST_DATA, "file1.dat")) as nd.file1, \
+                    open(os.path.join(TEST_DATA, "file2.dat")) as nd.file2:
+                nd.calculate_diff()
+            self.assertEqual(sorted(os.listdir(d)), ["CROD-1.html", "control.html", "index.html"])
+
+
+if __name__ == '__main__':
+    unittest.main()
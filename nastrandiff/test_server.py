@@ -0,0 +1,187 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+import difflib
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from nastrandiff import DeckError, NastranDiff
+from nastrandiff.server import DeckLRU, DiffService, is_loopback, make_server, request, request_diff, server_address, \
+    tree_states
+from nastrandiff.snapshot import make_snapshot
+from nastrandiff.synthetic import SyntheticDecks
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.file1, self.file2 = SyntheticDecks(200, seed=3, changed_fraction=0.1, depth=2, fanout=2).write(
+            os.path.join(self.directory.name, "a"), os.path.join(self.directory.name, "b"))
+
+    @staticmethod
+    def local_diff(file1: str, file2: str, output_format: str = "html", **kwargs) -> str:
+        difflib.HtmlDiff._default_prefix = 0  # the anchors are numbered by the HtmlDiffs made so far
+        nd = NastranDiff()
+        for k, v in kwargs.items():
+            setattr(nd, k, v)
+        nd.output = io.StringIO()
+        nd.output_format = output_format
+        with open(file1) as nd.file1, open(file2) as nd.file2:
+            nd.calculate_diff()
+        return nd.output.getvalue()
+
+    def serve(self, address: str) -> str:
+        server = make_server(address, DiffService())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.addCleanup(stop)
+        return server_address(server)
+
+    def test_lru(self):
+        decks = DeckLRU()
+        loads = []
+
+        def load(file_name):
+            loads.append(file_name)
+            states = tree_states(file_name)
+            with open(file_name) as f:
+                deck = NastranDiff.read_deck(f)
+            return deck, states, 1000
+        deck = decks.get(self.file1, "deck", load)
+        self.assertIs(decks.get(self.file1, "deck", load), deck)
+        self.assertEqual((decks.hits, decks.misses, len(loads)), (1, 1, 1))
+
+        # a file that was saved without being changed is checked but not read again
+        include = tree_states(self.file1)[1][0]
+        os.utime(include, ns=(0, 0))
+        self.assertIs(decks.get(self.file1, "deck", load), deck)
+        self.assertEqual((decks.revalidations, len(loads)), (1, 1))
+
+        with open(include, "a") as f:
+            f.write("GRID    99999999        0.      0.      0.\n")
+        changed = decks.get(self.file1, "deck", load)
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(len(changed[2]), len(deck[2]) + 1)
+
+        decks.get(self.file2, "deck", load)
+        self.assertEqual(len(decks), 2)
+        decks.max_size = 1500
+        decks.get(self.file2, "other", load)
+        self.assertEqual((len(decks), decks.evictions), (1, 2))
+        decks.get(self.file1, "deck", load)
+        self.assertEqual(len(loads), 5)
+
+    def test_http(self):
+        address = self.serve("localhost:0")
+        expected = self.local_diff(self.file1, self.file2)
+        difflib.HtmlDiff._default_prefix = 0
+        self.assertEqual(request_diff(address, self.file1, self.file2), expected)
+        self.assertEqual(request_diff(address, self.file1, self.file2, format="jsonl"),
+                         self.local_diff(self.file1, self.file2, "jsonl"))
+        stats = json.loads(request(address, "GET", "/stats")[1])
+        self.assertEqual((stats["misses"], stats["hits"]), (stats["entries"], 0))
+        request_diff(address, self.file1, self.file2)
+        self.assertEqual(json.loads(request(address, "GET", "/stats")[1])["hits"], stats["entries"] // 2)
+
+        with self.assertRaisesRegex(RuntimeError, "missing.bdf"):
+            request_diff(address, self.file1, os.path.join(self.directory.name, "missing.bdf"))
+        with self.assertRaisesRegex(RuntimeError, "Unknown format"):
+            request_diff(address, self.file1, self.file2, format="pdf")
+        self.assertEqual(request(address, "GET", "/other")[0], 404)
+
+    def test_loopback(self):
+        self.assertTrue(is_loopback("localhost"))
+        self.assertTrue(is_loopback("127.0.0.1"))
+        self.assertFalse(is_loopback("0.0.0.0"))
+        with self.assertRaisesRegex(ValueError, "isn't a loopback address"):
+            make_server("0.0.0.0:0", DiffService())
+        server = make_server("0.0.0.0:0", DiffService(), allow_remote=True)
+        server.server_close()
+
+    def test_not_a_server(self):
+        # an answer that isn't from a diff server, such as an error page from a proxy
+        with mock.patch("nastrandiff.server.request", return_value=(502, "<html>Bad Gateway</html>")):
+            with self.assertRaisesRegex(DeckError, "502"):
+                request_diff("localhost:1", self.file1, self.file2)
+        with mock.patch("nastrandiff.server.request", return_value=(400, json.dumps(dict(error="Invalid")))):
+            with self.assertRaisesRegex(RuntimeError, "Invalid"):
+                request_diff("localhost:1", self.file1, self.file2)
+
+    def test_edit(self):
+        service = DiffService()
+        request = dict(file1=self.file1, file2=self.file2, format="jsonl")
+        service.diff(request)
+        misses = service.decks.misses
+
+        # only the edited file is read again
+        include = tree_states(self.file2)[-1][0]
+        with open(include, "a") as f:
+            f.write("GRID    99999999        0.      0.      0.\n")
+        self.assertEqual(service.diff(request)[1], self.local_diff(self.file1, self.file2, "jsonl"))
+        self.assertEqual(service.decks.misses, misses + 1)
+
+        # an entry continued in an included file can't be read one file at a time, so the whole deck is read
+        with open(include, "r+") as f:
+            lines = f.read()
+            f.seek(0)
+            f.write("        1.5\n" + lines)
+        self.assertEqual(service.diff(request)[1], self.local_diff(self.file1, self.file2, "jsonl"))
+        self.assertIn((os.path.realpath(self.file2), "located deck"), service.decks._entries)
+
+    def test_filter_cards(self):
+        service = DiffService()
+        for request in (dict(exclude_cards=["GRID"]), dict(include_cards=["GRID"])):
+            expected = self.local_diff(self.file1, self.file2, "jsonl", **{k: set(v) for k, v in request.items()})
+            request.update(file1=self.file1, file2=self.file2, format="jsonl")
+            self.assertEqual(service.diff(request)[1], expected)
+        card_types = set(json.loads(line).get("card_type") for line in expected.splitlines())
+        self.assertEqual(card_types - {None}, {"GRID"})
+        with self.assertRaisesRegex(ValueError, "card types"):
+            service.diff(dict(file1=self.file1, file2=self.file2, include_cards=[1]))
+
+    def test_snapshot(self):
+        service = DiffService()
+        snapshot = os.path.join(self.directory.name, "a.ndsnap")
+        make_snapshot(self.file1, snapshot)
+        for output_format in ("html", "jsonl"):
+            expected = self.local_diff(self.file1, self.file2, output_format)
+            difflib.HtmlDiff._default_prefix = 0
+            report = service.diff(dict(file1=snapshot, file2=self.file2, format=output_format))[1]
+            self.assertEqual(report.replace(snapshot, self.file1), expected)
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets aren't supported")
+    def test_unix_socket(self):
+        path = os.path.join(self.directory.name, "server.sock")
+        address = self.serve("unix:" + path)
+        self.assertEqual(address, "unix:" + path)
+        self.assertEqual(request_diff(address, self.file1, self.file2, format="csv"),
+                         self.local_diff(self.file1, self.file2, "csv"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import difflib
+import io
+import json
+import os
+import pickle
+import struct
+import tempfile
+import unittest
+from unittest import mock
+from nastrandiff import NastranDiff
+from nastrandiff.batch import BatchDiff
+from nastrandiff.columnar import ColumnarBulk
+from nastrandiff.snapshot import MAGIC, Snapshot, is_snapshot, make_snapshot, read_located_snapshot, read_snapshot
+from nastrandiff.structured import read_located_deck
+from nastrandiff.synthetic import SyntheticDecks
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.deck1, self.deck2 = SyntheticDecks(500, seed=6, changed_fraction=0.1).write(
+            os.path.join(self.directory, "1"), os.path.join(self.directory, "2"))
+        self.snapshot = os.path.join(self.directory, "1.ndsnap")
+        make_snapshot(self.deck1, self.snapshot)
+
+    def diff(self, file1: str, file2: str, output_format: str = "html", **kwargs) -> str:
+        difflib.HtmlDiff._default_prefix = 0  # the anchors are numbered by the HtmlDiffs made so far
+        nd = NastranDiff()
+        for k, v in kwargs.items():
+            setattr(nd, k, v)
+        nd.output_format = output_format
+        nd.output = io.StringIO()
+        with open(file1) as nd.file1, open(file2) as nd.file2:
+            nd.calculate_diff()
+        return nd.output.getvalue()
+
+    def test_read_snapshot(self):
+        self.assertTrue(is_snapshot(self.snapshot))
+        self.assertFalse(is_snapshot(self.deck1))
+        self.assertFalse(is_snapshot(None))
+
+        exec_lines, case_lines, bulk = read_snapshot(self.snapshot)
+        self.assertIsInstance(bulk, ColumnarBulk)
+        self.assertIsInstance(bulk.columns["GRID"].ids, memoryview)  # not copied from the mapped file
+        with open(self.deck1) as f:
+            expected = NastranDiff.read_deck(f, options=dict(columnar_types=bulk.columnar_types))
+        self.assertEqual((exec_lines, case_lines), expected[0:2])
+        self.assertEqual(bulk.columns, expected[2].columns)
+        self.assertEqual(bulk.generic, expected[2].generic)
+        nd = NastranDiff()
+        self.assertEqual(nd.compare_parsed_bulk(bulk, expected[2]), ([], [], [], []))
+
+        # compared with a deck parsed into a dict, or with other columnar types
+        with open(self.deck2) as f:
+            bulk2 = NastranDiff.read_deck(f)[2]
+        results = nd.compare_parsed_bulk(bulk, bulk2)
+        self.assertGreater(len(results[0]), 0)
+        with open(self.deck1) as f:
+            self.assertEqual(nd.compare_parsed_bulk(NastranDiff.read_deck(f)[2], bulk2), results)
+        with open(self.deck2) as f:
+            columnar2 = NastranDiff.read_deck(f, options=dict(columnar_types=frozenset(["GRID"])))[2]
+        self.assertEqual(nd.compare_parsed_bulk(columnar2, bulk), tuple(results[i] for i in (1, 0, 3, 2)))
+
+        # pickled (as for the cache and worker processes) as arrays
+        copy = pickle.loads(pickle.dumps(bulk))
+        self.assertEqual(copy.columns, bulk.columns)
+        self.assertNotIsInstance(copy.columns["GRID"].ids, memoryview)
+
+        filtered = read_snapshot(self.snapshot, dict(exclude_cards={"grid"}))[2]
+        self.assertNotIn("GRID", filtered.columns)
+        self.assertEqual(len(filtered), len(bulk) - len(bulk.columns["GRID"]))
+
+    def test_located(self):
+        with open(self.deck1) as f:
+            expected = read_located_deck(f)
+        with mock.patch("nastrandiff.snapshot.Snapshot.close", autospec=True, side_effect=Snapshot.close) as close:
+            self.assertEqual(read_located_snapshot(self.snapshot), expected)
+        close.assert_called_once()
+        self.assertTrue(close.call_args[0][0]._data.closed)
+        with Snapshot(self.snapshot) as snapshot:
+            self.assertEqual(snapshot.source, self.deck1)
+        self.assertTrue(snapshot._data.closed)
+
+    def test_close(self):
+        # the file stays mapped while the columns read from it are in use
+        with Snapshot(self.snapshot) as snapshot:
+            bulk = snapshot.bulk()
+        self.assertFalse(snapshot._data.closed)
+        self.assertGreater(len(bulk.columns["GRID"].entry(0).fields), 0)
+        del bulk
+        snapshot.close()
+        self.assertTrue(snapshot._data.closed)
+
+    def test_diff(self):
+        for output_format in ("html", "jsonl"):
+            expected = self.diff(self.deck1, self.deck2, output_format)
+            self.assertEqual(self.diff(self.snapshot, self.deck2, output_format).replace(self.snapshot, self.deck1),
+                             expected)
+            reverse = self.diff(self.deck2, self.deck1, output_format)
+            self.assertEqual(self.diff(self.deck2, self.snapshot, output_format).replace(self.snapshot, self.deck1),
+                             reverse)
+        self.assertEqual(self.diff(self.snapshot, self.snapshot), self.diff(self.deck1, self.deck1).replace(
+            self.deck1, self.snapshot))
+        self.assertEqual(self.diff(self.snapshot, self.deck2, memory_limit=1024, jobs=2).replace(
+            self.snapshot, self.deck1), self.diff(self.deck1, self.deck2))
+
+        nd = NastranDiff()
+        with open(self.snapshot) as nd.file1, open(self.deck1) as nd.file2:
+            self.assertTrue(nd.check().equivalent)
+        with open(self.snapshot) as nd.file1, open(self.deck2) as nd.file2:
+            self.assertEqual(nd.check().different_sections(), ["bulk"])
+
+    def test_batch(self):
+        nd = NastranDiff()
+        nd.progress = False
+        directory = os.path.join(self.directory, "batch")
+        results = BatchDiff(nd, self.snapshot, [self.deck2, self.deck1], directory).run()
+        self.assertEqual([r.error for r in results], [None, None])
+        self.assertGreater(len(results[0].cards), 0)
+        self.assertEqual(results[1].cards, {})
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, "isn't a snapshot"):
+            Snapshot(self.deck1)
+        with open(self.snapshot, "r+b") as f:
+            f.seek(len(MAGIC))
+            f.write(struct.pack("<I", 1000))
+        with self.assertRaisesRegex(ValueError, "version 1000"):
+            Snapshot(self.snapshot)
+
+        # the error opening the file is raised, rather than one from removing the temporary file that wasn't created
+        with self.assertRaises(FileNotFoundError) as cm:
+            make_snapshot(self.deck1, os.path.join(self.directory, "missing", "1.ndsnap"))
+        self.assertIsNone(cm.exception.__context__)
+
+    def test_generic_types(self):
+        # all of the GRIDs are stored in generic when one of them can't be stored in columns
+        lines = ["SOL 101", "CEND", "BEGIN BULK", "GRID    1               1.0     2.0     3.0",
+                 "{:<8}{:<16}{:<16}{:<16}".format("GRID*", 2, "", 9999999999999999),
+                 "CROD    1       1       1       2", "ENDDATA"]
+        deck = os.path.join(self.directory, "3.dat")
+        with open(deck, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        make_snapshot(deck, self.snapshot)
+        snapshot = Snapshot(self.snapshot)
+        self.assertEqual(snapshot.columnar_types, {"CROD"})
+        self.assertEqual(snapshot.generic_types, {"GRID"})
+        bulk = snapshot.bulk(dict(columnar_types=frozenset(["GRID", "CROD"])))
+        self.assertEqual(bulk.columnar_types, {"CROD"})
+        self.assertEqual(len(bulk.generic), 2)
+
+        # so the GRID is changed, rather than deleted and added, when compared with a deck storing GRIDs in columns
+        lines[4] = "GRID    2               1.0"
+        with open(deck, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        self.assertEqual(self.diff(self.snapshot, deck, "jsonl", columnar_types=frozenset(["GRID"])).count(
+            '"changed"'), 1)
+
+    def test_byteorder(self):
+        # a snapshot written on a machine with the other byte order is read by swapping the bytes of a copy
+        with open(self.snapshot, "rb") as f:
+            data = f.read()
+        header_size = struct.unpack_from("<Q", data, len(MAGIC) + 4)[0]
+        header = data[len(MAGIC) + 12:len(MAGIC) + 12 + header_size]
+        order = json.loads(header.decode())["byteorder"]
+        other = {"little": "big", "big": "little"}[order]
+        swapped = header.replace('"byteorder": "{}"'.format(order).encode(),
+                                 '"byteorder": "{}"'.format(other).encode().ljust(len('"byteorder": "little"')))
+        data = data[:len(MAGIC) + 12] + swapped + data[len(MAGIC) + 12 + header_size:]
+        with open(self.snapshot, "wb") as f:
+            f.write(data)
+        bulk = read_snapshot(self.snapshot)[2]
+        self.assertNotEqual(bulk.columns["GRID"].ids[0], 1)
+        self.assertNotIsInstance(bulk.columns["GRID"].ids, memoryview)
+
+
+if __name__ == '__main__':
+    unittest.main()
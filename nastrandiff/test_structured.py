@@ -0,0 +1,127 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.compare import Tolerances
+from nastrandiff.synthetic import SyntheticDecks
+
+DECK1 = """SOL 101
+CEND
+TITLE = ONE
+SUBCASE 1
+    LOAD = 1
+BEGIN BULK
+INCLUDE 'grids.bdf'
+CROD    1       1       1       2
+FORCE   10      5       0       1.0     1.0
+ENDDATA
+"""
+DECK2 = """SOL 101
+CEND
+TITLE = TWO
+SUBCASE 1
+    LOAD = 1
+BEGIN BULK
+CROD    1       1       1       3
+INCLUDE 'grids.bdf'
+FORCE   10      6       0       1.0     1.0
+ENDDATA
+"""
+GRIDS = """$ grids
+GRID    1               0.0     0.0     0.0
+GRID*   2                               1.0             0.0             *G2
+*G2     0.0
+"""
+
+
+class TestStructured(unittest.TestCase):
+    def diff(self, directory: str, output_format: str, **kwargs) -> str:
+        nd = NastranDiff()
+        for k, v in kwargs.items():
+            setattr(nd, k, v)
+        nd.output_format = output_format
+        nd.output = io.StringIO()
+        with open(os.path.join(directory, "1", "deck.bdf")) as nd.file1, \
+                open(os.path.join(directory, "2", "deck.bdf")) as nd.file2:
+            nd.calculate_diff()
+        return nd.output.getvalue()
+
+    def write_decks(self, d: str) -> None:
+        for name, deck in (("1", DECK1), ("2", DECK2)):
+            os.makedirs(os.path.join(d, name))
+            with open(os.path.join(d, name, "deck.bdf"), "w") as f:
+                f.write(deck)
+            with open(os.path.join(d, name, "grids.bdf"), "w") as f:
+                f.write(GRIDS)
+
+    def test_jsonl(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.write_decks(d)
+            records = [json.loads(line) for line in self.diff(d, "jsonl").splitlines()]
+        self.assertEqual([(r["section"], r["kind"]) for r in records],
+                         [("case", "changed"), ("bulk", "changed"), ("bulk", "deleted"), ("bulk", "added")])
+        self.assertEqual(records[0]["line1"], 3)
+        self.assertEqual(records[0]["fields"], [dict(field=None, before=["TITLE = ONE"], after=["TITLE = TWO"])])
+        crod = records[1]
+        self.assertEqual((crod["card_type"], crod["key"]), ("CROD", [1]))
+        self.assertEqual((os.path.basename(crod["file1"]), crod["line1"]), ("deck.bdf", 8))
+        self.assertEqual((os.path.basename(crod["file2"]), crod["line2"]), ("deck.bdf", 7))
+        self.assertEqual(crod["fields"], [dict(field=4, before=2, after=3)])
+        self.assertEqual((records[2]["key"], records[2]["file2"]), ([10, 5], None))
+        self.assertEqual(records[3]["key"], [10, 6])
+        self.assertEqual(records[3]["fields"][0], dict(field=1, before=None, after=10))
+
+    def test_csv(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.write_decks(d)
+            rows = list(csv.DictReader(io.StringIO(self.diff(d, "csv"))))
+        self.assertEqual(len(rows), 1 + 1 + 5 + 5)  # the deleted and added FORCEs have 5 fields each
+        self.assertEqual(rows[1]["key"], "1")
+        self.assertEqual((rows[1]["field"], rows[1]["before"], rows[1]["after"]), ("4", "2", "3"))
+        self.assertEqual(rows[2]["key"], "10 5")
+
+    def test_locations(self):
+        with tempfile.TemporaryDirectory() as d:
+            generator = SyntheticDecks(300, seed=5, changed_fraction=0.2)
+            generator.write(os.path.join(d, "1"), os.path.join(d, "2"))
+            records = [json.loads(line) for line in self.diff(d, "jsonl").splitlines()]
+            self.assertEqual(len(records), generator.n_changed)
+            for r in records:
+                with open(r["file1"]) as f:
+                    line = f.readlines()[r["line1"] - 1]
+                self.assertTrue(line.startswith(r["card_type"]))
+                self.assertGreater(len(r["fields"]), 0)
+            loose = self.diff(d, "jsonl", tolerances=Tolerances(rel_tol=0.5, abs_tol=1000.))
+            self.assertLess(len(loose.splitlines()), len(records))
+
+    def test_filter_cards(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.write_decks(d)
+            records = [json.loads(line) for line in self.diff(d, "jsonl", include_cards={"FORCE"}).splitlines()]
+        self.assertEqual([(r["section"], r["kind"]) for r in records],
+                         [("case", "changed"), ("bulk", "deleted"), ("bulk", "added")])
+        self.assertEqual((records[1]["card_type"], records[1]["line1"]), ("FORCE", 9))
+        self.assertEqual((records[2]["card_type"], records[2]["line2"]), ("FORCE", 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
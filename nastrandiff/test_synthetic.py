@@ -0,0 +1,61 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import filecmp
+import os
+import tempfile
+import unittest
+from nastrandiff import NastranDiff
+from nastrandiff.synthetic import SyntheticDecks, format_card
+
+
+class TestSynthetic(unittest.TestCase):
+    def test_format_card(self):
+        fields = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+        for fmt in ("small", "large", "free"):
+            text = format_card("CHEXA", fields, fmt)
+            self.assertGreater(text.count("\n"), 1)
+            cards = list(NastranDiff.generate_bulk_cards(text.splitlines()))
+            self.assertEqual(len(cards), 1)
+            self.assertEqual(cards[0].fields[:len(fields)], tuple(fields))
+            self.assertTrue(all(f == "" for f in cards[0].fields[len(fields):]))
+        text = format_card("GRID", [1, "", 1.5, -2.25, 3.0], "large")
+        self.assertEqual(NastranDiff.parse_bulk_fields(text.splitlines()).popitem()[1].fields,
+                         (1, "", 1.5, -2.25, 3.0, "", "", ""))
+
+    def test_decks(self):
+        with tempfile.TemporaryDirectory() as d:
+            generator = SyntheticDecks(500, seed=3, changed_fraction=0.1, depth=2, fanout=2)
+            decks = generator.write(os.path.join(d, "1"), os.path.join(d, "2"))
+            again = SyntheticDecks(500, seed=3, changed_fraction=0.1, depth=2, fanout=2)
+            again.write(os.path.join(d, "3"), os.path.join(d, "4"))
+            self.assertEqual(filecmp.dircmp(os.path.join(d, "1"), os.path.join(d, "3")).diff_files, [])
+            self.assertEqual(sorted(os.listdir(os.path.join(d, "1"))),
+                             ["deck.bdf", "mesh.bdf", "mesh_0.bdf", "mesh_1.bdf"])
+
+            nd = NastranDiff()
+            bulk = []
+            for deck in decks:
+                with open(deck) as f:
+                    bulk.append(NastranDiff.read_deck(f)[2])
+            self.assertEqual(len(bulk[0]), 501)  # and the PARAM in the root file
+            self.assertGreater(generator.n_changed, 0)
+            self.assertEqual([len(r) for r in nd.compare_parsed_bulk(*bulk)],
+                             [generator.n_changed, generator.n_changed, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
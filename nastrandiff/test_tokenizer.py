@@ -0,0 +1,71 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+from unittest import mock
+from nastrandiff import tokenizer
+
+LINES = ["GRID    1       5       1.0     2.0     3.0-1   0       123456",
+         "CQUAD4  10      1       1       2       3       4               .5+1    +C1",
+         "GRID*                  2                             1.0            -2.0+",
+         "*                    3.0                             136",
+         "PARAM   POST    0       $ a comment"]
+
+
+class TestTokenizer(unittest.TestCase):
+    def test_parse_field(self):
+        for field, expected in (("7.0", 7.0), (".7E1", 7.0), ("0.7+1", 7.0), (".70+1", 7.0), ("7.E+0", 7.0),
+                                ("70.-1", 7.0), ("800", 800), ("TEST    ", "TEST"),
+                                ("2.193363961D+06", 2.193363961E+06), ("   -12  ", -12), ("+3", 3), ("-.5-2", -0.005),
+                                ("", ""), ("        ", ""), ("THRU", "THRU")):
+            res = tokenizer.parse_field(field)
+            self.assertEqual(res, expected)
+            self.assertIs(type(res), type(expected))
+        self.assertRaises(ValueError, tokenizer.parse_field, "1-2")
+
+    def test_parse_line(self):
+        name, fields, continuation = tokenizer.parse_line(LINES[0])
+        self.assertEqual(name, "GRID")
+        self.assertEqual(fields, [1, 5, 1.0, 2.0, 0.3, 0, 123456, ""])
+        self.assertFalse(continuation)
+        self.assertEqual(tokenizer.parse_line(LINES[1])[1][7], 5.0)  # the continuation field isn't read
+        self.assertEqual(tokenizer.parse_line(LINES[2]), ("GRID", [2, "", 1.0, -2.0], False))
+        self.assertEqual(tokenizer.parse_line(LINES[3]), ("", [3.0, "", 136, ""], True))
+        self.assertEqual(tokenizer.parse_line(LINES[4])[1], ["POST", 0, "", "", "", "", "", ""])
+        self.assertEqual(tokenizer.parse_line("GRID*,2,,1.0,-2.0"), ("GRID", [2, "", 1.0, -2.0], False))
+        self.assertEqual(tokenizer.parse_line("+,1,2"), ("+", [1, 2], True))
+
+    def test_parse_fixed_field_lines(self):
+        self.assertEqual(tokenizer.parse_fixed_field_lines([LINES[0], LINES[1], LINES[4]]),
+                         [tokenizer.parse_line(line)[1] for line in (LINES[0], LINES[1], LINES[4])])
+        self.assertEqual(tokenizer.parse_fixed_field_lines(LINES[2:4], 16),
+                         [tokenizer.parse_line(line)[1] for line in LINES[2:4]])
+
+    def test_parse_lines(self):
+        lines = [LINES[0], LINES[0].replace("1", "2", 1), "GRID,3,,1.0", LINES[0]] + LINES[1:] + \
+            ["        1       2", "        3"]
+        with mock.patch("nastrandiff.tokenizer._RUN_SIZE", 1):
+            self.assertEqual(list(tokenizer.parse_lines(lines)), [tokenizer.parse_line(line) for line in lines])
+        self.assertEqual(list(tokenizer.parse_lines(lines)), [tokenizer.parse_line(line) for line in lines])
+        with mock.patch("nastrandiff.tokenizer.parse_fixed_field_lines",
+                        wraps=tokenizer.parse_fixed_field_lines) as parse_fixed_field_lines:
+            list(tokenizer.parse_lines(lines))
+        self.assertEqual([c[0] for c in parse_fixed_field_lines.call_args_list],
+                         [(lines[0:2], 8), (lines[-2:], 8)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# This file is part of NASTRAN-Diff.
+#
+# NASTRAN-Diff is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+#  NASTRAN-Diff is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Splits lines of bulk data into fields and parses the fields. These functions are called for every field of a deck, so
+they avoid work per field: fields that have been seen before are looked up rather than parsed again, the patterns are
+compiled once, the type of a field is decided by a lookup on its first character and the positions of the fields of
+fixed-field format lines are computed in advance.
+"""
+
+import re
+import typing
+
+# NASTRAN allows the "E" to be left out of the exponent of a real (e.g. "7.0+1"). MSC also uses "D" in place of "E".
+_exponent_regex = re.compile("([.0-9])([-+])([0-9])")
+
+# The number of lines of a run parsed at once by parse_lines
+_RUN_SIZE = 1024
+
+# The (start, end) of each field of a fixed-field format line with 8 and 16 character fields. The continuation field
+# (from column 73) is not read.
+_fixed_field_slices = {width: tuple((i, i + width) for i in range(8, 72, width)) for width in (8, 16)}
+
+
+def _parse_character(field: str) -> str:
+    return field
+
+
+def _parse_number(field: str) -> typing.Union[int, float]:
+    if "." in field:  # it's real (reals must contain a decimal point per NASTRAN docs)
+        try:
+            return float(field)
+        except ValueError:
+            # the exponent is in one of the forms that Python doesn't accept
+            return float(_exponent_regex.sub("\\1E\\2\\3", field.replace("D", "E")))
+    return int(field)
+
+
+# The function parsing a field, by its first character. Fields starting with any other character are character fields.
+_field_parsers = dict.fromkeys("-+.0123456789", _parse_number)
+
+
+# The values of the fields parsed so far, by the text of the field (including any whitespace). Decks repeat the same
+# field many times (blank fields, property and material IDs, coordinate systems, common reals), so most fields are
+# found here. The values are immutable, so they are shared by all of the entries with that field.
+_field_cache = {}
+_FIELD_CACHE_SIZE = 1 << 16
+
+
+def _parse_new_field(field: str) -> typing.Union[int, float, str]:
+    # Parses a field that isn't in _field_cache, and adds it
+    value = field.strip()
+    if len(value) > 0:
+        value = _field_parsers.get(value[0], _parse_character)(value)
+    if len(_field_cache) >= _FIELD_CACHE_SIZE:
+        _field_cache.clear()
+    _field_cache[field] = value
+    return value
+
+
+def parse_field(field: str) -> typing.Union[int, float, str]:
+    """
+    Parses a field as an integer or real if it starts with a sign, a decimal point or a digit, and as a character
+    field otherwise. Leading and trailing whitespace is removed; a blank field is an empty string.
+    """
+    value = _field_cache.get(field)
+    if value is None:
+        value = _parse_new_field(field)
+    return value
+
+
+def _name(name: str) -> (str, int):
+    # Returns the BDE name without the asterisk that indicates large fields, and the width of the fields
+    i = name.find("*")
+    if i >= 0:
+        return name[0:i].strip(), 16
+    return name.strip(), 8
+
+
+def parse_fixed_field_format_line(line: str) -> (str, list, bool):
+    """
+    Parses a line in fixed-field format, returning the BDE name, the fields and whether the line is a continuation
+    """
+    bde_name, field_width = _name(line[0:8])
+    if "$" in line:
+        line = line[0:line.find("$")]  # remove the comment, if one exists
+    fields = []
+    for start, end in _fixed_field_slices[field_width]:
+        field = line[start:end]
+        value = _field_cache.get(field)
+        fields.append(_parse_new_field(field) if value is None else value)
+    return bde_name, fields, len(bde_name) == 0 or "+" in bde_name
+
+
+def parse_free_field_format_line(line: str) -> (str, list, bool):
+    """
+    Parses a line in free-field format, returning the BDE name, the fields and whether the line is a continuation
+    """
+    split_line = line.split(",")
+    bde_name = _name(split_line[0])[0]
+    fields = [parse_field(f) for f in split_line[1:]]
+    return bde_name, fields, len(bde_name) == 0 or "+" in bde_name
+
+
+def parse_line(line: str) -> (str, list, bool):
+    """
+    Parses a line of bulk data (with comments and trailing whitespace removed) in either format
+    """
+    if "," in line:
+        return parse_free_field_format_line(line)
+    return parse_fixed_field_format_line(line)
+
+
+def parse_fixed_field_lines(lines: list, field_width: int = 8) -> list:
+    """
+    Parses many lines in fixed-field format with the same field width (for example, the lines of one card type) at
+    once, returning a list of the fields of each line. The BDE name and the continuation field are not returned. This
+    does less work per line than calling parse_fixed_field_format_line for each line.
+    """
+    slices = _fixed_field_slices[field_width]
+    get = _field_cache.get
+    result = []
+    for line in lines:
+        if "$" in line:
+            line = line[0:line.find("$")]
+        fields = []
+        for start, end in slices:
+            field = line[start:end]
+            value = get(field)
+            fields.append(_parse_new_field(field) if value is None else value)
+        result.append(fields)
+    return result
+
+
+def _parse_run(name_field: str, run: list) -> (str, list, bool):
+    # Yields the same as parse_line for each of a run of lines in fixed-field format starting with name_field
+    if len(run) == 1:
+        yield parse_fixed_field_format_line(run[0])
+        return
+    bde_name, field_width = _name(name_field)
+    continuation = len(bde_name) == 0 or "+" in bde_name
+    for fields in parse_fixed_field_lines(run, field_width):
+        yield bde_name, fields, continuation
+
+
+def parse_lines(lines: iter) -> (str, list, bool):
+    """
+    Parses lines of bulk data (with comments and trailing whitespace removed) in either format, yielding the same as
+    parse_line for each line. Consecutive lines in fixed-field format with the same first field (such as the GRIDs of
+    a mesh, or their continuation lines) have the same BDE name and field width, so they're parsed together by
+    parse_fixed_field_lines.
+    """
+    run = []
+    name_field = None
+    for line in lines:
+        if "," in line:
+            if run:
+                yield from _parse_run(name_field, run)
+                run = []
+            yield parse_free_field_format_line(line)
+            continue
+        if line[0:8] != name_field or len(run) == _RUN_SIZE:
+            if run:
+                yield from _parse_run(name_field, run)
+                run = []
+            name_field = line[0:8]
+        run.append(line)
+    if run:
+        yield from _parse_run(name_field, run)